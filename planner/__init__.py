@@ -5,3 +5,5 @@
 __version__ = '2022.12.9'
 
 from .core import Plan, create_plan
+from .control import Stop, Skip, Branch, branch
+from .registry import register_plan, get_plan, warm_up
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""batch - 合并并发执行中对同一个action的调用
+
+注册时给定batch选项的action 在编译时包装为合并调用的目标:
+
+    >>> Plan.register(get_user, batch=get_users, batch_size=64, batch_wait=0.002)
+
+并发到达此action的调用在batch_wait秒内(或者凑满batch_size个时)合并为一次 batch([item, ...])
+batch返回与输入等长的序列 每个调用得到自己对应的结果; 某一项为异常对象时只有此调用抛出。
+
+#. item: action只得到一个位置参数时为此参数 只得到关键字参数时为参数字典(不包括result_mapper/action_mapper)
+   否则为(args, kwargs)
+#. 注册的action本身不被调用 只用于确定参数形式
+#. 合并属于action本身: 所有线程、所有Plan中的调用一起合并
+#. 同步调用: 第一个到达的调用等待并运行batch 凑满时由最后到达的调用运行 其余调用等待结果
+#. 协程action: 在同一个事件循环中合并 batch可以是协程函数 否则在线程池中运行
+#. 同时给定concurrency/rate时 限制作用于合并后的batch调用
+
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from functools import wraps
+from inspect import iscoroutine, iscoroutinefunction
+from typing import Any, Callable, Dict, List, Optional
+from weakref import WeakKeyDictionary
+
+DEFAULT_SIZE = 64
+"""默认的最大合并数量"""
+DEFAULT_WAIT = 0.002
+"""默认的最长等待时间(秒)"""
+
+_IGNORED_KEYWORDS = ('result_mapper', 'action_mapper')
+
+_batchers: WeakKeyDictionary = WeakKeyDictionary()
+"""{action: Batcher} 重新编译后仍然保留"""
+_lock = threading.Lock()
+
+
+def make_item(args: tuple, kwargs: dict) -> Any:
+    """一次调用对应的item"""
+    if kwargs:
+        kwargs = {k: v for k, v in kwargs.items() if k not in _IGNORED_KEYWORDS}
+
+    if not kwargs:
+        if len(args) == 1:
+            return args[0]
+        if not args:
+            return None
+    elif not args:
+        return kwargs
+
+    return args, kwargs
+
+
+class Batch(object):
+    """一次合并的调用
+
+    同步调用以done(threading.Event)等待; 协程以future(asyncio.Future)等待
+    """
+
+    __slots__ = ('items', 'results', 'error', 'done', 'taken', 'future', 'handle')
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.items: List[Any] = []
+        self.results = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event() if loop is None else None
+        self.taken = threading.Event() if loop is None else None
+        """已由某个调用取走运行"""
+        self.future = loop.create_future() if loop is not None else None
+        self.handle = None
+        """协程: 等待超时后运行的定时器"""
+
+
+class Batcher(object):
+    """合并调用的设置与状态
+
+    Args:
+        name: action名称
+        batch: 以item列表为参数 返回等长结果序列的函数
+        size: 最多合并的调用数量
+        wait: 第一个调用最长等待的时间(秒)
+    """
+
+    def __init__(self, name: str, batch: Callable[[List[Any]], Any], size: int = DEFAULT_SIZE,
+                 wait: float = DEFAULT_WAIT):
+        if size < 1:
+            raise ValueError(f'batch_size must be at least 1, got {size}.')
+        if wait < 0:
+            raise ValueError(f'batch_wait must not be negative, got {wait}.')
+
+        self.name = name
+        self.batch = batch
+        self.call = batch
+        """实际调用的batch: 可能被并发/速率限制包装"""
+        self.size = size
+        self.wait = wait
+
+        self.calls = 0
+        """合并前的调用次数"""
+        self.batches = 0
+        """batch的调用次数"""
+        self.full = 0
+        """凑满batch_size的次数"""
+        self.largest = 0
+
+        self._pending: Optional[Batch] = None
+        self._pending_async: Dict[asyncio.AbstractEventLoop, Batch] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<Batcher {self.name} size={self.size} wait={self.wait}>'
+
+    @classmethod
+    def from_options(cls, action, name: str, options: dict) -> Optional[Batcher]:
+        """由action选项获取共用的Batcher 没有batch选项时返回None"""
+        batch = options.get('batch')
+        if batch is None:
+            return None
+
+        if not callable(batch):
+            raise TypeError(f'batch of {name} must be callable, got {batch!r}.')
+
+        size, wait = options.get('batch_size', DEFAULT_SIZE), options.get('batch_wait', DEFAULT_WAIT)
+
+        with _lock:
+            try:
+                batcher = _batchers.get(action)
+            except TypeError:
+                return cls(name, batch, size, wait)
+
+            if batcher is None:
+                batcher = _batchers[action] = cls(name, batch, size, wait)
+            elif (batcher.batch, batcher.size, batcher.wait) != (batch, size, wait):
+                raise ValueError(f'{name} is already batched with {batcher.batch!r}, size={batcher.size}, '
+                                 f'wait={batcher.wait}.')
+
+        return batcher
+
+    def limit(self, limiter) -> None:
+        """并发/速率限制作用于batch调用"""
+        self.call = limiter.wrap_async(self.batch) if iscoroutinefunction(self.batch) else limiter.wrap(self.batch)
+
+    def _close(self, batch: Batch) -> None:
+        """batch不再接收新的调用 调用时持有锁"""
+        self.batches += 1
+        self.full += len(batch.items) >= self.size
+        self.largest = max(self.largest, len(batch.items))
+
+    def _check(self, batch: Batch, results) -> list:
+        results = list(results)
+        if len(results) != len(batch.items):
+            raise ValueError(f'batch of {self.name} returned {len(results)} results for {len(batch.items)} items.')
+        return results
+
+    def _run(self, batch: Batch) -> None:
+        """在当前线程运行batch 唤醒等待的调用"""
+        try:
+            results = self.call(batch.items)
+            if iscoroutine(results):
+                results = asyncio.run(results)
+            batch.results = self._check(batch, results)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def submit(self, item: Any) -> Any:
+        """同步调用: 加入当前的batch 返回对应的结果"""
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = Batch()
+
+            index = len(batch.items)
+            batch.items.append(item)
+            self.calls += 1
+
+            run = len(batch.items) >= self.size
+            if run:
+                self._pending = None
+                self._close(batch)
+
+        if run:
+            batch.taken.set()
+            self._run(batch)
+        elif leader:
+            batch.taken.wait(self.wait)
+            with self._lock:
+                run = self._pending is batch
+                if run:
+                    self._pending = None
+                    self._close(batch)
+            if run:
+                self._run(batch)
+
+        batch.done.wait()
+        return self._result(batch, index)
+
+    def _result(self, batch: Batch, index: int) -> Any:
+        if batch.error is not None:
+            raise batch.error
+
+        result = batch.results[index]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def _run_async(self, batch: Batch) -> None:
+        try:
+            if iscoroutinefunction(self.batch):
+                results = await self.call(batch.items)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.call, batch.items)
+            batch.results = self._check(batch, results)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.future.set_result(None)
+
+    def _flush_async(self, loop: asyncio.AbstractEventLoop, batch: Batch) -> None:
+        """协程: 超时或者凑满时运行batch"""
+        with self._lock:
+            if self._pending_async.get(loop) is not batch:
+                return
+            del self._pending_async[loop]
+            self._close(batch)
+
+        if batch.handle is not None:
+            batch.handle.cancel()
+        loop.create_task(self._run_async(batch))
+
+    async def submit_async(self, item: Any) -> Any:
+        """协程调用: 加入当前事件循环的batch 返回对应的结果"""
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            batch = self._pending_async.get(loop)
+            if batch is None:
+                batch = self._pending_async[loop] = Batch(loop)
+                batch.handle = loop.call_later(self.wait, self._flush_async, loop, batch)
+
+            index = len(batch.items)
+            batch.items.append(item)
+            self.calls += 1
+
+        if len(batch.items) >= self.size:
+            self._flush_async(loop, batch)
+
+        # 取消的调用不影响同一batch中的其他调用
+        await asyncio.shield(batch.future)
+        return self._result(batch, index)
+
+    def wrap(self, target: Callable) -> Callable:
+        """包装同步的调用目标"""
+
+        @wraps(target)
+        def batched(*args, **kwargs):
+            return self.submit(make_item(args, kwargs))
+
+        return batched
+
+    def wrap_async(self, target: Callable) -> Callable:
+        """包装需要await的调用目标"""
+
+        @wraps(target)
+        async def batched(*args, **kwargs):
+            return await self.submit_async(make_item(args, kwargs))
+
+        return batched
+
+    def snapshot(self) -> Dict[str, float]:
+        """{calls, batches, full, largest, mean_size}"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'batches': self.batches,
+                'full': self.full,
+                'largest': self.largest,
+                'mean_size': self.calls / self.batches if self.batches else 0.0,
+            }
+
+
+def get_batcher(action) -> Optional[Batcher]:
+    """action对应的Batcher"""
+    try:
+        return _batchers.get(action)
+    except TypeError:
+        return None
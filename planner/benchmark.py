@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""benchmark - 执行引擎的基准测试
+
+#. 每种调用方式的单个action开销(与直接调用函数相比)
+#. Plan长度与嵌套深度对耗时的影响
+#. 不定参数action的参数构造开销
+#. 异常路径的开销
+#. 多线程运行同一个Plan的吞吐量
+
+结果以JSON输出 比较两次结果时超过阈值的变慢视为回归:
+
+    python -m planner.benchmark run -o base.json
+    python -m planner.benchmark run -o new.json
+    python -m planner.benchmark compare base.json new.json --threshold 0.1
+
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from planner import __version__, create_plan
+from planner.error import PlanException
+
+Benchmark = Callable[[], Callable[[], None]]
+"""基准: 准备工作后返回被测量的函数"""
+
+
+def measure(function: Callable[[], None], operations: int = 1, repeat: int = 5, min_time: float = 0.05) -> dict:
+    """测量单次操作的耗时(纳秒)
+
+    Args:
+        function: 被测量的函数
+        operations: 每次调用包含的操作数
+        repeat: 重复测量的次数 取中位数
+        min_time: 每次测量的最短时间(秒)
+    """
+    # 确定每次测量的调用次数
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter_ns() - start
+
+        if elapsed >= min_time * 1e9:
+            break
+        number *= 2
+
+    samples = [elapsed / (number * operations)]
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter_ns() - start) / (number * operations))
+
+    return {'ns': statistics.median(samples), 'min_ns': min(samples), 'runs': number * repeat}
+
+
+def one_argument(x):
+    return x
+
+
+def no_argument():
+    return 1
+
+
+def keyword_argument(**kwargs):
+    return kwargs['result']
+
+
+def failed_action(x):
+    raise ValueError(x)
+
+
+def bench_dispatch(length: int) -> Dict[str, Benchmark]:
+    """每种调用方式的单个action开销: 以length个action的Plan运行 按action平均"""
+    benchmarks = {}
+
+    def raw():
+        def run():
+            for _ in range(length):
+                one_argument(1)
+        return run
+
+    benchmarks['dispatch.raw_call'] = raw
+
+    cases = {
+        'no_argument': lambda: no_argument,
+        'positional': lambda: one_argument,
+        'var_keyword': lambda: keyword_argument,
+        'nested_plan': lambda: create_plan(actions=[keyword_argument]),
+    }
+
+    for kind, factory in cases.items():
+        def execute(factory=factory):
+            plan = create_plan(actions=[factory() for _ in range(length)])
+            return lambda: plan.execute(result=1)
+
+        def single(factory=factory):
+            plan = create_plan(actions=[factory()])
+            action = plan.actions[0]
+            spec = plan.compile()[0]
+            return lambda: plan.execute_single_actions(action, 1, {'result': 1}, spec)
+
+        benchmarks[f'dispatch.execute.{kind}'] = execute
+        benchmarks[f'dispatch.single.{kind}'] = single
+
+    return benchmarks
+
+
+def bench_length(lengths: Iterable[int]) -> Dict[str, Benchmark]:
+    """Plan长度"""
+    def factory(length):
+        plan = create_plan(actions=[one_argument] * length)
+        return lambda: plan.execute()
+
+    return {f'length.{length}': (lambda length=length: factory(length)) for length in lengths}
+
+
+def bench_depth(depths: Iterable[int]) -> Dict[str, Benchmark]:
+    """嵌套深度: 每层一个action与一个内层Plan"""
+    def factory(depth):
+        plan = create_plan(actions=[keyword_argument])
+        for _ in range(depth - 1):
+            plan = create_plan(actions=[keyword_argument, plan])
+        return lambda: plan.execute(result=1)
+
+    return {f'depth.{depth}': (lambda depth=depth: factory(depth)) for depth in depths}
+
+
+def bench_keyword(sizes: Iterable[int], length: int) -> Dict[str, Benchmark]:
+    """不定参数action的参数构造: 执行参数的数量"""
+    def factory(size):
+        plan = create_plan(actions=[keyword_argument] * length)
+        parameter = {f'p{_}': _ for _ in range(size)}
+        return lambda: plan.execute(result=1, **parameter)
+
+    return {f'keyword.{size}_parameters': (lambda size=size: factory(size)) for size in sizes}
+
+
+def bench_error(length: int) -> Dict[str, Benchmark]:
+    """异常路径: 三层嵌套的Plan在最后一个action出错"""
+    def factory(format_message):
+        plan = create_plan(actions=[one_argument] * length + [failed_action])
+        for _ in range(2):
+            plan = create_plan(actions=[keyword_argument] * length + [plan])
+
+        def run():
+            try:
+                plan.execute(result=1)
+            except PlanException as e:
+                if format_message:
+                    str(e)
+
+        return run
+
+    return {
+        'error.catch': lambda: factory(False),
+        'error.format': lambda: factory(True),
+    }
+
+
+def bench_threads(threads: Iterable[int], executions: int, length: int) -> Dict[str, Benchmark]:
+    """多线程运行同一个Plan: 按执行次数平均的耗时(吞吐量的倒数)"""
+    def factory(count):
+        plan = create_plan(actions=[keyword_argument] * length)
+
+        def worker():
+            for _ in range(executions):
+                plan.execute(result=1)
+
+        def run():
+            workers = [threading.Thread(target=worker) for _ in range(count)]
+            for _ in workers:
+                _.start()
+            for _ in workers:
+                _.join()
+
+        return run
+
+    return {f'threads.{count}': (lambda count=count: factory(count)) for count in threads}
+
+
+def collect(quick: bool = False) -> Dict[str, tuple]:
+    """全部基准: {名称: (准备函数, 每次调用包含的操作数)}"""
+    length = 20 if quick else 100
+    executions = 20 if quick else 200
+
+    # 按Plan运行的基准按action平均
+    benchmarks = {k: (v, 1 if '.single.' in k else length) for k, v in bench_dispatch(length).items()}
+    benchmarks.update({k: (v, 1) for k, v in bench_length((1, 10, 100) if quick else (1, 10, 100, 1000)).items()})
+    benchmarks.update({k: (v, 1) for k, v in bench_depth((1, 4, 16) if quick else (1, 4, 16, 64)).items()})
+    benchmarks.update({k: (v, 1) for k, v in bench_keyword((0, 10, 100), length).items()})
+    benchmarks.update({k: (v, 1) for k, v in bench_error(10).items()})
+    benchmarks.update({k: (v, executions * int(k.split('.')[1]))
+                       for k, v in bench_threads((1, 2, 4, 8), executions, length).items()})
+
+    return benchmarks
+
+
+def run_benchmarks(pattern: Optional[str] = None, quick: bool = False, repeat: int = 5,
+                   min_time: float = 0.05) -> dict:
+    """运行基准测试
+
+    Args:
+        pattern: 只运行名称包含此字符串的基准
+        quick: 使用较小的规模
+        repeat: 重复测量的次数
+        min_time: 每次测量的最短时间(秒)
+    """
+    results = {}
+
+    for name, (factory, operations) in collect(quick).items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(factory(), operations, repeat, min_time)
+
+    return {
+        'meta': {
+            'planner': __version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1) -> List[dict]:
+    """比较两次结果: 耗时增加超过threshold(比例)的基准视为回归"""
+    rows = []
+
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            continue
+
+        ratio = result['ns'] / base['results'][name]['ns']
+        rows.append({
+            'name': name,
+            'base_ns': base['results'][name]['ns'],
+            'new_ns': result['ns'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+
+    return rows
+
+
+def format_results(results: dict) -> str:
+    lines = [f'{"benchmark":<40}{"ns/op":>14}{"min ns/op":>14}']
+    for name, result in results['results'].items():
+        lines.append(f'{name:<40}{result["ns"]:>14.1f}{result["min_ns"]:>14.1f}')
+    return '\n'.join(lines)
+
+
+def format_comparison(rows: List[dict]) -> str:
+    lines = [f'{"benchmark":<40}{"base ns":>14}{"new ns":>14}{"ratio":>10}']
+    for row in rows:
+        mark = '  REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["name"]:<40}{row["base_ns"]:>14.1f}{row["new_ns"]:>14.1f}{row["ratio"]:>10.3f}{mark}')
+    return '\n'.join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m planner.benchmark', description='planner benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run benchmarks')
+    run_parser.add_argument('-o', '--output', help='write JSON results to this file')
+    run_parser.add_argument('-k', '--pattern', help='only run benchmarks whose name contains this string')
+    run_parser.add_argument('--quick', action='store_true', help='use smaller sizes')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--min-time', type=float, default=0.05)
+
+    compare_parser = commands.add_parser('compare', help='compare two JSON results')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown ratio')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.pattern, args.quick, args.repeat, args.min_time)
+        print(format_results(results))
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows = compare(base, new, args.threshold)
+    print(format_comparison(rows))
+
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""cache - action结果的缓存
+
+注册时给定cache选项的action 在编译时包装为带缓存的调用目标:
+
+    >>> Plan.register(lookup, cache=LRU(maxsize=1024, ttl=60))
+
+#. 键由action实际得到的参数构成: 上一个结果 或者执行参数与result
+#. 键包含注册的action本身 而不是包装后的调用目标: Plan重新编译后仍然命中
+#. result_mapper/action_mapper不参与默认的键 依赖它们的action应当给定key函数
+#. 命中缓存时action不会被调用 但结果仍然被记录到result_store
+#. 参数不可哈希时直接调用action(计入uncacheable) 可以给定key函数处理
+
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+_IGNORED_KEYWORDS = ('result_mapper', 'action_mapper')
+"""不参与默认键的参数"""
+
+_MISSING = object()
+
+
+def make_key(*args, **kwargs) -> Hashable:
+    """默认的键: 位置参数与关键字参数(不包括result_mapper/action_mapper)"""
+    if kwargs:
+        return args + tuple(sorted((k, v) for k, v in kwargs.items() if k not in _IGNORED_KEYWORDS))
+    return args
+
+
+class LRU(object):
+    """线程安全的LRU缓存 可选过期时间
+
+    Args:
+        maxsize: 最多缓存的结果数量 None时不限制
+        ttl: 过期时间(秒) None时不过期
+        key: 由action的参数计算键的函数 默认为make_key
+
+    并发的未命中不会互相等待: 同一个键可能被计算多次 以最后一次的结果为准
+    """
+
+    def __init__(self, maxsize: Optional[int] = 128, ttl: Optional[float] = None,
+                 key: Callable[..., Hashable] = make_key):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        """因容量或过期被移除的结果数量"""
+        self.uncacheable = 0
+        """参数不可哈希而直接调用的次数"""
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'<LRU maxsize={self.maxsize} ttl={self.ttl} size={len(self._data)} hits={self.hits} ' \
+               f'misses={self.misses} evictions={self.evictions}>'
+
+    def __getstate__(self):
+        # 传递到其他进程时只保留配置
+        return {'maxsize': self.maxsize, 'ttl': self.ttl, 'key': self.key}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key: Hashable) -> Any:
+        """查找缓存 未命中时返回_MISSING"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+
+            if item is not _MISSING:
+                value, expires = item
+
+                if expires is None or expires > monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._data[key]
+                self.evictions += 1
+
+            self.misses += 1
+            return _MISSING
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, monotonic() + self.ttl if self.ttl is not None else None)
+            self._data.move_to_end(key)
+
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """命中/未命中/移除的计数"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'uncacheable': self.uncacheable, 'size': len(self._data)}
+
+    def _lookup(self, action: Any, args: tuple, kwargs: dict):
+        """(键, 缓存的结果) 参数不可哈希时键为None"""
+        try:
+            key = (action, self.key(*args, **kwargs))
+            hash(key)
+        except TypeError:
+            with self._lock:
+                self.uncacheable += 1
+            return None, _MISSING
+
+        return key, self.get(key)
+
+    def wrap(self, target: Callable, action: Any = None) -> Callable:
+        """包装同步的调用目标
+
+        Args:
+            target: 调用目标
+            action: 在键中区分不同action的对象 默认为target
+        """
+        action = target if action is None else action
+
+        @wraps(target)
+        def cached(*args, **kwargs):
+            key, value = self._lookup(action, args, kwargs)
+
+            if value is _MISSING:
+                value = target(*args, **kwargs)
+                if key is not None:
+                    self.set(key, value)
+
+            return value
+
+        return cached
+
+    def wrap_async(self, target: Callable, action: Any = None) -> Callable:
+        """包装需要await的调用目标 action与wrap相同"""
+        action = target if action is None else action
+
+        @wraps(target)
+        async def cached(*args, **kwargs):
+            key, value = self._lookup(action, args, kwargs)
+
+            if value is _MISSING:
+                value = await target(*args, **kwargs)
+                if key is not None:
+                    self.set(key, value)
+
+            return value
+
+        return cached
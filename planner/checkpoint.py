@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""checkpoint - 检查点与恢复执行
+
+Plan.checkpoint_store不为None时 每个action成功后保存其结果; 出错时PlanException.execution_id为此次执行的标识:
+
+    >>> Plan.checkpoint_store = DirectoryCheckpointStore('/tmp/checkpoints')
+    >>> try:
+    ...     Plan.execute(day='2022-12-01')
+    ... except PlanException as e:
+    ...     Plan.execute(resume=e.execution_id)
+
+#. 检查点以(Plan名称, 执行标识, action的序号路径)为键 包括嵌套Plan中的action
+#. 恢复执行时 已完成的action不再运行 其结果按原顺序重新记录(result/result_mapper/特殊返回值)
+#. 执行参数同样被保存 恢复时传入的参数会覆盖保存的参数
+#. 执行成功后删除此次执行的检查点
+#. execute、execute_many与aexecute(resume同样可以给定)都保存检查点
+#. 默认以planner.serialize序列化: lambda、局部函数与create_plan创建的Plan(例如Branch的Plan)按值保存
+#. 序列化方式可以替换: 任何具有dumps/loads的对象
+
+只支持linear模式 其他模式抛出ValueError。
+
+"""
+from __future__ import annotations
+
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+from planner.engine import CallStrategy, Frame, new_frame, invoke, ainvoke, execute_instructions, \
+    aexecute_instructions
+from planner.error import PlanException
+from planner.serialize import dumps, loads
+
+PARAMETER_KEY = 'parameter'
+"""保存执行参数的键"""
+
+MAPPER_PARAMETERS = ('result_mapper', 'action_mapper')
+"""不保存的执行参数"""
+
+
+class PickleSerializer(object):
+    """pickle: 只能按引用保存函数与Plan"""
+
+    def __init__(self, protocol: int = pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class PlanSerializer(PickleSerializer):
+    """默认的序列化方式: 不能导入的函数与Plan按值保存(planner.serialize)
+
+    action的结果可以是Branch(plan)等包含Plan的对象
+    """
+
+    def dumps(self, value: Any) -> bytes:
+        return dumps(value, self.protocol)
+
+    def loads(self, data: bytes) -> Any:
+        return loads(data)
+
+
+class CheckpointStore(object):
+    """检查点存储的基类
+
+    Args:
+        serializer: 具有dumps/loads的序列化方式 默认为PlanSerializer
+    """
+
+    def __init__(self, serializer=None):
+        self.serializer = serializer if serializer is not None else PlanSerializer()
+
+    def save(self, plan_name: str, execution_id: str, key: str, value: Any) -> None:
+        """保存一个action的结果"""
+        raise NotImplementedError
+
+    def load(self, plan_name: str, execution_id: str) -> Dict[str, Any]:
+        """此次执行已保存的全部结果: {键: 结果}"""
+        raise NotImplementedError
+
+    def clear(self, plan_name: str, execution_id: str) -> None:
+        """删除此次执行的检查点"""
+        raise NotImplementedError
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+class DirectoryCheckpointStore(CheckpointStore):
+    """以目录保存检查点: <目录>/<Plan名称>/<执行标识>/<键>
+
+    写入临时文件后重命名 进程中止时不会留下不完整的检查点
+    """
+
+    def __init__(self, directory: str, serializer=None):
+        super().__init__(serializer)
+        self.directory = directory
+
+    def _execution_directory(self, plan_name: str, execution_id: str) -> str:
+        return os.path.join(self.directory, _safe_name(plan_name), _safe_name(execution_id))
+
+    def save(self, plan_name: str, execution_id: str, key: str, value: Any) -> None:
+        directory = self._execution_directory(plan_name, execution_id)
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, key.replace('/', '-'))
+        temp = f'{path}.{uuid.uuid4().hex}.tmp'
+
+        with open(temp, 'wb') as f:
+            f.write(self.serializer.dumps(value))
+        os.replace(temp, path)
+
+    def load(self, plan_name: str, execution_id: str) -> Dict[str, Any]:
+        directory = self._execution_directory(plan_name, execution_id)
+        if not os.path.isdir(directory):
+            return {}
+
+        checkpoints = {}
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                continue
+            with open(os.path.join(directory, name), 'rb') as f:
+                checkpoints[name.replace('-', '/')] = self.serializer.loads(f.read())
+
+        return checkpoints
+
+    def clear(self, plan_name: str, execution_id: str) -> None:
+        directory = self._execution_directory(plan_name, execution_id)
+        if not os.path.isdir(directory):
+            return
+
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """以SQLite文件保存检查点"""
+
+    def __init__(self, path: str, serializer=None):
+        super().__init__(serializer)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                'plan TEXT NOT NULL, execution TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, '
+                'PRIMARY KEY (plan, execution, key))'
+            )
+
+    def save(self, plan_name: str, execution_id: str, key: str, value: Any) -> None:
+        data = self.serializer.dumps(value)
+
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                                     (plan_name, execution_id, key, data))
+
+    def load(self, plan_name: str, execution_id: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._connection.execute('SELECT key, value FROM checkpoints WHERE plan = ? AND execution = ?',
+                                            (plan_name, execution_id)).fetchall()
+
+        return {key: self.serializer.loads(value) for key, value in rows}
+
+    def clear(self, plan_name: str, execution_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM checkpoints WHERE plan = ? AND execution = ?',
+                                     (plan_name, execution_id))
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def index_key(stack: List[Frame], index: int) -> str:
+    """action的序号路径 例如 1/0 表示第2个action(嵌套的Plan)中的第1个action"""
+    return '/'.join([str(frame.index) for frame in stack] + [str(index)])
+
+
+class Checkpointer(CallStrategy):
+    """每个action成功后保存检查点 已完成的action返回保存的结果"""
+
+    __slots__ = ('store', 'plan_name', 'execution_id', 'completed')
+
+    def __init__(self, plan, execute_parameter: dict, resume: Optional[str] = None):
+        self.store: CheckpointStore = plan.checkpoint_store
+        self.plan_name = plan.__name__
+
+        if resume is not None:
+            self.execution_id = resume
+            self.completed = self.store.load(self.plan_name, resume)
+            # 传入的参数覆盖保存的参数
+            for key, value in self.completed.pop(PARAMETER_KEY, {}).items():
+                execute_parameter.setdefault(key, value)
+        else:
+            self.execution_id = uuid.uuid4().hex
+            self.completed = {}
+            # 作为action运行时 result_mapper/action_mapper是外层的视图 不保存
+            self.store.save(self.plan_name, self.execution_id, PARAMETER_KEY,
+                            {k: v for k, v in execute_parameter.items() if k not in MAPPER_PARAMETERS})
+
+    def call(self, frame: Frame, spec, stack: List[Frame]) -> Any:
+        key = index_key(stack, frame.index)
+        if key in self.completed:
+            return self.completed[key]
+
+        action_result = invoke(frame, spec)
+        self.store.save(self.plan_name, self.execution_id, key, action_result)
+        return action_result
+
+    async def acall(self, frame: Frame, spec, stack: List[Frame], executor=None) -> Any:
+        key = index_key(stack, frame.index)
+        if key in self.completed:
+            return self.completed[key]
+
+        action_result = await ainvoke(frame, spec, executor)
+        self.store.save(self.plan_name, self.execution_id, key, action_result)
+        return action_result
+
+    def clear(self) -> None:
+        """执行成功: 删除此次执行的检查点"""
+        self.store.clear(self.plan_name, self.execution_id)
+
+
+def run_checkpointed(plan, execute_parameter: dict, resume: Optional[str] = None) -> Any:
+    """运行Plan的扁平指令流 每个action成功后保存检查点
+
+    Args:
+        plan: 需要运行的Plan
+        execute_parameter: 执行参数
+        resume: 需要恢复的执行标识 为None时开始新的执行
+    """
+    checkpointer = Checkpointer(plan, execute_parameter, resume)
+
+    try:
+        result = execute_instructions(plan.instructions(), new_frame(plan, plan.compile(), execute_parameter),
+                                      checkpointer)
+    except PlanException as e:
+        e.execution_id = checkpointer.execution_id
+        raise
+
+    checkpointer.clear()
+    return result
+
+
+async def arun_checkpointed(plan, execute_parameter: dict, resume: Optional[str] = None, executor=None) -> Any:
+    """异步运行Plan的扁平指令流 每个action成功后保存检查点"""
+    checkpointer = Checkpointer(plan, execute_parameter, resume)
+
+    try:
+        result = await aexecute_instructions(plan.instructions(), new_frame(plan, plan.compile(), execute_parameter),
+                                             executor, checkpointer)
+    except PlanException as e:
+        e.execution_id = checkpointer.execution_id
+        raise
+
+    checkpointer.clear()
+    return result
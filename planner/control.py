@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""control - 控制执行流程的返回值
+
+action返回以下对象时 执行引擎改变之后的执行顺序(仅linear模式):
+
+#. Stop(value): 结束当前的Plan value作为其最终结果; levels>1时同时结束外层的Plan levels=None时结束整个执行
+#. Skip(count, value): 跳过当前Plan中之后的count个action(嵌套的Plan算作一个) value作为此action的结果
+#. Branch(plan): 以plan代替此action运行 其结果作为此action的结果 与注册的嵌套Plan相同
+
+branch()根据result选择分支:
+
+    >>> Plan.register(branch((lambda result: result > 0, Positive), (lambda result: result < 0, Negative)))
+
+被跳过的action不运行 也不记录结果。结束的Plan与嵌套Plan的结果照常向外层传递。
+dag模式与stream模式中的action返回这些对象时抛出ValueError(control results are only supported in linear mode)。
+
+"""
+from __future__ import annotations
+
+from itertools import chain
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+
+class Stop(object):
+    """结束当前的Plan
+
+    Args:
+        value: 结束的Plan的最终结果
+        levels: 结束的层数 1为当前的Plan None为全部
+    """
+
+    __slots__ = ('value', 'levels')
+
+    def __init__(self, value: Any = None, levels: Optional[int] = 1):
+        if levels is not None and levels < 1:
+            raise ValueError(f'levels must be at least 1 or None, got {levels}.')
+
+        self.value = value
+        self.levels = levels
+
+    def __repr__(self):
+        return f'Stop({self.value!r}, levels={self.levels})'
+
+    def resume(self, iterator: Iterator, index: int) -> Iterator:
+        """跳过结束的Plan中剩余的指令 只保留退出这些Plan的指令"""
+        from planner.engine import ENTER, EXIT
+
+        levels = self.levels
+
+        while True:
+            depth = 0
+            for instruction in iterator:
+                op = instruction[0]
+                if op is ENTER:
+                    depth += 1
+                elif op is EXIT:
+                    if not depth:
+                        yield instruction
+                        break
+                    depth -= 1
+            else:
+                return
+
+            if levels is not None:
+                levels -= 1
+                if not levels:
+                    break
+
+        yield from iterator
+
+
+class Skip(object):
+    """跳过当前Plan中之后的action
+
+    Args:
+        count: 跳过的action数量 超过剩余的数量时跳过全部
+        value: 此action的结果
+    """
+
+    __slots__ = ('count', 'value')
+
+    def __init__(self, count: int = 1, value: Any = None):
+        if count < 0:
+            raise ValueError(f'count must not be negative, got {count}.')
+
+        self.count = count
+        self.value = value
+
+    def __repr__(self):
+        return f'Skip({self.count}, {self.value!r})'
+
+    def resume(self, iterator: Iterator, index: int) -> Iterator:
+        """跳过当前Plan中之后的count个action的指令"""
+        from planner.engine import ENTER, EXIT
+
+        remaining = self.count
+        depth = 0
+        if not remaining:
+            yield from iterator
+            return
+
+        for instruction in iterator:
+            op = instruction[0]
+
+            if op is ENTER:
+                depth += 1
+                continue
+            elif op is EXIT:
+                # 当前Plan的结束: 不跳过
+                if not depth:
+                    yield instruction
+                    break
+                depth -= 1
+
+            # 一个action(或者一个嵌套的Plan)结束
+            if not depth:
+                remaining -= 1
+                if not remaining:
+                    break
+
+        yield from iterator
+
+
+class Branch(object):
+    """以plan代替此action运行
+
+    Args:
+        plan: 需要运行的Plan
+    """
+
+    __slots__ = ('plan', 'value')
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.value = None
+
+    def __repr__(self):
+        return f'Branch({self.plan.__name__})'
+
+    def resume(self, iterator: Iterator, index: int) -> Iterator:
+        """此action之后先运行plan的指令"""
+        from planner.core import compile_action
+        from planner.engine import PLAN, CALL, ENTER, EXIT
+
+        plan = self.plan
+        spec = compile_action(plan)
+
+        # 可以展开的Plan与注册的嵌套Plan相同 否则作为一个action调用
+        if spec.kind is PLAN:
+            branch = ((ENTER, spec, index, plan.compile()),) + plan.instructions() + ((EXIT, spec, index, ()),)
+        else:
+            branch = ((CALL, spec, index, ()),)
+
+        return chain(branch, iterator)
+
+
+CONTROLS = (Stop, Skip, Branch)
+"""控制执行流程的返回值类型"""
+
+
+def unsupported(control, mode: str) -> ValueError:
+    """其他执行模式中的控制返回值: 作为action的异常抛出"""
+    return ValueError(f'{control!r} returned in {mode} mode: control results are only supported in linear mode.')
+
+
+class Jump(Exception):
+    """action返回了控制执行流程的对象: 由执行引擎处理"""
+
+    def __init__(self, control, index: int):
+        super().__init__(f'{control!r} is only supported in linear mode.')
+        self.control = control
+        self.index = index
+
+    def resume(self, iterator: Iterator) -> Iterator:
+        """之后需要运行的指令"""
+        return self.control.resume(iterator, self.index)
+
+
+def branch(*cases: Tuple[Callable[[Any], bool], Any], default=None) -> Callable:
+    """按result选择分支的action
+
+    Args:
+        *cases: (判断函数, Plan) 按顺序以result调用判断函数 运行第一个为真的Plan
+        default: 全部为假时运行的Plan 为None时result不变
+    """
+    cases = tuple(cases)
+
+    def choose(**kwargs):
+        result = kwargs['result']
+
+        for predicate, plan in cases:
+            if predicate(result):
+                return Branch(plan)
+
+        return Branch(default) if default is not None else result
+
+    choose.__name__ = choose.__qualname__ = 'branch'
+    return choose
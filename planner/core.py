@@ -2,6 +2,7 @@
 """core package
 
 #. 可以打印运行信息。包括docs、花费时间、运行结果
+#. 可以订阅运行事件。见planner.hooks
 #. 可以暂存运行结果。用于查询结果
 #. 可以动态检测函数参数
 #. 可以包装错误 并且逐级抛出
@@ -9,19 +10,47 @@
 """
 from __future__ import annotations
 
-import threading
-import time
-import uuid
-from functools import reduce
-from inspect import signature, Parameter
+import os
+from contextvars import ContextVar, copy_context
+from functools import partial
+from itertools import count
+from inspect import signature, Parameter, iscoroutinefunction
 from logging import getLogger
-from types import FunctionType, MethodType
-from typing import Callable, Any, Union, Type, Dict, List, Tuple
-
-from planner.error import PlanException
+from types import FunctionType, MethodType, MappingProxyType
+from typing import Callable, Any, Union, Type, Dict, List, Tuple, Optional, Iterable, Iterator, Mapping, \
+    TYPE_CHECKING
+
+from planner.engine import NO_ARGUMENT, POSITIONAL, VAR_KEYWORD, PLAN, NAMED, LINEAR, DAG, STREAM, RAISE, SKIP, YIELD, \
+    ENTER, Frame, flatten, run, run_many, arun, invoke, record, keyword_parameter
+from planner.control import Branch, Jump
+from planner.store import ResultStore, ContextResultStore
+from planner.registry import registry
+
+# 其他执行模式与可选功能按需导入: 导入planner时不加载asyncio、concurrent.futures、sqlite3等模块
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from planner.checkpoint import CheckpointStore
+    from planner.history import HistoryRecorder
+    from planner.incremental import IncrementalStore
+    from planner.profiling import Profiler
+    from planner.transport import SharedMemoryTransport
 
 DEFAULT_DELAY = 0.2
 
+WRAPPING_OPTIONS = ('cache', 'timeout', 'hedge', 'concurrency', 'rate', 'limit', 'batch')
+"""需要包装调用目标的action选项"""
+
+STANDALONE_OPTIONS = ('checkpoint_store', 'incremental_store', 'profiler', 'recorder')
+"""Plan的可选功能: 设置了其中任何一个的Plan嵌套时不展开 整体作为一个action(在外层编译之前设置)"""
+
+_generation_counter = count(1)
+"""action列表的版本号: 每个Plan的actions变化后取新的值 不同Plan之间不会重复"""
+
+
+def _invalidate(plan) -> None:
+    """使此Plan(以及展开了此Plan的Plan)的编译结果失效"""
+    type.__setattr__(plan, '_generation', next(_generation_counter))
+
 
 def get_origin(action) -> Tuple[str, object]:
     if isinstance(action, PlanMeta):
@@ -46,18 +75,248 @@ def get_origin(action) -> Tuple[str, object]:
         return str(action), action
 
 
+class ActionSpec(object):
+    """action的编译结果: 预先确定的调用方式"""
+
+    __slots__ = ('action', 'name', 'origin', 'kind', 'target', 'plan', 'options', 'async_target', 'params')
+
+    def __init__(self, action, name: str, origin, kind: str, target: Callable, plan=None, options: dict = None,
+                 async_target: Callable = None, params: Tuple[str, ...] = ()):
+        self.action = action
+        self.name = name
+        self.origin = origin
+        self.kind = kind
+        self.target = target
+        self.plan = plan
+        self.options = options if options is not None else {}
+        self.async_target = async_target
+        """异步执行时需要await的调用目标"""
+        self.params = params
+        """位置参数的名称: DAG模式下用于匹配依赖的action"""
+
+    def __repr__(self):
+        return f'<ActionSpec {self.name} ({self.kind})>'
+
+
+def compile_action(action, options: dict = None, mode: str = LINEAR) -> ActionSpec:
+    """检查action的参数 确定其调用方式
+
+    不支持的参数形式会直接抛出TypeError。DAG模式下额外支持多个位置参数(按名称匹配依赖的action)
+    """
+    action_name, origin = get_origin(action)
+
+    # 如果是Plan类 展开到外层的指令流中
+    # 重写了execute的Plan则调用其execute/aexecute方法
+    if isinstance(action, PlanMeta) or isinstance(action, Plan):
+        plan = action if isinstance(action, PlanMeta) else type(action)
+
+        # 带缓存/超时/限制/合并 或者带检查点/增量执行/统计/记录的Plan不展开 整体作为一个action
+        if getattr(plan.execute, '__func__', None) is Plan.execute.__func__ and plan.mode == LINEAR and not (
+                options and any(options.get(_) is not None for _ in WRAPPING_OPTIONS)) and \
+                all(getattr(plan, _) is None for _ in STANDALONE_OPTIONS):
+            return ActionSpec(action, action_name, origin, PLAN, action.execute, plan, options)
+        return wrap_targets(ActionSpec(action, action_name, origin, VAR_KEYWORD, action.execute, None, options,
+                                       action.aexecute))
+
+    if not callable(action):
+        raise TypeError(f'action {action!r} is not callable.')
+
+    try:
+        sig = signature(action)
+    except (TypeError, ValueError) as e:
+        raise TypeError(f'cannot inspect parameters of action {action!r}: {e}') from None
+
+    positional = [_ for _ in sig.parameters.values() if _.kind == Parameter.POSITIONAL_OR_KEYWORD]
+    var_positional = [_ for _ in sig.parameters.values() if _.kind == Parameter.VAR_POSITIONAL]
+    var_keyword = [_ for _ in sig.parameters.values() if _.kind == Parameter.VAR_KEYWORD]
+
+    # case: 没有参数
+    if not sig.parameters:
+        kind = NO_ARGUMENT
+    # case: 有且只有一个给定的参数
+    elif not var_positional and not var_keyword and len(positional) == 1:
+        kind = POSITIONAL
+    # case: 不定参数
+    elif var_keyword:
+        kind = VAR_KEYWORD
+    # case: DAG模式下的多个位置参数
+    elif mode == DAG and not var_positional and len(positional) == len(sig.parameters):
+        kind = NAMED
+    else:
+        raise TypeError(f'parameter error: action {action_name} {sig} must take no argument, '
+                        f'exactly one positional argument or **kwargs.')
+
+    # 协程函数 或者 __call__为协程函数的对象
+    is_async = iscoroutinefunction(action) or iscoroutinefunction(getattr(action, '__call__', None))
+
+    return wrap_targets(ActionSpec(action, action_name, origin, kind, action, None, options,
+                                   action if is_async else None, tuple(_.name for _ in positional)))
+
+
+def wrap_targets(spec: ActionSpec) -> ActionSpec:
+    """注册时给定了batch/concurrency/rate/timeout/hedge/cache选项: 包装调用目标
+
+    缓存在最外层: 命中缓存时不再等待; 限制在内层: 超时包括排队的时间;
+    合并在最内层: 同时有限制时 限制作用于合并后的batch调用
+    """
+    options = spec.options
+
+    limiter = None
+    if any(options.get(_) is not None for _ in ('concurrency', 'rate', 'limit')):
+        from planner.limits import Limiter
+        limiter = Limiter.from_options(spec.action, spec.name, options)
+
+    batcher = None
+    if options.get('batch') is not None:
+        from planner.batch import Batcher
+        batcher = Batcher.from_options(spec.action, spec.name, options)
+        if limiter is not None:
+            batcher.limit(limiter)
+            limiter = None
+
+    guard = None
+    if options.get('timeout') is not None or options.get('hedge') is not None:
+        from planner.timeout import Guard
+        guard = Guard.from_options(spec.action, spec.name, options)
+
+    cache = options.get('cache')
+
+    for wrapper in (batcher, limiter, guard, cache):
+        if wrapper is None:
+            continue
+
+        wrap, wrap_async = wrapper.wrap, wrapper.wrap_async
+        # 缓存的键使用注册的action: 每次编译重新包装的调用目标不同
+        if wrapper is cache:
+            wrap, wrap_async = partial(wrap, action=spec.action), partial(wrap_async, action=spec.action)
+
+        if spec.async_target is not None:
+            wrapped_async = wrap_async(spec.async_target)
+            # 协程函数在同步执行时同样返回包装后的协程
+            spec.target = wrapped_async if spec.target is spec.async_target else wrap(spec.target)
+            spec.async_target = wrapped_async
+        else:
+            spec.target = wrap(spec.target)
+
+    return spec
+
+
+def observe(plan, runner: Callable, *args) -> Any:
+    """运行一次执行runner(*args): 按Plan.profiler与Plan.recorder的抽样比例统计
+
+    execute、execute_many的每个输入共用 aexecute使用aobserve
+    """
+    profiler = plan.profiler
+
+    if profiler is not None and profiler.sampled():
+        with profiler.capture():
+            return _record(plan, runner, args)
+
+    return _record(plan, runner, args)
+
+
+def _record(plan, runner: Callable, args: tuple) -> Any:
+    recorder = plan.recorder
+
+    if recorder is not None and recorder.sampled():
+        with recorder.capture(plan):
+            return runner(*args)
+
+    return runner(*args)
+
+
+async def aobserve(plan, runner: Callable, *args) -> Any:
+    """异步运行一次执行await runner(*args): 与observe相同"""
+    profiler = plan.profiler
+
+    if profiler is not None and profiler.sampled():
+        with profiler.capture():
+            return await _arecord(plan, runner, args)
+
+    return await _arecord(plan, runner, args)
+
+
+async def _arecord(plan, runner: Callable, args: tuple) -> Any:
+    recorder = plan.recorder
+
+    if recorder is not None and recorder.sampled():
+        with recorder.capture(plan):
+            return await runner(*args)
+
+    return await runner(*args)
+
+
+class ActionList(list):
+    """action列表: 任何修改都会使所属Plan的编译结果失效"""
+
+    __slots__ = ('plan',)
+
+    def __init__(self, actions=(), plan=None):
+        super().__init__(actions)
+        self.plan = plan
+
+    def __reduce__(self):
+        # 序列化为普通的list 不包含所属的Plan
+        return list, (list(self),)
+
+    def _invalidating(name):
+        method = getattr(list, name)
+
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            if self.plan is not None:
+                _invalidate(self.plan)
+            return result
+
+        wrapper.__name__ = name
+        return wrapper
+
+    append = _invalidating('append')
+    extend = _invalidating('extend')
+    insert = _invalidating('insert')
+    remove = _invalidating('remove')
+    pop = _invalidating('pop')
+    clear = _invalidating('clear')
+    sort = _invalidating('sort')
+    reverse = _invalidating('reverse')
+    __setitem__ = _invalidating('__setitem__')
+    __delitem__ = _invalidating('__delitem__')
+    __iadd__ = _invalidating('__iadd__')
+    __imul__ = _invalidating('__imul__')
+
+    del _invalidating
+
+
 class PlanMeta(type):
     def __init__(cls, name, bases, attrs: dict, actions=None):
         super().__init__(name, bases, attrs)
 
     def __new__(mcs, name, bases, attrs: dict, actions=None):
         cls = type.__new__(mcs, name, bases, attrs)
-        cls._thread_action_result_mapper = {}
+        cls._action_result_var = ContextVar(f'{name}_results')
+        cls._compiled = (None, (), MappingProxyType({}))
+        cls._instructions = ((), ())
+        cls._graph = (None, ())
 
         cls.actions = [_ for _ in (actions if actions is not None else cls.actions)]
+        cls.action_options = {**cls.action_options}
+
+        # 注册时即检查参数
+        for action in cls.actions:
+            compile_action(action, None, cls.mode)
+
+        registry.define(cls)
 
         return cls
 
+    def __setattr__(cls, key, value):
+        # 替换actions时使此Plan的编译结果失效
+        if key == 'actions':
+            value = ActionList(value, cls)
+            _invalidate(cls)
+
+        super().__setattr__(key, value)
+
 
 class Plan(object, metaclass=PlanMeta):
     """不能实例化后使用"""
@@ -68,145 +327,365 @@ class Plan(object, metaclass=PlanMeta):
     """打印结果"""
 
     delay: Union[float, int] = DEFAULT_DELAY
-    """执行间隔"""
+    """执行间隔(已废弃: 打印信息时不再等待)"""
+
+    action_options: Dict[Any, dict] = {}
+    """注册时给定的action选项"""
+
+    mode: str = LINEAR
+    """执行模式: linear(按顺序执行) dag(按依赖关系并发执行) 或 stream(流式执行)"""
+
+    buffer_size: int = 0
+    """流模式下各阶段之间队列的大小: 大于0时每个阶段在独立的线程中运行"""
+
+    checkpoint_store: Optional[CheckpointStore] = None
+    """检查点存储: 不为None时每个action成功后保存结果 可以恢复执行(仅linear模式)"""
+
+    incremental_store: Optional[IncrementalStore] = None
+    """增量执行的存储: 不为None时复用输入指纹未变化的action的结果(仅linear模式)"""
+
+    profiler: Optional[Profiler] = None
+    """不为None时 按其抽样比例统计每个action的CPU时间与内存分配"""
+
+    recorder: Optional[HistoryRecorder] = None
+    """不为None时 按其抽样比例把每次执行的耗时与结果持久化(planner.history)"""
+
+    max_workers: int = 4
+    """DAG模式下默认线程池的大小"""
+
+    executor: Optional[Executor] = None
+    """线程池: 异步执行时用于阻塞的action 默认为事件循环的默认线程池; DAG模式下用于并发执行 默认为每个Plan独立的线程池"""
+
+    result_store: ResultStore = ContextResultStore()
+    """action结果的存储 默认保留当前上下文中最近一次执行的结果"""
+
+    _action_result_var: ContextVar
+    """action结果字典: 每个线程/协程任务拥有独立的上下文"""
 
-    _thread_action_result_mapper: Dict[int, Dict[str, Any]] = {}
-    """线程与action结果字典的字典"""
+    _generation: int = 0
+    """actions的版本号: 只在此Plan的actions变化时改变"""
+
+    _compiled: Tuple[Any, Tuple[ActionSpec, ...], Mapping[str, Any]] = (None, (), MappingProxyType({}))
+    """编译结果: (版本号, 每个action的调用方式, action名称与其来源)"""
+
+    _instructions: Tuple[tuple, tuple] = ((), ())
+    """展开结果: (展开的每个Plan与其版本号, 扁平的指令流)"""
 
     @classmethod
     def get_results(cls) -> Dict[str, Any]:
-        """多线程: 根据当前线程id自动切换不同的结果队列"""
-        _id = threading.get_ident()
-        if _id not in cls._thread_action_result_mapper:
-            cls._thread_action_result_mapper[_id] = {}
-        return cls._thread_action_result_mapper[_id]
+        """多线程/协程: 根据当前上下文(contextvars)自动切换不同的结果字典
+
+        执行结束后是否仍可获取 取决于result_store
+        """
+        return cls.result_store.get(cls)
 
     @classmethod
-    def register(cls, target_callable: Union[FunctionType, MethodType, Type[Plan]]):
-        """注册一个函数或者Plan到此Plan"""
+    def get_options(cls, action) -> dict:
+        """获取action注册时给定的选项"""
+        try:
+            return cls.action_options.get(action, {})
+        except TypeError:
+            return {}
+
+    @classmethod
+    def register(cls, target_callable: Union[FunctionType, MethodType, Type[Plan]] = None, **options):
+        """注册一个函数或者Plan到此Plan
+
+        注册时即检查参数 不支持的参数形式抛出TypeError
+
+        Args:
+            target_callable: 函数或者Plan. 为None时返回装饰器
+            **options: action选项
+                blocking (bool): 异步执行时放入线程池运行
+                depends (Iterable[str]): DAG模式下依赖的action名称 默认根据参数推断
+                cache (planner.cache.LRU): 缓存action的结果 以action得到的参数为键
+                timeout (float): 超时时间(秒) 超时抛出ActionTimeout
+                hedge (float | str): 超过此时间(秒)或已观测耗时的分位数(例如'p95')仍未完成时 再调用一次 取先完成的结果
+                concurrency (int): 同时运行的最大数量 所有线程与Plan中此action的调用共用
+                rate (float | tuple): 每秒最多调用次数 或者(次数, 秒数)
+                limit (str): 共用限制的名称 多个action共用同一个concurrency/rate
+                batch (Callable): 合并并发调用的函数 以item列表为参数 返回等长的结果序列
+                batch_size (int): 最多合并的调用数量 默认64
+                batch_wait (float): 第一个调用最长等待合并的时间(秒) 默认0.002
+                impure (bool): 增量执行时总是运行此action
+                reads (Iterable[str]): 增量执行时不定参数action读取的执行参数 默认为全部执行参数
+        """
+        if target_callable is None:
+            return lambda _: cls.register(_, **options)
+
+        spec = compile_action(target_callable, options, cls.mode)
+
+        # DAG模式下检查依赖是否存在
+        if cls.mode == DAG:
+            from planner.dag import build_graph
+            build_graph(cls.compile() + (spec,))
+
+        if options:
+            cls.action_options[target_callable] = options
         cls.actions.append(target_callable)
 
-        # if isinstance(target_callable, FunctionType):
-        #     cls.actions.append(target_callable)
-        # elif isinstance(target_callable, PlanMeta):
-        #     cls.actions.append(target_callable)
+        return target_callable
 
     @classmethod
-    def execute(cls, **execute_parameter):
-        """运行此计划"""
+    def compile(cls) -> Tuple[ActionSpec, ...]:
+        """编译此Plan: 确定每个action的调用方式
 
-        cls.get_results().clear()
+        结果会被缓存 直到此Plan的actions发生变化
+        """
+        generation = cls._generation
+        compiled_generation, specs, _ = cls._compiled
 
-        try:
-            res = reduce(
-                lambda last_result, action: cls.execute_single_actions(action, last_result, execute_parameter),
-                cls.actions,
-                None
-            )
+        if compiled_generation != generation:
+            specs = tuple(compile_action(action, cls.get_options(action), cls.mode) for action in cls.actions)
+            cls._compiled = (generation, specs, MappingProxyType({spec.name: spec.origin for spec in specs}))
+
+        return specs
+
+    @classmethod
+    def action_table(cls) -> Mapping[str, Any]:
+        """action名称与其来源的只读字典 作为action_mapper的最内层
+
+        与编译结果一同缓存
+        """
+        cls.compile()
+        return cls._compiled[2]
+
+    @classmethod
+    def instructions(cls) -> tuple:
+        """展开此Plan: 嵌套的Plan被展开为一条扁平的指令流
 
-        except PlanException as pe:
-            pe.add_plan_exception(cls, pe)
-            raise pe from None
+        结果会被缓存 直到此Plan或者其中展开的Plan的actions发生变化
+        """
+        generations, instructions = cls._instructions
 
-        except Exception as e:
-            plan_exception = PlanException(e, cls)
-            plan_exception.add_origin_exception(cls, e)
+        for plan, generation in generations:
+            if plan._generation != generation:
+                break
+        else:
+            if generations:
+                return instructions
 
-            raise plan_exception from None
+        instructions = flatten(cls)
+        # 展开时使用的是各Plan编译时的版本
+        plans = (cls,) + tuple(_[1].plan for _ in instructions if _[0] is ENTER)
+        cls._instructions = (tuple((plan, plan._compiled[0]) for plan in plans), instructions)
 
-        return res
+        return instructions
 
     @classmethod
-    def execute_single_actions(cls, action: Callable, last_result, execute_parameter: dict) -> Any:
-        """运行单个的一个函数 可以根据函数参数动态调整"""
+    def graph(cls) -> tuple:
+        """DAG模式下每个action的依赖关系
 
-        action_name, origin = get_origin(action)
+        结果会被缓存 直到此Plan的actions发生变化
+        """
+        generation = cls._generation
+        graph_generation, graph = cls._graph
 
-        if cls.is_output:
-            s = time.time()
+        if graph_generation != generation:
+            from planner.dag import build_graph
+            graph = build_graph(cls.compile())
+            cls._graph = (generation, graph)
 
-            cls.output(f'- Start action: {action_name} --> {action}')
-            if doc := action.__doc__:
-                cls.output(f'- Doc: {doc}')
+        return graph
 
-        # 如果是Plan类 转换为其execute方法
-        if isinstance(action, PlanMeta) or isinstance(action, Plan):
-            execute_target = action.execute
-        else:
-            execute_target = action
-
-        # 动态检查参数
-        sig = signature(execute_target)
-        positional = [_ for _ in sig.parameters.values() if _.kind == Parameter.POSITIONAL_OR_KEYWORD]
-        var_positional = [_ for _ in sig.parameters.values() if _.kind == Parameter.VAR_POSITIONAL]
-        var_keyword = [_ for _ in sig.parameters.values() if _.kind == Parameter.VAR_KEYWORD]
-
-        # case: 没有参数
-        if not sig.parameters:
-            action_result = execute_target()
-
-            cls.get_results()[action_name] = action_result
-
-        # case: 有且只有一个给定的参数
-        elif not var_positional and not var_keyword and len(positional) == 1:
-            action_result = execute_target(last_result)
-            cls.get_results()[action_name] = action_result
-
-        # case: 不定参数
-        elif var_keyword:
-            # 如果是当前Plan第一个action 则试图从执行参数中获取result
-            # *result可以向下渗透
-            if last_result is None:
-                last_result = execute_parameter.get('result')
-
-            action_result = execute_target(**{
-                **execute_parameter,
-                'result': last_result,
-                'result_mapper': {
-                    **execute_parameter.get('result_mapper', {}),
-                    **cls.get_results()
-                },
-                'action_mapper': {
-                    **{_[0]: _[1] for _ in [get_origin(_) for _ in cls.actions]},
-                    **execute_parameter.get('action_mapper', {}),
-                },
-            })
-            cls.get_results()[action_name] = action_result
+    @classmethod
+    def execute(cls, *, resume: str = None, **execute_parameter):
+        """运行此计划
 
-        else:
-            assert False, 'parameter error.'
+        Args:
+            resume: 使用检查点时 恢复此标识(PlanException.execution_id)的执行 跳过已完成的action
+            **execute_parameter: 执行参数
+        """
+        if cls.profiler is not None or cls.recorder is not None:
+            return observe(cls, cls._execute, resume, execute_parameter)
+
+        return cls._execute(resume, execute_parameter)
+
+    @classmethod
+    def _check_options(cls, resume: Optional[str] = None) -> None:
+        """检查点与增量执行只支持linear模式"""
+        if cls.checkpoint_store is not None or resume is not None:
+            if cls.mode != LINEAR or cls.checkpoint_store is None:
+                raise ValueError(f'Plan {cls.__name__} needs a checkpoint_store in {LINEAR} mode to resume.')
+
+        if cls.incremental_store is not None and cls.mode != LINEAR:
+            raise ValueError(f'Plan {cls.__name__} needs {LINEAR} mode to use an incremental_store.')
+
+    @classmethod
+    def _execute(cls, resume: Optional[str], execute_parameter: dict):
+        """按执行模式与可选功能运行一次"""
+        if cls.checkpoint_store is not None or cls.incremental_store is not None or resume is not None:
+            cls._check_options(resume)
+
+        if cls.checkpoint_store is not None:
+            from planner.checkpoint import run_checkpointed
+            return run_checkpointed(cls, execute_parameter, resume)
+
+        if cls.incremental_store is not None:
+            from planner.incremental import run_incremental
+            return run_incremental(cls, execute_parameter)
 
-        if cls.is_output:
-            e = time.time()
-            cls.output(f'- Done.')
-            time.sleep(cls.delay)
+        if cls.mode == DAG:
+            from planner.dag import run_dag
+            return run_dag(cls, execute_parameter)
+        elif cls.mode == STREAM:
+            from planner.stream import run_stream
+            return run_stream(cls, execute_parameter)
 
-            cls.output(f'- Time cost: {round(e - s, 3)} second.')
-            cls.output(f'- action result:{action_result}')
-            cls.output('-' * 80)
-            time.sleep(cls.delay)
+        return run(cls, execute_parameter)
 
-        # TODO: special sentinel return value.
-        if type(action_result) is dict and 'pass' in action_result:
-            execute_parameter.update(action_result)
+    @classmethod
+    def stream(cls, **execute_parameter) -> Iterator:
+        """流模式: 逐项(惰性)返回最后一个action的结果
+
+        提前停止迭代时 所有阶段随之停止
+        """
+        if cls.mode != STREAM:
+            raise ValueError(f'Plan {cls.__name__} is not in {STREAM} mode.')
+
+        from planner.stream import iterate_stream
+        return iterate_stream(cls, execute_parameter)
+
+    @classmethod
+    async def aexecute(cls, *, resume: str = None, **execute_parameter):
+        """异步运行此计划
+
+        协程函数会被await 普通函数直接运行 注册时blocking=True的函数放入线程池运行。
+        DAG模式与流模式的Plan在线程池中运行
+
+        Args:
+            resume: 与execute相同
+            **execute_parameter: 执行参数
+        """
+        if cls.profiler is not None or cls.recorder is not None:
+            return await aobserve(cls, cls._aexecute, resume, execute_parameter)
+
+        return await cls._aexecute(resume, execute_parameter)
+
+    @classmethod
+    async def _aexecute(cls, resume: Optional[str], execute_parameter: dict):
+        """按执行模式与可选功能异步运行一次"""
+        if cls.checkpoint_store is not None or cls.incremental_store is not None or resume is not None:
+            cls._check_options(resume)
+
+        if cls.checkpoint_store is not None:
+            from planner.checkpoint import arun_checkpointed
+            return await arun_checkpointed(cls, execute_parameter, resume, cls.executor)
+
+        if cls.mode in (DAG, STREAM):
+            from asyncio import get_running_loop
+            from planner.dag import run_dag
+            from planner.stream import run_stream
+
+            return await get_running_loop().run_in_executor(
+                None, partial(copy_context().run, run_dag if cls.mode == DAG else run_stream, cls, execute_parameter)
+            )
+
+        if cls.incremental_store is not None:
+            from planner.incremental import arun_incremental
+            return await arun_incremental(cls, execute_parameter, cls.executor)
+
+        return await arun(cls, execute_parameter, cls.executor)
 
-            return action_result.get('result')
+    @classmethod
+    def execute_many(cls, parameters: Iterable[dict], errors: str = RAISE) -> Iterator:
+        """以每个执行参数运行此计划 逐个(惰性)返回结果
+
+        编译结果与指令流在所有输入之间复用 内存占用与输入数量无关
+
+        Args:
+            parameters: 执行参数(dict)的迭代器
+            errors: 单个输入失败时 raise(抛出) skip(跳过) yield(返回PlanException)
+        """
+        if errors not in (RAISE, SKIP, YIELD):
+            raise ValueError(f'errors must be one of {RAISE}, {SKIP}, {YIELD}.')
+        cls._check_options()
+
+        runner = None
+        if cls.checkpoint_store is not None:
+            from planner.checkpoint import run_checkpointed
+            runner = partial(run_checkpointed, cls)
+        elif cls.mode == DAG:
+            from planner.dag import run_dag
+            runner = partial(run_dag, cls)
+        elif cls.mode == STREAM:
+            from planner.stream import run_stream
+            runner = partial(run_stream, cls)
+        elif cls.incremental_store is not None:
+            from planner.incremental import run_incremental
+            runner = partial(run_incremental, cls)
+
+        # 每个输入作为一次执行抽样
+        if cls.profiler is not None or cls.recorder is not None:
+            runner = partial(observe, cls, runner or partial(run, cls))
+
+        return run_many(cls, parameters, errors, runner)
+
+    @classmethod
+    def map(cls, iterable: Iterable[dict], workers: int = None, chunksize: int = 1, ordered: bool = True,
+            transport: SharedMemoryTransport = None) -> Iterator:
+        """在进程池中以每个执行参数运行此计划 适用于CPU密集的Plan
+
+        Plan与其actions(包括lambda与create_plan创建的Plan)按值序列化后传递到工作进程
 
-        return action_result
+        Args:
+            iterable: 执行参数(dict)的迭代器
+            workers: 进程数 默认为CPU数量
+            chunksize: 每次提交到工作进程的输入数量
+            ordered: True时按输入顺序返回结果; False时按完成顺序返回(输入序号, 结果)
+            transport: 经共享内存传递大的执行参数与结果(planner.transport.SharedMemoryTransport)
+        """
+        # 按需导入: 避免导入planner时加载multiprocessing
+        from planner.parallel import map_plan
+
+        return map_plan(cls, iterable, workers, chunksize, ordered, transport)
+
+    @classmethod
+    def execute_single_actions(cls, action: Callable, last_result, execute_parameter: dict,
+                               spec: ActionSpec = None) -> Any:
+        """运行单个的一个函数 根据编译好的调用方式传入参数
+
+        嵌套的Plan不会被展开 而是调用其execute方法
+        """
+        if spec is None:
+            spec = compile_action(action)
+        if spec.kind is PLAN:
+            spec = ActionSpec(spec.action, spec.name, spec.origin, VAR_KEYWORD, spec.target)
+
+        frame = Frame(cls, cls.compile(), execute_parameter, cls.get_results())
+        frame.last_result = last_result
+
+        try:
+            record(frame, spec, invoke(frame, spec))
+            return frame.last_result
+        except Jump as jump:
+            # 单个action: Stop/Skip只返回其结果 Branch运行其Plan
+            if type(jump.control) is Branch:
+                return jump.control.plan.execute(**keyword_parameter(frame))
+            return frame.last_result
 
     @classmethod
     def output(cls, output_content):
-        """默认输出"""
-        if not getLogger(cls.__name__).handlers:
+        """默认输出: 没有handler时print 否则写入以Plan名称命名的logger
+
+        is_output时在后台线程中以planner.log.OutputRecord调用 其结构化字段作为日志的extra;
+        重写此方法时output_content不再是str: str(output_content)为原来的文本
+        """
+        logger = getLogger(cls.__name__)
+
+        if not logger.handlers:
             print(output_content)
+        elif extra := getattr(output_content, 'extra', None):
+            logger.info('%s', output_content, extra=extra())
         else:
-            getLogger(cls.__name__).info(output_content)
+            logger.info(output_content)
 
 
 def create_plan(name: str = None, actions: list = None, is_output: bool = False, delay: float = DEFAULT_DELAY,
                 **kwargs) -> Type[Plan]:
     """创建"""
-    name = name if name is not None else f'Plan{uuid.uuid4().node}'
+    # 随机的48位整数 与uuid4().node相同
+    name = name if name is not None else f'Plan{int.from_bytes(os.urandom(6), "big")}'
     actions = actions if actions is not None else list()
 
     # TODO: refactor here.
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""dag - 按依赖关系并发执行
+
+#. 每个action的依赖: 注册时给定的depends 或者根据参数名称匹配之前的action名称
+#. 所有依赖完成的action立即提交到有界的线程池
+#. 任一action失败时 取消尚未开始的action 等待已开始的action结束 异常指向失败的action
+#. 每个Plan独立的线程池在Plan被回收时关闭
+#. 不支持控制执行流程的返回值(Stop/Skip/Branch): 抛出ValueError
+
+依赖的推断规则:
+
+#. 没有参数: 不依赖任何action
+#. 一个参数: 参数名称与之前的action名称相同时依赖该action 否则依赖上一个action
+#. 多个参数: 每个参数名称必须与之前的action名称相同 按名称传入其结果
+#. 不定参数/嵌套的Plan: 依赖之前所有的action
+
+"""
+from __future__ import annotations
+
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextvars import copy_context
+from functools import partial
+from types import MappingProxyType
+from typing import Any, Dict, List, Tuple, Optional
+
+from planner.control import CONTROLS, unsupported
+from planner.engine import NO_ARGUMENT, POSITIONAL, NAMED, DAG, Frame, keyword_parameter, new_frame, close_frames, \
+    record, wrap_exception, action_path, observed_call, plan_start, plan_end
+from planner.hooks import subscribers
+
+_executor_lock = threading.Lock()
+
+
+class Node(object):
+    """DAG中的一个action"""
+
+    __slots__ = ('spec', 'index', 'depends', 'source', 'arguments', 'dependents')
+
+    def __init__(self, spec, index: int, depends: Tuple[int, ...], source: Optional[int],
+                 arguments: Tuple[Tuple[str, int], ...] = ()):
+        self.spec = spec
+        self.index = index
+        self.depends = depends
+        """依赖的action序号"""
+        self.source = source
+        """作为上一个结果(result)传入的action序号"""
+        self.arguments = arguments
+        """多个位置参数时: (参数名称, action序号)"""
+        self.dependents: List[int] = []
+        """依赖此action的action序号"""
+
+    def __repr__(self):
+        return f'<Node [{self.index + 1}] {self.spec.name} depends on {[_ + 1 for _ in self.depends]}>'
+
+
+def _resolve(spec, names, latest: Dict[str, int]) -> List[int]:
+    """将action名称转换为序号"""
+    missing = [_ for _ in names if _ not in latest]
+    if missing:
+        raise TypeError(f'action {spec.name} depends on unknown actions: {missing}.')
+
+    return [latest[_] for _ in names]
+
+
+def build_graph(specs: tuple) -> Tuple[Node, ...]:
+    """根据编译结果构造依赖关系 依赖不存在时抛出TypeError"""
+    nodes: List[Node] = []
+    latest: Dict[str, int] = {}
+
+    for index, spec in enumerate(specs):
+        previous = index - 1 if index else None
+        arguments = ()
+
+        if spec.kind is NO_ARGUMENT:
+            depends, source = [], None
+
+        elif spec.kind is POSITIONAL:
+            source = latest.get(spec.params[0], previous)
+            depends = [source] if source is not None else []
+
+        elif spec.kind is NAMED:
+            arguments = tuple(zip(spec.params, _resolve(spec, spec.params, latest)))
+            depends, source = [_[1] for _ in arguments], None
+
+        else:
+            depends, source = list(range(index)), previous
+
+        # 注册时给定的依赖代替推断的依赖 但仍包含参数所需的action
+        if (explicit := spec.options.get('depends')) is not None:
+            explicit = _resolve(spec, (explicit,) if isinstance(explicit, str) else explicit, latest)
+
+            if spec.kind is POSITIONAL:
+                source = latest.get(spec.params[0], max(explicit, default=None))
+            elif spec.kind is not NAMED:
+                source = max(explicit, default=None)
+
+            depends = explicit + [_[1] for _ in arguments] + ([source] if source is not None else [])
+
+        nodes.append(Node(spec, index, tuple(sorted(set(depends))), source, arguments))
+        latest[spec.name] = index
+
+    for node in nodes:
+        for depend in node.depends:
+            nodes[depend].dependents.append(node.index)
+
+    return tuple(nodes)
+
+
+def get_executor(plan):
+    """DAG模式使用的线程池: Plan.executor 或者每个Plan独立的有界线程池
+
+    Plan之间不共用线程池: 在action中运行其他DAG模式的Plan时不会互相等待
+    """
+    if plan.executor is not None:
+        return plan.executor
+
+    if (executor := plan.__dict__.get('_dag_executor')) is None:
+        with _executor_lock:
+            if (executor := plan.__dict__.get('_dag_executor')) is None:
+                executor = ThreadPoolExecutor(plan.max_workers, thread_name_prefix=plan.__name__)
+                plan._dag_executor = executor
+                # 例如循环中create_plan创建的Plan: 被回收时结束其线程
+                weakref.finalize(plan, executor.shutdown, wait=False)
+
+    return executor
+
+
+def submit(executor, frame: Frame, node: Node, values: list):
+    """以当前的结果构造参数 提交一个action"""
+    spec = node.spec
+    run = copy_context().run
+    target = spec.target
+
+    # 打印信息/发送事件在线程中进行 耗时不包括排队时间
+    if subscribers or frame.plan.is_output:
+        target = partial(observed_call, frame.plan, spec, action_path(frame, spec), target)
+
+    # 参数在提交时确定 线程中不再读取frame
+    if spec.kind is NO_ARGUMENT:
+        return executor.submit(run, target)
+
+    elif spec.kind is NAMED:
+        return executor.submit(run, target, **{name: values[index] for name, index in node.arguments})
+
+    frame.last_result = values[node.source] if node.source is not None else None
+
+    if spec.kind is POSITIONAL:
+        return executor.submit(run, target, frame.last_result)
+
+    # 其他action的结果仍在更新 传入此时结果的快照
+    parameter = keyword_parameter(frame)
+    parameter['result_mapper'] = MappingProxyType(dict(frame.result_mapper))
+
+    return executor.submit(run, target, **parameter)
+
+
+def run_dag(plan, execute_parameter: dict) -> Any:
+    """按依赖关系并发运行Plan 返回最后一个action的结果"""
+    nodes = plan.graph()
+    executor = get_executor(plan)
+
+    frame = new_frame(plan, plan.compile(), execute_parameter)
+    plan_start(frame)
+
+    values = [None] * len(nodes)
+    waiting = [len(node.depends) for node in nodes]
+    ready = [node for node in nodes if not node.depends]
+    running = {}
+
+    try:
+        while ready or running:
+            for node in ready:
+                frame.index = node.index
+                running[submit(executor, frame, node, values)] = node
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                node = running.pop(future)
+                frame.index = node.index
+
+                action_result = future.result()
+                if type(action_result) in CONTROLS:
+                    raise unsupported(action_result, DAG)
+
+                record(frame, node.spec, action_result)
+                values[node.index] = frame.last_result
+
+                for dependent in node.dependents:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        ready.append(nodes[dependent])
+
+    except Exception as e:
+        # 取消尚未开始的action 等待已开始的action: 其副作用与事件不会发生在Plan结束之后
+        for future in running:
+            future.cancel()
+        wait(running)
+
+        plan_exception = wrap_exception(e, frame, [])
+        close_frames([frame])
+        plan_end(frame, e)
+
+        raise plan_exception from None
+
+    frame.last_result = values[-1] if values else None
+    close_frames([frame])
+    plan_end(frame)
+
+    return frame.last_result
@@ -0,0 +1,623 @@
+# -*- coding: utf-8 -*-
+"""engine - 执行引擎
+
+#. 将嵌套的Plan展开为一条扁平的指令流 以ENTER/EXIT标记每一层
+#. 以显式的帧栈代替递归调用 嵌套深度不受Python递归深度限制
+#. 保持原有语义: result向下渗透 result_mapper与action_mapper逐层合并 异常逐层追溯
+
+"""
+from __future__ import annotations
+
+from collections import ChainMap
+from contextvars import copy_context
+from types import MappingProxyType
+from time import perf_counter_ns
+from typing import Any, List, Tuple, Iterable, Iterator, Callable, Optional
+
+from planner.control import Stop, Skip, Branch, Jump
+from planner.error import PlanException
+from planner.hooks import PLAN_START, PLAN_END, ACTION_START, ACTION_END, ACTION_ERROR, subscribers, current_path, emit
+from planner.log import OutputRecord, START, DONE, submit
+
+NO_ARGUMENT = 'no_argument'
+"""调用方式: 没有参数"""
+POSITIONAL = 'positional'
+"""调用方式: 有且只有一个参数 传入上一个action的结果"""
+VAR_KEYWORD = 'var_keyword'
+"""调用方式: 不定参数 传入执行参数"""
+PLAN = 'plan'
+"""调用方式: 嵌套的Plan 会被展开到外层的指令流中"""
+NAMED = 'named'
+"""调用方式: 多个位置参数 按名称传入依赖的action的结果(仅DAG模式)"""
+
+LINEAR = 'linear'
+"""执行模式: 按顺序执行"""
+DAG = 'dag'
+"""执行模式: 按依赖关系并发执行"""
+STREAM = 'stream'
+"""执行模式: 流式执行 第一个action的结果被逐项传给之后的action"""
+
+CALL = 'call'
+"""指令: 调用一个action"""
+ENTER = 'enter'
+"""指令: 进入一个嵌套的Plan"""
+EXIT = 'exit'
+"""指令: 退出一个嵌套的Plan 其结果作为外层action的结果"""
+
+RAISE = 'raise'
+"""批量执行的异常处理: 抛出"""
+SKIP = 'skip'
+"""批量执行的异常处理: 跳过"""
+YIELD = 'yield'
+"""批量执行的异常处理: 作为结果返回"""
+
+Instruction = Tuple[str, Any, int, tuple]
+"""(指令, action的编译结果, action在所属Plan中的序号, 嵌套Plan的编译结果)"""
+
+
+RESERVED_PARAMETERS = ('result', 'result_mapper', 'action_mapper')
+"""由执行引擎传入不定参数action的参数"""
+
+SPECIAL_RESULTS = frozenset((dict, Stop, Skip, Branch))
+"""需要额外处理的action结果类型: 特殊返回值 与控制执行流程的返回值(planner.control)"""
+
+
+class Frame(object):
+    """一层Plan的运行状态
+
+    不定参数action得到的result_mapper与action_mapper是只读的分层视图(ChainMap):
+    内层的视图叠加在外层的视图之上 每层只创建一次 不复制任何结果。
+    执行参数在各层之间共享 仅在被特殊返回值修改时复制。
+    """
+
+    __slots__ = ('plan', 'specs', 'parameter', 'owned', 'result', 'results', 'result_maps', 'action_maps',
+                 'result_mapper', 'action_mapper', 'last_result', 'index', 'start', 'parent', 'path')
+
+    def __init__(self, plan, specs: tuple, parameter: dict, results: dict):
+        result = None
+        result_maps = action_maps = ()
+
+        # 外部传入的result/result_mapper/action_mapper(例如未展开的Plan)作为外层
+        if 'result' in parameter or 'result_mapper' in parameter or 'action_mapper' in parameter:
+            result = parameter.get('result')
+            if (result_mapper := parameter.get('result_mapper')) is not None:
+                result_maps = (result_mapper,)
+            if (action_mapper := parameter.get('action_mapper')) is not None:
+                action_maps = (action_mapper,)
+            parameter = {k: v for k, v in parameter.items() if k not in RESERVED_PARAMETERS}
+
+        self._setup(plan, specs, parameter, True, result, results, result_maps, action_maps)
+
+    def _setup(self, plan, specs, parameter, owned, result, results, result_maps, action_maps):
+        self.plan = plan
+        self.specs = specs
+        self.parameter = parameter
+        """执行参数(不包含result/result_mapper/action_mapper)"""
+        self.owned = owned
+        """执行参数是否属于此帧 否则在修改前复制"""
+        self.result = result
+        """第一个action之前的result: 由外层传入"""
+        self.results = results
+
+        # 每层的视图直接由所有层的字典组成 查找时不会逐层递归
+        self.result_maps = (results,) + result_maps
+        self.action_maps = action_maps + (plan.action_table(),)
+        self.result_mapper = MappingProxyType(ChainMap(*self.result_maps) if result_maps else results)
+        self.action_mapper = MappingProxyType(ChainMap(*self.action_maps)) if action_maps else self.action_maps[0]
+
+        self.last_result = None
+        self.index = 0
+        self.start = None
+        """打印/事件: (开始时间, 路径, current_path的token)"""
+        self.parent = None
+        self.path = None
+
+    def child(self, plan, specs: tuple, results: dict) -> Frame:
+        """嵌套Plan的帧: 共享执行参数 视图叠加在此帧之上"""
+        frame = Frame.__new__(Frame)
+        result = self.last_result if self.last_result is not None else self.result
+
+        frame._setup(plan, specs, self.parameter, False, result, results, self.result_maps, self.action_maps)
+        frame.parent = self
+
+        return frame
+
+    def update_parameter(self, values: dict) -> None:
+        """特殊返回值: 合并到执行参数"""
+        if not self.owned:
+            self.parameter = dict(self.parameter)
+            self.owned = True
+
+        for key, value in values.items():
+            if key == 'result':
+                self.result = value
+            elif key not in RESERVED_PARAMETERS:
+                self.parameter[key] = value
+
+
+def flatten(plan) -> Tuple[Instruction, ...]:
+    """将Plan展开为扁平的指令流
+
+    使用显式的栈 不受递归深度限制。Plan包含自身时抛出RecursionError
+    """
+    instructions: List[Instruction] = []
+
+    # (Plan, 剩余的action, 进入此Plan的指令)
+    stack = [(plan, iter(enumerate(plan.compile())), None)]
+
+    while stack:
+        current_plan, remaining, enter = stack[-1]
+
+        for index, spec in remaining:
+            if spec.kind is PLAN:
+                inner_plan = spec.plan
+
+                if any(inner_plan is _[0] for _ in stack):
+                    raise RecursionError(f'Plan {inner_plan.__name__} contains itself.')
+
+                specs = inner_plan.compile()
+                enter = (ENTER, spec, index, specs)
+                instructions.append(enter)
+                stack.append((inner_plan, iter(enumerate(specs)), enter))
+                break
+
+            instructions.append((CALL, spec, index, ()))
+        else:
+            stack.pop()
+            if enter is not None:
+                instructions.append((EXIT, enter[1], enter[2], ()))
+
+    return tuple(instructions)
+
+
+def keyword_parameter(frame: Frame) -> dict:
+    """构造不定参数action的参数字典"""
+    last_result = frame.last_result
+
+    # 如果是当前Plan第一个action 则试图从执行参数中获取result
+    # *result可以向下渗透
+    if last_result is None:
+        last_result = frame.result
+
+    return {
+        **frame.parameter,
+        'result': last_result,
+        'result_mapper': frame.result_mapper,
+        'action_mapper': frame.action_mapper,
+    }
+
+
+def call_action(frame: Frame, spec, target=None) -> Any:
+    """根据编译好的调用方式调用单个action"""
+    kind = spec.kind
+    target = target or spec.target
+
+    # case: 没有参数
+    if kind is NO_ARGUMENT:
+        return target()
+
+    # case: 有且只有一个给定的参数
+    elif kind is POSITIONAL:
+        return target(frame.last_result)
+
+    # case: 不定参数 / 未展开的Plan
+    else:
+        last_result = frame.last_result
+
+        return target(**frame.parameter, result=last_result if last_result is not None else frame.result,
+                      result_mapper=frame.result_mapper, action_mapper=frame.action_mapper)
+
+
+def record(frame: Frame, spec, action_result) -> None:
+    """记录action结果 并作为下一个action的输入
+
+    Raises:
+        Jump: 控制执行流程的返回值 由运行指令流的循环处理
+    """
+    frame.results[spec.name] = action_result
+
+    if type(action_result) in SPECIAL_RESULTS:
+        action_result = special_result(frame, spec, action_result)
+
+    frame.last_result = action_result
+
+
+def special_result(frame: Frame, spec, action_result) -> Any:
+    """特殊返回值: {'pass': ...}合并到执行参数; Stop/Skip/Branch改变之后的执行顺序"""
+    if type(action_result) is dict:
+        if 'pass' in action_result:
+            frame.update_parameter(action_result)
+            action_result = action_result.get('result')
+        return action_result
+
+    # Branch的结果在其Plan结束时记录
+    if type(action_result) is Branch:
+        frame.results.pop(spec.name, None)
+    else:
+        frame.results[spec.name] = frame.last_result = action_result.value
+
+    raise Jump(action_result, frame.index)
+
+
+def frame_path(frame: Frame) -> str:
+    """帧的嵌套路径: 最外层为Plan名称(或者运行它的action的路径) 内层为外层action的路径"""
+    if frame.path is None:
+        parent = frame.parent
+        if parent is None:
+            frame.path = current_path.get() or frame.plan.__name__
+        else:
+            frame.path = action_path(parent, parent.specs[parent.index])
+
+    return frame.path
+
+
+def action_path(frame: Frame, spec) -> str:
+    """action的嵌套路径 例如 Outer/[2] Inner/[1] parse"""
+    return f'{frame_path(frame)}/[{frame.index + 1}] {spec.name}'
+
+
+def output_start(plan, spec, path: Optional[str]) -> None:
+    """打印action开始信息: 放入输出队列 由后台线程写出"""
+    submit(OutputRecord(START, plan, spec, path))
+
+
+def output_done(plan, spec, path: Optional[str], duration_ns: int, action_result) -> None:
+    """打印action结束信息: 结果在写出时才格式化"""
+    submit(OutputRecord(DONE, plan, spec, path, duration_ns, action_result))
+
+
+def action_start(plan, spec, path: Optional[str] = None) -> tuple:
+    """action开始: 打印信息 有路径(存在订阅者或者需要打印)时发送事件
+
+    Returns:
+        (开始时间, 路径, current_path的token)
+    """
+    if plan.is_output:
+        output_start(plan, spec, path)
+
+    token = current_path.set(path) if path is not None else None
+    start = perf_counter_ns()
+
+    if path is not None:
+        emit(ACTION_START, plan, spec.name, path, start, action=spec.action)
+
+    return start, path, token
+
+
+def action_end(plan, spec, started: tuple, action_result=None, error: Optional[BaseException] = None) -> None:
+    """action结束或出错: 打印信息 发送事件"""
+    end = perf_counter_ns()
+    start, path, token = started
+
+    if token is not None:
+        current_path.reset(token)
+
+    if path is not None:
+        emit(ACTION_END if error is None else ACTION_ERROR, plan, spec.name, path, end, end - start,
+             spec.action, action_result, error)
+
+    if error is None and plan.is_output:
+        output_done(plan, spec, path, end - start, action_result)
+
+
+def observed_call(plan, spec, path: Optional[str], call: Callable, /, *args, **kwargs) -> Any:
+    """在打印信息/发送事件的同时调用action"""
+    started = action_start(plan, spec, path)
+
+    try:
+        action_result = call(*args, **kwargs)
+    except Exception as e:
+        action_end(plan, spec, started, error=e)
+        raise
+
+    action_end(plan, spec, started, action_result)
+
+    return action_result
+
+
+def plan_start(frame: Frame) -> None:
+    """最外层的帧开始: 存在订阅者时发送事件"""
+    if subscribers:
+        path = frame_path(frame)
+        frame.start = (perf_counter_ns(), path, None)
+        emit(PLAN_START, frame.plan, frame.plan.__name__, path, frame.start[0])
+
+
+def plan_end(frame: Frame, error: Optional[BaseException] = None) -> None:
+    """一层Plan结束或出错: 开始时发送过事件时发送结束事件"""
+    if frame.start is not None and frame.start[1] is not None:
+        end = perf_counter_ns()
+        emit(PLAN_END, frame.plan, frame.plan.__name__, frame.start[1], end, end - frame.start[0],
+             result=frame.last_result if error is None else None, error=error)
+
+
+def fail_frames(frames: List[Frame], error: BaseException) -> None:
+    """由内向外 结束出错的每一层Plan与对应的外层action"""
+    for index in range(len(frames) - 1, -1, -1):
+        frame = frames[index]
+        if frame.start is None:
+            continue
+
+        plan_end(frame, error)
+
+        if index:
+            outer = frames[index - 1]
+            action_end(outer.plan, outer.specs[outer.index], frame.start, error=error)
+
+
+def invoke(frame: Frame, spec) -> Any:
+    """调用单个action 存在订阅者或需要打印时发送事件/打印信息 返回action的原始结果"""
+    plan = frame.plan
+
+    if subscribers or plan.is_output:
+        return observed_call(plan, spec, action_path(frame, spec), call_action, frame, spec)
+
+    return call_action(frame, spec)
+
+
+async def ainvoke(frame: Frame, spec, executor=None) -> Any:
+    """异步调用单个action: 协程await 阻塞函数放入线程池 其余直接运行 返回action的原始结果"""
+    plan = frame.plan
+    started = None
+
+    if subscribers or plan.is_output:
+        started = action_start(plan, spec, action_path(frame, spec))
+
+    try:
+        if spec.async_target is not None:
+            action_result = await call_action(frame, spec, spec.async_target)
+        elif spec.options.get('blocking'):
+            from asyncio import get_running_loop
+            action_result = await get_running_loop().run_in_executor(
+                executor, copy_context().run, call_action, frame, spec
+            )
+        else:
+            action_result = call_action(frame, spec)
+    except Exception as e:
+        if started is not None:
+            action_end(plan, spec, started, error=e)
+        raise
+
+    if started is not None:
+        action_end(plan, spec, started, action_result)
+
+    return action_result
+
+
+def new_frame(plan, specs: tuple, parameter: dict) -> Frame:
+    """进入一层Plan: 由result_store创建新的结果字典"""
+    return Frame(plan, specs, parameter, plan.result_store.begin(plan))
+
+
+def close_frames(frames: List[Frame]) -> None:
+    """退出一层或多层Plan: 通知result_store执行结束"""
+    for frame in reversed(frames):
+        frame.plan.result_store.end(frame.plan, frame.results)
+
+
+def enter_plan(frame: Frame, spec, specs: tuple, stack: List[Frame]) -> Frame:
+    """进入嵌套的Plan: 外层帧入栈 以不定参数的形式构造内层的执行参数"""
+    outer_plan = frame.plan
+    started = None
+
+    if subscribers or outer_plan.is_output:
+        started = action_start(outer_plan, spec, action_path(frame, spec))
+
+    stack.append(frame)
+    plan = spec.plan
+
+    frame = frame.child(plan, specs, plan.result_store.begin(plan))
+
+    # 内层帧记录外层action的开始信息 退出时使用
+    if started is not None:
+        frame.start = started
+        if (path := started[1]) is not None:
+            frame.path = path
+            emit(PLAN_START, plan, plan.__name__, path, started[0])
+
+    return frame
+
+
+def exit_plan(frame: Frame, spec, stack: List[Frame]) -> Frame:
+    """退出嵌套的Plan: 内层的最终结果作为外层action的结果"""
+    action_result = frame.last_result
+    close_frames([frame])
+    plan_end(frame)
+    started = frame.start
+
+    frame = stack.pop()
+
+    if started is not None:
+        action_end(frame.plan, spec, started, action_result)
+
+    record(frame, spec, action_result)
+
+    return frame
+
+
+def trace_exception(exception: PlanException, frames: List[Frame]) -> PlanException:
+    """记录由外向内每一层的帧: 出错action的路径在访问时才生成"""
+    exception.add_frames(frames)
+
+    return exception
+
+
+def wrap_exception(e: Exception, frame: Frame, stack: List[Frame]) -> PlanException:
+    """包装异常 并记录每一层出错的action"""
+    stack.append(frame)
+
+    # 未展开的Plan抛出的异常 已经包含内层的路径
+    if isinstance(e, PlanException):
+        return trace_exception(e, stack)
+
+    plan_exception = PlanException(e, frame.plan, origin_action=frame.specs[frame.index].action)
+
+    return trace_exception(plan_exception, stack)
+
+
+def run(plan, execute_parameter: dict) -> Any:
+    """运行Plan的扁平指令流"""
+    return execute_instructions(plan.instructions(), new_frame(plan, plan.compile(), execute_parameter))
+
+
+class CallStrategy(object):
+    """指令流中调用action的方式: 检查点与增量执行替换其中的方法 运行指令流的循环只有一份
+
+    call/acall返回action的原始结果; enter/exit在进入/退出嵌套的Plan之前调用
+    """
+
+    __slots__ = ()
+
+    def call(self, frame: Frame, spec, stack: List[Frame]) -> Any:
+        return invoke(frame, spec)
+
+    async def acall(self, frame: Frame, spec, stack: List[Frame], executor=None) -> Any:
+        return await ainvoke(frame, spec, executor)
+
+    def enter(self, frame: Frame) -> None:
+        pass
+
+    def exit(self, frame: Frame) -> None:
+        pass
+
+
+def fail_execution(e: Exception, frame: Frame, stack: List[Frame]) -> PlanException:
+    """运行指令流出错: 包装异常 结束未退出的每一层Plan"""
+    plan_exception = wrap_exception(e, frame, stack)
+    close_frames(stack)
+    fail_frames(stack, e)
+
+    return plan_exception
+
+
+def execute_instructions(instructions: Tuple[Instruction, ...], frame: Frame, strategy: CallStrategy = None) -> Any:
+    """从最外层的帧开始运行指令流
+
+    Args:
+        instructions: 扁平的指令流
+        frame: 最外层的帧
+        strategy: 调用action的方式 为None时直接调用
+    """
+    stack: List[Frame] = []
+    plan_start(frame)
+
+    iterator = iter(instructions)
+
+    try:
+        while True:
+            try:
+                for op, spec, index, specs in iterator:
+                    if op is CALL:
+                        frame.index = index
+                        if strategy is None:
+                            record(frame, spec, invoke(frame, spec))
+                        else:
+                            record(frame, spec, strategy.call(frame, spec, stack))
+
+                    elif op is ENTER:
+                        frame.index = index
+                        if strategy is not None:
+                            strategy.enter(frame)
+                        frame = enter_plan(frame, spec, specs, stack)
+
+                    else:
+                        if strategy is not None:
+                            strategy.exit(frame)
+                        frame = exit_plan(frame, spec, stack)
+
+                break
+
+            # 控制执行流程的返回值: 从剩余的指令继续
+            except Jump as jump:
+                iterator = jump.resume(iterator)
+
+    except Exception as e:
+        raise fail_execution(e, frame, stack) from None
+
+    close_frames([frame])
+    plan_end(frame)
+
+    return frame.last_result
+
+
+def run_many(plan, parameters: Iterable[dict], errors: str = RAISE, runner: Callable = None) -> Iterator[Any]:
+    """以每个执行参数运行Plan 逐个返回结果
+
+    指令流与编译结果在所有输入之间复用
+
+    Args:
+        plan: 需要运行的Plan
+        parameters: 执行参数(dict)的迭代器
+        errors: 单个输入失败时 raise(抛出) skip(跳过) yield(返回PlanException)
+        runner: 运行单个输入的函数 默认为运行扁平指令流
+    """
+    if runner is None:
+        instructions = plan.instructions()
+        specs = plan.compile()
+
+        def runner(execute_parameter: dict) -> Any:
+            return execute_instructions(instructions, new_frame(plan, specs, execute_parameter))
+
+    for execute_parameter in parameters:
+        try:
+            # 复制执行参数: 特殊返回值会修改执行参数
+            result = runner(dict(execute_parameter))
+        except PlanException as pe:
+            if errors == RAISE:
+                raise
+            elif errors == YIELD:
+                yield pe
+            continue
+
+        yield result
+
+
+async def arun(plan, execute_parameter: dict, executor=None, strategy: CallStrategy = None) -> Any:
+    """异步运行Plan的扁平指令流"""
+    return await aexecute_instructions(plan.instructions(), new_frame(plan, plan.compile(), execute_parameter),
+                                       executor, strategy)
+
+
+async def aexecute_instructions(instructions: Tuple[Instruction, ...], frame: Frame, executor=None,
+                                strategy: CallStrategy = None) -> Any:
+    """从最外层的帧开始异步运行指令流: 与execute_instructions相同"""
+    stack: List[Frame] = []
+    plan_start(frame)
+
+    iterator = iter(instructions)
+
+    try:
+        while True:
+            try:
+                for op, spec, index, specs in iterator:
+                    if op is CALL:
+                        frame.index = index
+                        if strategy is None:
+                            record(frame, spec, await ainvoke(frame, spec, executor))
+                        else:
+                            record(frame, spec, await strategy.acall(frame, spec, stack, executor))
+
+                    elif op is ENTER:
+                        frame.index = index
+                        if strategy is not None:
+                            strategy.enter(frame)
+                        frame = enter_plan(frame, spec, specs, stack)
+
+                    else:
+                        if strategy is not None:
+                            strategy.exit(frame)
+                        frame = exit_plan(frame, spec, stack)
+
+                break
+
+            # 控制执行流程的返回值: 从剩余的指令继续
+            except Jump as jump:
+                iterator = jump.resume(iterator)
+
+    except Exception as e:
+        raise fail_execution(e, frame, stack) from None
+
+    close_frames([frame])
+    plan_end(frame)
+
+    return frame.last_result
@@ -3,13 +3,18 @@
 
 #. 可以定位行号
 #. 可以追溯异常错误
+#. 执行引擎只记录出错时的帧 每层的路径在首次访问时生成 异常信息在str()时才格式化
 
 """
 from __future__ import annotations
 
 import linecache
+import pickle
+import reprlib
+import warnings
+from collections.abc import Sequence as SequenceABC
 from types import FunctionType, MethodType
-from typing import List, Tuple, Iterable
+from typing import List, Tuple, Iterable, Optional, Sequence
 
 line_mask = (-2, -1, 0, 1, 2)
 
@@ -42,10 +47,35 @@ def get_action_name(action):
         return f'(Other) {str(action)}'
 
 
-def get_error_line(origin_exception: Exception):
-    # reduce -> lambda in reduce -> execute_single_actions -> target function
-    tb = origin_exception.__traceback__.tb_next.tb_next.tb_next
-    target_line = tb.tb_frame.f_lineno - 1
+def get_action_code(action):
+    """获取一个函数/方法的code对象"""
+    # 函数/方法 或者 可调用对象的__call__
+    for target in (action, getattr(action, '__call__', None)):
+        if (code := getattr(target, '__code__', None)) is not None:
+            return code
+
+
+def get_action_traceback(origin_exception: Exception, action=None):
+    """定位action所在的traceback
+
+    优先按action的code对象查找 找不到时取执行引擎的下一帧
+    """
+    tb = origin_exception.__traceback__
+
+    if (code := get_action_code(action)) is not None:
+        target = tb
+        while target is not None:
+            if target.tb_frame.f_code is code:
+                return target
+            target = target.tb_next
+
+    # engine -> target function
+    return tb.tb_next or tb
+
+
+def get_error_line(origin_exception: Exception, action=None):
+    tb = get_action_traceback(origin_exception, action)
+    target_line = tb.tb_lineno - 1
 
     error_file_content = linecache.getlines(tb.tb_frame.f_code.co_filename)
     error_lines = [f'Package <{tb.tb_frame.f_globals["__name__"]}> File <{tb.tb_frame.f_code.co_filename}>\n']
@@ -61,52 +91,210 @@ def get_error_line(origin_exception: Exception):
     return ''.join(error_lines)
 
 
+def portable_exception(exception: Exception) -> Exception:
+    """可以跨进程传递的异常: 不能序列化时以RuntimeError代替"""
+    try:
+        pickle.dumps(exception)
+    except Exception:
+        return RuntimeError(f'{exception.__class__.__name__}: {exception}')
+    return exception
+
+
+def _rebuild_plan_exception(exception_class, origin_exception: Exception, origin_plan: str, trace: list,
+                            error_content: str, item: Optional[tuple] = None, execution_id: Optional[str] = None):
+    exception = exception_class.__new__(exception_class)
+    Exception.__init__(exception)
+
+    exception.origin_exception = origin_exception
+    exception.origin_plan = origin_plan
+    exception.origin_action = None
+    exception._levels = []
+    exception._trace = trace
+    exception.item = item
+    exception.execution_id = execution_id
+    exception.error_content = error_content
+
+    return exception
+
+
+def portable_item(item: Optional[tuple]) -> Optional[tuple]:
+    """可以跨进程传递的出错项: 不能序列化时以其repr代替"""
+    if item is not None:
+        try:
+            pickle.dumps(item)
+        except Exception:
+            return item[0], reprlib.repr(item[1])
+    return item
+
+
+def format_level(actions: Sequence, index: int) -> List[Tuple[bool, str]]:
+    """格式化一层Plan的路径: index为出错action的序号"""
+    current_trace = []
+
+    for action_index, action in enumerate(actions):
+        action_name = get_action_name(action)
+
+        if action_index == index:
+            current_trace.append((True, f'{error_line_mark} [{action_index + 1}] {action_name}'))
+        else:
+            current_trace.append((False, f'{normal_line_mark} [{action_index + 1}] {action_name}'))
+
+    return current_trace
+
+
+def find_action_index(actions: Sequence, exception: BaseException) -> int:
+    """按traceback中的code对象查找出错action的序号 找不到时为-1"""
+    codes = set()
+    tb = exception.__traceback__
+    while tb is not None:
+        codes.add(tb.tb_frame.f_code)
+        tb = tb.tb_next
+
+    for index, action in enumerate(actions):
+        if get_action_code(action) in codes:
+            return index
+    return -1
+
+
+class SpecActions(SequenceABC):
+    """编译结果中的action: 异常格式化时才读取 不复制"""
+
+    __slots__ = ('specs',)
+
+    def __init__(self, specs: tuple):
+        self.specs = specs
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __getitem__(self, index):
+        return self.specs[index].action
+
+
+class ActionTimeout(TimeoutError):
+    """action超过注册时给定的timeout"""
+
+
 class PlanException(Exception):
+    """包装action抛出的异常 记录出错action在每一层Plan中的位置
+
+    出错时只赋值必需的属性 其余属性的默认值为类属性; 路径在首次访问levels/trace时生成
+    """
+
+    error_lines: int = 5
 
-    def __init__(self, origin_exception: Exception, origin_plan, error_lines=5):
+    item: Optional[Tuple[int, object]] = None
+    """流模式: 出错的项(数据源中的序号, 项)"""
+
+    execution_id: Optional[str] = None
+    """使用检查点时: 此次执行的标识 用于恢复执行"""
+
+    error_content: Optional[str] = None
+    """出错位置的代码(格式化后): 从其他进程传递而来时使用"""
+
+    _levels: Optional[List[Tuple[object, Sequence, int]]] = None
+    _pending: tuple = ()
+    """尚未生成的路径: 由内向外添加的(Plan, actions, 序号) 或者执行引擎由外向内的帧列表"""
+    _trace: Optional[List[List[Tuple[bool, str]]]] = None
+
+    def __init__(self, origin_exception: Exception, origin_plan, error_lines=5, origin_action=None):
         self.origin_exception = origin_exception
-        self.origin_plan = origin_plan
-        self.error_lines: int = error_lines
         # FIXME: Plan typing
-        self.trace: List[List[Tuple[bool, str]]] = []
+        self.origin_plan = origin_plan
+        self.origin_action = origin_action
+        if error_lines != 5:
+            self.error_lines = error_lines
         super().__init__()
 
-    def add_origin_exception(self, plan, e):
-        """添加原始异常类"""
-        # reduce -> lambda in reduce -> execute_single_actions
-        failed_tb = e.__traceback__.tb_next.tb_next.tb_next
-        current_trace = []
+    def __reduce__(self):
+        """跨进程传递: 路径与出错位置在序列化时格式化为文本 origin_plan仅保留名称
 
-        for index, action in enumerate(plan.actions):
-            action_name = get_action_name(action)
+        反序列化后仍然可以添加外层的路径(例如在其他进程中运行的Plan作为本地Plan的action)
+        """
+        plan = self.origin_plan
 
-            if hasattr(action, "__code__") and action.__code__.co_code == failed_tb.tb_frame.f_code.co_code:
-                current_trace.append((True, f'{error_line_mark} [{index + 1}] {action_name}'))
-            else:
-                current_trace.append((False, f'{normal_line_mark} [{index + 1}] {action_name}'))
+        return _rebuild_plan_exception, (self.__class__, portable_exception(self.origin_exception),
+                                         getattr(plan, '__name__', plan), self.trace, self.get_error_content(),
+                                         portable_item(self.item), self.execution_id)
+
+    def get_error_content(self) -> str:
+        """出错位置的代码"""
+        if self.error_content is None:
+            return get_error_line(self.origin_exception, self.origin_action)
+        return self.error_content
+
+    @property
+    def levels(self) -> List[Tuple[object, Sequence, int]]:
+        """由外向内每一层的(Plan, actions, 出错action的序号) 首次访问时生成"""
+        if self._levels is None:
+            levels = []
+            for pending in reversed(self._pending):
+                if type(pending) is tuple:
+                    levels.append(pending)
+                else:
+                    levels.extend((frame.plan, SpecActions(frame.specs), frame.index) for frame in pending)
 
-        self.trace.insert(0, current_trace)
+            self._levels = levels
+            self._pending = ()
+        return self._levels
 
-    def add_plan_exception(self, plan, e):
-        """plan异常
+    @property
+    def trace(self) -> List[List[Tuple[bool, str]]]:
+        """每一层Plan的路径(格式化后) 首次访问时生成"""
+        if self._trace is None:
+            self._trace = [format_level(actions, index) for _, actions, index in self.levels]
+        return self._trace
+
+    @property
+    def action_path(self) -> Tuple[Tuple[str, int], ...]:
+        """由外向内每一层的(Plan名称, 出错action的序号)"""
+        return tuple((plan.__name__, index) for plan, _, index in self.levels)
+
+    def add_action_trace(self, plan, index: int, actions: Sequence = None):
+        """添加一层Plan的路径: index为出错action的序号
+
+        由内向外逐层添加 只记录序号 不做任何格式化
 
-        如果为Plan异常，则action必定为Plan类。
+        Args:
+            plan: 出错的Plan
+            index: 出错action的序号
+            actions: 此Plan的action 默认为plan.actions
         """
+        actions = plan.actions if actions is None else actions
 
-        execute_tb = e.__traceback__.tb_next.tb_next
+        if self._levels is None:
+            self._pending += ((plan, actions, index),)
+            return
 
-        current_trace = []
+        self._levels.insert(0, (plan, actions, index))
+        if self._trace is not None:
+            self._trace.insert(0, format_level(actions, index))
 
-        for index, action in enumerate(plan.actions):
-            action_name = get_action_name(action)
+    def add_frames(self, frames: list):
+        """执行引擎: 添加由外向内每一层出错时的帧
 
-            # 如果是执行的plan类
-            if action is execute_tb.tb_frame.f_locals['action']:
-                current_trace.append((True, f'{error_line_mark} [{index + 1}] {action_name}'))
-            else:
-                current_trace.append((False, f'{normal_line_mark} [{index + 1}] {action_name}'))
+        只保存帧的列表 其Plan、编译结果与出错action的序号在访问levels时读取 帧在出错后不再改变
+        """
+        if self._levels is None:
+            self._pending += (frames,)
+            return
+
+        for frame in reversed(frames):
+            self.add_action_trace(frame.plan, frame.index, SpecActions(frame.specs))
+
+    def add_origin_exception(self, plan, e):
+        """已废弃: 使用add_action_trace 按traceback查找出错的action"""
+        warnings.warn('add_origin_exception() is deprecated, use add_action_trace().', DeprecationWarning,
+                      stacklevel=2)
+        self.add_action_trace(plan, find_action_index(plan.actions, e))
 
-        self.trace.insert(0, current_trace)
+    def add_plan_exception(self, plan, e):
+        """已废弃: 使用add_action_trace 出错的action为e所属的Plan"""
+        warnings.warn('add_plan_exception() is deprecated, use add_action_trace().', DeprecationWarning,
+                      stacklevel=2)
+        inner_plan = e.levels[0][0] if isinstance(e, PlanException) and e.levels else getattr(e, 'origin_plan', None)
+        index = next((index for index, action in enumerate(plan.actions) if action is inner_plan), -1)
+        self.add_action_trace(plan, index)
 
     def get_plan_trace(self, level=0) -> Iterable[str]:
         """获取Plan的路径"""
@@ -131,11 +319,15 @@ class PlanException(Exception):
         origin_error = self.origin_exception
         plan = self.origin_plan
 
-        error_content = get_error_line(origin_error)
+        error_content = self.get_error_content()
 
-        plan_hand = f'Plan [{plan.__name__}]:\n'
+        plan_hand = f'Plan [{getattr(plan, "__name__", plan)}]:\n'
         error_hand = f'Raise [{origin_error.__class__.__name__}]. Message:{str(origin_error)}\n'
 
         plan_content = '\n'.join(list(self.get_plan_trace()))
 
+        if self.item is not None:
+            item_content = reprlib.repr(self.item[1])
+            error_hand = f'{error_hand}Item [{self.item[0]}]: {item_content}\n'
+
         return f'{horizon_line}{error_hand}{horizon_line}{plan_hand}{horizon_line}{plan_content}\n{horizon_line}{error_content}'
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+"""history - 持久化的执行记录与耗时统计
+
+Plan.recorder不为None时 抽样的每次执行结束后记录一行到SQLite:
+
+    >>> Plan.recorder = HistoryRecorder('history.sqlite3', sample=10)
+    >>> ...
+    >>> History('history.sqlite3').percentiles(since='24h')
+
+#. 每次执行一行: 执行标识、开始时间、Plan名称、耗时、是否成功、异常类型、结果的长度(可以取len时)
+#. 其中每个action(包括嵌套Plan中的action)以JSON保存: 路径、相对开始时间、耗时、异常类型、结果的长度
+#. 路径以执行的Plan名称开头 例如 Outer/[2] Inner/[1] parse (在其他action中运行时去掉外层的前缀)
+#. 记录先放入内存 由后台线程每flush_interval秒(或者积累batch_size次执行时)批量写入; 积压超过max_pending次时丢弃
+#. History(只读): 耗时分位数、最慢的action、按时间窗口的失败率、嵌套Plan的关键路径
+#. 命令行: planner-history percentiles|slowest|failures|critical-path --db history.sqlite3
+
+基于运行事件(planner.hooks) 没有执行被抽样时不产生开销。
+
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from time import perf_counter_ns, time, time_ns
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from planner.hooks import PLAN_END, ACTION_END, ACTION_ERROR, Event, LatencyHistogram, current_path, subscribe, unsubscribe
+
+PLAN = 'plan'
+"""记录: 一次执行"""
+ACTION = 'action'
+"""记录: 一个action"""
+
+PERCENTILES = (50, 95, 99)
+
+SLOWEST_METRICS = ('mean_ms', 'max_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'total_ms')
+"""可以排序最慢action的指标"""
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS executions (
+    id INTEGER NOT NULL,
+    started REAL NOT NULL,
+    plan TEXT NOT NULL,
+    duration_ns INTEGER NOT NULL,
+    error TEXT,
+    result_size INTEGER,
+    actions TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS executions_plan_started ON executions (plan, started);
+'''
+"""actions: [[相对路径, 相对开始时间(纳秒), 耗时(纳秒), 异常类型, 结果的长度], ...]"""
+
+Row = Tuple[int, float, str, int, Optional[str], Optional[int], list]
+"""(执行标识, 开始时间(秒), Plan名称, 耗时(纳秒), 异常类型, 结果的长度, actions)"""
+
+Record = Tuple[float, str, str, str, int, Optional[str], Optional[int]]
+"""展开的记录: (开始时间(秒), Plan名称, 路径, 类型, 耗时(纳秒), 异常类型, 结果的长度)"""
+
+TimeLike = Union[None, float, int, str, datetime]
+"""时间: 秒数(epoch) datetime ISO格式 或者'30m'/'24h'/'7d'形式的距今时间"""
+
+_recording: ContextVar[Optional[Recording]] = ContextVar('planner_history_recording', default=None)
+"""当前执行所属的记录"""
+
+_DURATION = re.compile(r'^(\d+(?:\.\d+)?)([smhdw])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30)
+    # WAL: 写入时不阻塞查询 每次提交不等待落盘
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def connect_readonly(path: str) -> sqlite3.Connection:
+    """只读打开: 不创建数据库文件与表"""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f'history database {path} does not exist.')
+
+    return sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True, timeout=30)
+
+
+def result_size(result) -> Optional[int]:
+    """结果的长度: 不能取len时为None"""
+    try:
+        return len(result)
+    except Exception:
+        return None
+
+
+def parse_duration(value: Union[str, float]) -> float:
+    """'30m'/'24h'/'7d'形式的时间长度 转换为秒数"""
+    if isinstance(value, str) and (match := _DURATION.match(value.strip())):
+        return float(match.group(1)) * _UNITS[match.group(2)]
+    return float(value)
+
+
+def parse_time(value: TimeLike, now: float = None) -> Optional[float]:
+    """转换为秒数(epoch)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+
+    if _DURATION.match(value.strip()):
+        return (time() if now is None else now) - parse_duration(value)
+
+    return datetime.fromisoformat(value).timestamp()
+
+
+class Recording(object):
+    """一次被记录的执行"""
+
+    __slots__ = ('recorder', 'plan', 'root', 'start', 'actions', 'result')
+
+    def __init__(self, recorder: HistoryRecorder, plan: str, root: str):
+        self.recorder = recorder
+        self.plan = plan
+        self.root = root
+        """最外层Plan的路径: 记录时去掉此前缀"""
+        self.start = perf_counter_ns()
+        self.actions: List[list] = []
+        self.result = None
+
+    def row(self, error: Optional[BaseException]) -> Row:
+        end = perf_counter_ns()
+        started = (time_ns() - (end - self.start)) / 1e9
+
+        return (int.from_bytes(os.urandom(7), 'big'), started, self.plan, end - self.start,
+                None if error is None else type(error).__name__,
+                None if error is not None else result_size(self.result), self.actions)
+
+
+class HistoryRecorder(object):
+    """记录每次执行与其中每个action的耗时和结果
+
+    Args:
+        path: SQLite数据库文件
+        sample: 每sample次执行抽样记录1次
+        flush_interval: 后台写入的间隔(秒)
+        batch_size: 积累此数量的执行时立即写入
+        max_pending: 最多积压的执行数量 超过时丢弃新的记录
+    """
+
+    def __init__(self, path: str, sample: int = 1, flush_interval: float = 1.0, batch_size: int = 1000,
+                 max_pending: int = 100000):
+        if sample < 1:
+            raise ValueError(f'sample must be at least 1, got {sample}.')
+
+        self.path = path
+        self.sample = sample
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self.executions = 0
+        """已记录的执行次数"""
+        self.written = 0
+        """已写入的执行次数"""
+        self.dropped = 0
+        """因积压而丢弃的执行次数"""
+
+        self._pending: List[Row] = []
+        self._counter = count()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def __getstate__(self):
+        # 传递到其他进程时只保留配置
+        return {'path': self.path, 'sample': self.sample, 'flush_interval': self.flush_interval,
+                'batch_size': self.batch_size, 'max_pending': self.max_pending}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def sampled(self) -> bool:
+        """此次执行是否需要记录: 已经在记录中时返回False"""
+        return _recording.get() is None and next(self._counter) % self.sample == 0
+
+    @contextmanager
+    def capture(self, plan):
+        """记录其中运行的plan(包括其他线程中属于此上下文的action)"""
+        with self._lock:
+            if self._active == 0:
+                subscribe(self._on_event, (PLAN_END, ACTION_END, ACTION_ERROR))
+            self._active += 1
+            self.executions += 1
+            if self._thread is None:
+                self._start()
+
+        recording = Recording(self, plan.__name__, current_path.get() or plan.__name__)
+        token = _recording.set(recording)
+        error = None
+        try:
+            yield self
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _recording.reset(token)
+            row = recording.row(error)
+
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    unsubscribe(self._on_event)
+
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                else:
+                    self._pending.append(row)
+                    if len(self._pending) >= self.batch_size:
+                        self._wakeup.set()
+
+    def _on_event(self, event: Event) -> None:
+        recording = _recording.get()
+        if recording is None or recording.recorder is not self:
+            return
+
+        path, root = event.path, recording.root
+        if event.kind == PLAN_END:
+            # 嵌套Plan的结束与外层action的结束重复
+            if path == root:
+                recording.result = event.result
+            return
+
+        error = event.error
+        # 多个线程中的action: list.append是原子的
+        recording.actions.append([
+            path[len(root) + 1:] if path.startswith(root) else path, event.time_ns - event.duration_ns - recording.start,
+            event.duration_ns, None if error is None else type(error).__name__,
+            None if error is not None else result_size(event.result),
+        ])
+
+    def _start(self) -> None:
+        """启动后台写入线程 持有锁时调用"""
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='planner-history', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                from planner.hooks import logger
+                logger.exception(f'writing history to {self.path} failed.')
+
+    def flush(self) -> int:
+        """立即写入积压的记录 返回写入的执行次数"""
+        with self._write_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+
+            if not rows:
+                return 0
+
+            dumps = json.JSONEncoder(separators=(',', ':')).encode
+            connection = connect(self.path)
+            try:
+                with connection:
+                    connection.executemany('INSERT INTO executions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                           [row[:6] + (dumps(row[6]),) for row in rows])
+            finally:
+                connection.close()
+
+            self.written += len(rows)
+            return len(rows)
+
+    def close(self) -> None:
+        """写入积压的记录 结束后台线程"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._closed = True
+
+        if thread is not None:
+            atexit.unregister(self.close)
+            self._wakeup.set()
+            thread.join()
+
+        self.flush()
+
+
+class History(object):
+    """查询执行记录 只读打开数据库
+
+    Args:
+        path: SQLite数据库文件 不存在时查询抛出FileNotFoundError
+
+    时间参数可以是秒数(epoch)、datetime、ISO格式 或者'30m'/'24h'/'7d'形式的距今时间
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def records(self, plan: str = None, since: TimeLike = None, until: TimeLike = None, kind: str = None
+                ) -> Iterator[Record]:
+        """展开的记录: 每次执行(plan)及其中的每个action 时间范围按执行的开始时间"""
+        conditions, parameters = [], []
+        if plan is not None:
+            conditions.append('plan = ?')
+            parameters.append(plan)
+        if (since := parse_time(since)) is not None:
+            conditions.append('started >= ?')
+            parameters.append(since)
+        if (until := parse_time(until)) is not None:
+            conditions.append('started < ?')
+            parameters.append(until)
+
+        where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        columns = 'started, plan, duration_ns, error, result_size' + (', actions' if kind != PLAN else '')
+
+        connection = connect_readonly(self.path)
+        try:
+            for row in connection.execute(f'SELECT {columns} FROM executions{where} ORDER BY started', parameters):
+                started, plan_name, duration_ns, error, size = row[:5]
+                if kind != ACTION:
+                    yield started, plan_name, plan_name, PLAN, duration_ns, error, size
+                if kind != PLAN:
+                    for path, offset, action_duration, action_error, action_size in json.loads(row[5]):
+                        yield (started + offset / 1e9, plan_name, f'{plan_name}/{path}', ACTION, action_duration,
+                               action_error, action_size)
+        finally:
+            connection.close()
+
+    def plans(self) -> List[str]:
+        """记录中的Plan名称"""
+        connection = connect_readonly(self.path)
+        try:
+            return [_[0] for _ in connection.execute('SELECT DISTINCT plan FROM executions ORDER BY plan')]
+        finally:
+            connection.close()
+
+    def percentiles(self, plan: str = None, since: TimeLike = None, until: TimeLike = None, kind: str = None
+                    ) -> List[Dict]:
+        """每个路径的耗时分布
+
+        Returns:
+            [{plan, path, kind, count, errors, error_rate, mean_ms, max_ms, p50_ms, p95_ms, p99_ms, mean_result_size}]
+        """
+        stats: Dict[str, list] = {}
+
+        for _, plan_name, path, row_kind, duration_ns, error, size in self.records(plan, since, until, kind):
+            entry = stats.get(path)
+            if entry is None:
+                entry = stats[path] = [plan_name, row_kind, LatencyHistogram(), 0, 0, 0]
+            entry[2].record(duration_ns)
+            entry[3] += error is not None
+            if size is not None:
+                entry[4] += size
+                entry[5] += 1
+
+        result = []
+        for path, (plan_name, row_kind, histogram, errors, size_total, sized) in sorted(stats.items()):
+            metrics = {
+                'plan': plan_name,
+                'path': path,
+                'kind': row_kind,
+                'count': histogram.count,
+                'errors': errors,
+                'error_rate': errors / histogram.count,
+                'mean_ms': histogram.mean / 1e6,
+                'max_ms': histogram.max / 1e6,
+            }
+            for q in PERCENTILES:
+                metrics[f'p{q}_ms'] = histogram.percentile(q) / 1e6
+            metrics['mean_result_size'] = size_total / sized if sized else None
+            result.append(metrics)
+
+        return result
+
+    def slowest(self, limit: int = 10, by: str = 'p95_ms', plan: str = None, since: TimeLike = None,
+                until: TimeLike = None) -> List[Dict]:
+        """最慢的action: 按by(mean_ms/max_ms/p50_ms/p95_ms/p99_ms或者total_ms)从大到小"""
+        if by not in SLOWEST_METRICS:
+            raise ValueError(f'by must be one of {SLOWEST_METRICS}, got {by!r}.')
+
+        rows = self.percentiles(plan, since, until, ACTION)
+        for row in rows:
+            row['total_ms'] = row['mean_ms'] * row['count']
+
+        return sorted(rows, key=lambda _: _[by], reverse=True)[:limit]
+
+    def failures(self, window: float = 3600, plan: str = None, since: TimeLike = None, until: TimeLike = None,
+                 kind: str = PLAN) -> List[Dict]:
+        """按时间窗口统计失败率
+
+        Args:
+            window: 窗口的长度(秒)
+            kind: plan(按Plan统计每次执行) 或者 action(按路径统计每个action)
+
+        Returns:
+            [{start, path, count, errors, failure_rate}] start为窗口开始的时间(秒)
+        """
+        buckets: Dict[Tuple[int, str], List[int]] = {}
+
+        for started, _, path, _, _, error, _ in self.records(plan, since, until, kind):
+            entry = buckets.setdefault((int(started // window), path), [0, 0])
+            entry[0] += 1
+            entry[1] += error is not None
+
+        return [{'start': bucket * window, 'path': path, 'count': total, 'errors': errors,
+                 'failure_rate': errors / total} for (bucket, path), (total, errors) in sorted(buckets.items())]
+
+    def breakdown(self, plan: str, since: TimeLike = None, until: TimeLike = None) -> List[Dict]:
+        """嵌套Plan的耗时分解 按树的顺序排列
+
+        Returns:
+            [{path, depth, count, mean_ms, share, critical}] share为占上一层平均耗时的比例;
+            critical: 是否在关键路径上(从最外层开始 每一层中平均耗时最长的action)
+        """
+        rows = {_['path']: _ for _ in self.percentiles(plan, since, until)}
+        if plan not in rows:
+            return []
+
+        children: Dict[str, List[str]] = {}
+        for path in rows:
+            if path == plan:
+                continue
+            parent, _, _ = path.rpartition('/[')
+            children.setdefault(parent, []).append(path)
+
+        def index(path: str) -> int:
+            return int(path[path.rindex('/[') + 2:path.rindex(']')])
+
+        result = []
+
+        def visit(path: str, depth: int, parent_ms: Optional[float], critical: bool) -> None:
+            row = rows[path]
+            result.append({
+                'path': path,
+                'depth': depth,
+                'count': row['count'],
+                'mean_ms': row['mean_ms'],
+                'share': row['mean_ms'] / parent_ms if parent_ms else 1.0,
+                'critical': critical,
+            })
+
+            nested = sorted(children.get(path, ()), key=index)
+            longest = max(nested, key=lambda _: rows[_]['mean_ms'], default=None)
+            for child in nested:
+                visit(child, depth + 1, row['mean_ms'], critical and child == longest)
+
+        visit(plan, 0, None, True)
+        return result
+
+    def critical_path(self, plan: str, since: TimeLike = None, until: TimeLike = None) -> List[Dict]:
+        """关键路径: 从最外层开始 每一层中平均耗时最长的action"""
+        return [_ for _ in self.breakdown(plan, since, until) if _['critical']]
+
+
+def format_table(rows: List[Dict], columns: List[str]) -> str:
+    """对齐的文本表格"""
+    def cell(value) -> str:
+        if isinstance(value, float):
+            return f'{value:.3f}'
+        return '' if value is None else str(value)
+
+    cells = [[cell(row[_]) for _ in columns] for row in rows]
+    widths = [max([len(column)] + [len(_[i]) for _ in cells]) for i, column in enumerate(columns)]
+
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths)).rstrip()]
+    for line in cells:
+        lines.append('  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip())
+
+    return '\n'.join(lines)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog='planner-history', description='planner execution history reports')
+    parser.add_argument('--db', default='planner-history.sqlite3', help='SQLite database written by HistoryRecorder')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(name: str, help_text: str, plan_required: bool = False) -> argparse.ArgumentParser:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--plan', required=plan_required, help='plan name')
+        command.add_argument('--since', help='epoch seconds, ISO time, or 30m/24h/7d ago')
+        command.add_argument('--until', help='epoch seconds, ISO time, or 30m/24h/7d ago')
+        return command
+
+    add_command('percentiles', 'latency percentiles per plan and action').add_argument(
+        '--kind', choices=(PLAN, ACTION), help='only plans or only actions')
+    slowest = add_command('slowest', 'slowest actions')
+    slowest.add_argument('--limit', type=int, default=10)
+    slowest.add_argument('--by', default='p95_ms', choices=SLOWEST_METRICS)
+    failures = add_command('failures', 'failure rates over time windows')
+    failures.add_argument('--window', default='1h', help='window length, e.g. 15m, 1h, 1d')
+    failures.add_argument('--kind', choices=(PLAN, ACTION), default=PLAN)
+    add_command('critical-path', 'time breakdown of nested plans', plan_required=True)
+
+    args = parser.parse_args(argv)
+    history = History(args.db)
+    span = {'plan': args.plan, 'since': args.since, 'until': args.until}
+
+    if args.command == 'percentiles':
+        rows = history.percentiles(kind=args.kind, **span)
+        columns = ['plan', 'path', 'count', 'error_rate', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    elif args.command == 'slowest':
+        rows = history.slowest(args.limit, args.by, **span)
+        columns = ['path', 'count', args.by, 'mean_ms', 'max_ms']
+    elif args.command == 'failures':
+        rows = history.failures(parse_duration(args.window), kind=args.kind, **span)
+        for row in rows:
+            row['start'] = datetime.fromtimestamp(row['start']).isoformat(timespec='seconds')
+        columns = ['start', 'path', 'count', 'errors', 'failure_rate']
+    else:
+        rows = history.breakdown(**span)
+        for row in rows:
+            row['action'] = '  ' * row['depth'] + ('* ' if row['critical'] else '  ') + row['path'].rpartition('/')[2]
+        columns = ['action', 'count', 'mean_ms', 'share']
+
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+    else:
+        print(format_table(rows, columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""hooks - 运行事件与耗时统计
+
+#. 事件: Plan开始/结束 action开始/结束/出错 时间为perf_counter_ns
+#. 每个事件带有嵌套路径 例如 Outer/[2] Inner/[1] parse
+#. 没有订阅者时执行引擎不构造事件 也不读取时间
+#. LatencyAggregator: 内置的订阅者 按action统计调用次数与耗时分布(p50/p95/p99)
+
+订阅者在执行action的线程中被同步调用 应当尽快返回; 订阅者抛出的异常会被记录并忽略。
+
+"""
+from __future__ import annotations
+
+import math
+import threading
+from contextvars import ContextVar
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+PLAN_START = 'plan_start'
+"""事件: 一层Plan开始"""
+PLAN_END = 'plan_end'
+"""事件: 一层Plan结束(包括失败 此时error不为None)"""
+ACTION_START = 'action_start'
+"""事件: action开始"""
+ACTION_END = 'action_end'
+"""事件: action结束"""
+ACTION_ERROR = 'action_error'
+"""事件: action抛出异常"""
+ACTION_WAIT = 'action_wait'
+"""事件: action因并发/速率限制等待后开始运行 duration_ns为等待时间 plan为None(planner.limits)"""
+
+EVENTS = (PLAN_START, PLAN_END, ACTION_START, ACTION_END, ACTION_ERROR, ACTION_WAIT)
+
+subscribers: List[Tuple[Callable, frozenset]] = []
+"""当前的订阅者: [(回调, 订阅的事件)] 为空时执行引擎跳过所有事件"""
+
+current_path: ContextVar[Optional[str]] = ContextVar('planner_current_path', default=None)
+"""正在运行的action的路径: 在action中运行的Plan以此作为路径前缀"""
+
+_lock = threading.Lock()
+logger = getLogger(__name__)
+
+
+class Event(object):
+    """一个运行事件"""
+
+    __slots__ = ('kind', 'plan', 'name', 'path', 'time_ns', 'duration_ns', 'action', 'result', 'error')
+
+    def __init__(self, kind: str, plan, name: str, path: str, time_ns: int, duration_ns: Optional[int] = None,
+                 action=None, result: Any = None, error: Optional[BaseException] = None):
+        self.kind = kind
+        self.plan = plan
+        """action所属的Plan 或者开始/结束的Plan"""
+        self.name = name
+        """action名称 或者Plan名称"""
+        self.path = path
+        """嵌套路径"""
+        self.time_ns = time_ns
+        """事件发生的时间(perf_counter_ns)"""
+        self.duration_ns = duration_ns
+        """结束/出错事件: 耗时(纳秒)"""
+        self.action = action
+        self.result = result
+        self.error = error
+
+    def __repr__(self):
+        return f'<Event {self.kind} {self.path}>'
+
+
+def subscribe(callback: Callable[[Event], Any] = None, kinds: Iterable[str] = None):
+    """订阅运行事件 可以作为装饰器使用
+
+    Args:
+        callback: 以Event为参数的回调
+        kinds: 订阅的事件 默认为全部事件
+    """
+    if callback is None:
+        return lambda _: subscribe(_, kinds)
+
+    kinds = frozenset(EVENTS if kinds is None else kinds)
+    if unknown := kinds - set(EVENTS):
+        raise ValueError(f'unknown events: {sorted(unknown)}.')
+
+    with _lock:
+        # 整体替换列表的内容 正在发送的事件不受影响
+        subscribers[:] = [_ for _ in subscribers if _[0] != callback] + [(callback, kinds)]
+
+    return callback
+
+
+def unsubscribe(callback: Callable) -> None:
+    """取消订阅"""
+    with _lock:
+        subscribers[:] = [_ for _ in subscribers if _[0] != callback]
+
+
+def emit(kind: str, plan, name: str, path: str, time_ns: int, duration_ns: Optional[int] = None, action=None,
+         result: Any = None, error: Optional[BaseException] = None) -> None:
+    """发送事件到订阅了此事件的订阅者"""
+    event = None
+
+    for callback, kinds in subscribers[:]:
+        if kind not in kinds:
+            continue
+
+        if event is None:
+            event = Event(kind, plan, name, path, time_ns, duration_ns, action, result, error)
+
+        try:
+            callback(event)
+        except Exception:
+            logger.exception(f'hook {callback!r} failed on {event!r}.')
+
+
+class LatencyHistogram(object):
+    """对数分桶的耗时分布: 每个2的幂次分为16个桶 相对误差约3%"""
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            index = exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        else:
+            index = 0
+
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def _value(self, index: int) -> float:
+        """桶的中间值"""
+        if not index:
+            return 0.0
+
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 0.5) / (2 * self.SUB_BUCKETS), exponent)
+
+    def percentile(self, q: float) -> float:
+        """分位数 q取值0~100"""
+        if not self.count:
+            return 0.0
+
+        rank = max(math.ceil(self.count * q / 100), 1)
+        seen = 0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+
+        return float(self.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class LatencyAggregator(object):
+    """按action统计调用次数、出错次数与耗时分布
+
+    Args:
+        by: 统计的粒度 path(按嵌套路径) 或 name(按Plan名称.action名称)
+
+    Examples:
+        >>> aggregator = LatencyAggregator().attach()
+        >>> SomePlan.execute()
+        >>> aggregator.snapshot()
+        {'SomePlan/[1] parse': {'count': 1, 'errors': 0, 'mean_ms': ..., 'p50_ms': ..., ...}}
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, by: str = 'path'):
+        if by not in ('path', 'name'):
+            raise ValueError(f'unknown aggregation: {by}.')
+
+        self.by = by
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        key = event.path if self.by == 'path' else f'{event.plan.__name__}.{event.name}'
+
+        with self._lock:
+            if (histogram := self._histograms.get(key)) is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.record(event.duration_ns)
+
+            if event.kind == ACTION_ERROR:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def attach(self) -> LatencyAggregator:
+        """订阅action结束/出错事件"""
+        subscribe(self, (ACTION_END, ACTION_ERROR))
+        return self
+
+    def detach(self) -> None:
+        unsubscribe(self)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """当前的统计结果: {action: {count, errors, mean_ms, max_ms, p50_ms, p95_ms, p99_ms}}"""
+        with self._lock:
+            snapshot = {}
+
+            for key, histogram in self._histograms.items():
+                metrics = {
+                    'count': histogram.count,
+                    'errors': self._errors.get(key, 0),
+                    'mean_ms': histogram.mean / 1e6,
+                    'max_ms': histogram.max / 1e6,
+                }
+                for q in self.PERCENTILES:
+                    metrics[f'p{q}_ms'] = histogram.percentile(q) / 1e6
+
+                snapshot[key] = metrics
+
+            return snapshot
+
+    def render(self, prefix: str = 'planner_action') -> str:
+        """以Prometheus文本格式输出统计结果"""
+        lines = [f'# TYPE {prefix}_seconds summary']
+
+        for key, metrics in self.snapshot().items():
+            label = key.replace('\\', '\\\\').replace('"', '\\"')
+
+            for q in self.PERCENTILES:
+                lines.append(f'{prefix}_seconds{{action="{label}",quantile="{q / 100}"}} {metrics[f"p{q}_ms"] / 1e3}')
+
+            lines.append(f'{prefix}_seconds_sum{{action="{label}"}} {metrics["mean_ms"] * metrics["count"] / 1e3}')
+            lines.append(f'{prefix}_seconds_count{{action="{label}"}} {metrics["count"]}')
+            lines.append(f'{prefix}_errors_total{{action="{label}"}} {metrics["errors"]}')
+
+        return '\n'.join(lines) + '\n'
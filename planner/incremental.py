@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""incremental - 按输入指纹增量执行
+
+Plan.incremental_store不为None时 每个action运行前计算其输入的指纹 指纹不变时复用上一次的结果:
+
+#. action本身的指纹: 每个action对象一个随机的标识 替换action后不再复用; 不能弱引用的action总是运行
+#. 没有参数: 指纹只取决于action本身
+#. 一个参数: 取决于上一个action的结果
+#. 不定参数: 取决于result、读取的执行参数(注册时reads给定 默认为全部执行参数)以及之前所有action的结果
+#. 结果的指纹由产生它的输入指纹决定 中间结果不需要序列化; 执行参数按内容(pickle)计算指纹
+#. 注册时impure=True的action总是运行 其结果按内容计算指纹(相同的结果仍然可以让下游复用)
+#. 不能序列化的执行参数视为总是变化
+#. execute、execute_many与aexecute都会复用结果
+
+复用的结果是同一个对象 action不应修改其输入。action的可变状态(闭包变量、绑定的对象)不参与指纹:
+结果取决于这些状态的action应当注册为impure。只支持linear模式 其他模式抛出ValueError。
+
+"""
+from __future__ import annotations
+
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from planner.engine import NO_ARGUMENT, POSITIONAL, CallStrategy, Frame, new_frame, invoke, ainvoke, \
+    execute_instructions, aexecute_instructions
+
+_NONE = blake2b(b'none', digest_size=16).digest()
+"""None的指纹"""
+
+_tokens: WeakKeyDictionary = WeakKeyDictionary()
+"""action -> action_token"""
+
+
+def digest(*parts: bytes) -> bytes:
+    hasher = blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(len(part).to_bytes(4, 'little'))
+        hasher.update(part)
+    return hasher.digest()
+
+
+def fingerprint(value: Any) -> Optional[bytes]:
+    """按内容计算指纹 不能序列化时返回None"""
+    if value is None:
+        return _NONE
+
+    try:
+        return blake2b(pickle.dumps(value, 4), digest_size=16).digest()
+    except Exception:
+        return None
+
+
+def action_token(action) -> Optional[bytes]:
+    """action本身的标识: 每个action对象一个随机值 只在第一次运行时生成
+
+    替换为其他对象(包括字节码相同、闭包变量不同的函数)后不再复用; 同一个对象的可变状态不参与指纹。
+    不能弱引用的action返回None(总是运行)
+    """
+    try:
+        token = _tokens.get(action)
+        if token is None:
+            token = _tokens.setdefault(action, uuid.uuid4().bytes)
+        return token
+    except TypeError:
+        return None
+
+
+class IncrementalStore(object):
+    """输入指纹与结果的有界存储(LRU)
+
+    Args:
+        maxsize: 最多保存的结果数量
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        """复用结果的次数"""
+        self.misses = 0
+        """运行action的次数"""
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: bytes) -> Optional[Tuple[Any, bytes]]:
+        """(结果, 结果的指纹) 不存在时返回None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return item
+
+    def set(self, key: bytes, action_result: Any, output: bytes) -> None:
+        with self._lock:
+            self._data[key] = (action_result, output)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class Fingerprints(object):
+    """一层Plan的指纹状态"""
+
+    __slots__ = ('last', 'result', 'context')
+
+    def __init__(self, last: bytes, result: bytes, context: bytes):
+        self.last = last
+        """上一个结果的指纹"""
+        self.result = result
+        """外层传入的result的指纹"""
+        self.context = context
+        """之前所有结果(result_mapper)的指纹"""
+
+
+def input_fingerprint(frame: Frame, spec, state: Fingerprints) -> Optional[bytes]:
+    """action输入的指纹 输入不能计算指纹时返回None"""
+    identity = action_token(spec.action)
+
+    if identity is None:
+        return None
+
+    elif spec.kind is NO_ARGUMENT:
+        return identity
+
+    elif spec.kind is POSITIONAL:
+        return digest(identity, state.last)
+
+    reads = spec.options.get('reads')
+    parameter = frame.parameter if reads is None else {_: frame.parameter.get(_) for _ in reads}
+    parameter_fingerprint = fingerprint(sorted(parameter.items()))
+
+    if parameter_fingerprint is None:
+        return None
+
+    result = state.last if frame.last_result is not None else state.result
+
+    return digest(identity, result, parameter_fingerprint, state.context)
+
+
+class Tracker(CallStrategy):
+    """一次增量执行的指纹状态: 同步与异步执行共用"""
+
+    __slots__ = ('store', 'state', 'states')
+
+    def __init__(self, store: IncrementalStore, frame: Frame):
+        self.store = store
+        result_fingerprint = fingerprint(frame.result) or uuid.uuid4().bytes
+        self.state = Fingerprints(_NONE, result_fingerprint, digest(b'context', result_fingerprint))
+        self.states: List[Fingerprints] = []
+
+    def lookup(self, frame: Frame, spec) -> Tuple[Optional[bytes], Optional[tuple]]:
+        """(输入指纹, 复用的(结果, 结果的指纹)) 需要运行时后者为None"""
+        input_key = input_fingerprint(frame, spec, self.state)
+        cached = None if input_key is None or spec.options.get('impure') else self.store.get(input_key)
+
+        return input_key, cached
+
+    def done(self, spec, input_key: Optional[bytes], cached: Optional[tuple], action_result: Any) -> None:
+        """action结束: 保存结果 更新指纹"""
+        state = self.state
+
+        if cached is not None:
+            output = cached[1]
+        # impure的action以及无法计算输入指纹的action 结果按内容计算指纹
+        elif input_key is None or spec.options.get('impure'):
+            output = fingerprint(action_result) or uuid.uuid4().bytes
+        else:
+            output = digest(b'output', input_key)
+            self.store.set(input_key, action_result, output)
+
+        state.last = output
+        state.context = digest(state.context, output)
+
+    def enter(self, frame: Frame) -> None:
+        """进入嵌套的Plan"""
+        state = self.state
+        result = state.last if frame.last_result is not None else state.result
+        self.states.append(state)
+        self.state = Fingerprints(_NONE, result, state.context)
+
+    def call(self, frame: Frame, spec, stack: List[Frame]) -> Any:
+        input_key, cached = self.lookup(frame, spec)
+        action_result = cached[0] if cached is not None else invoke(frame, spec)
+
+        self.done(spec, input_key, cached, action_result)
+        return action_result
+
+    async def acall(self, frame: Frame, spec, stack: List[Frame], executor=None) -> Any:
+        input_key, cached = self.lookup(frame, spec)
+        action_result = cached[0] if cached is not None else await ainvoke(frame, spec, executor)
+
+        self.done(spec, input_key, cached, action_result)
+        return action_result
+
+    def exit(self, frame: Frame) -> None:
+        """退出嵌套的Plan: 内层最后的结果作为外层action的结果"""
+        output = self.state.last
+        state = self.state = self.states.pop()
+        state.last = output
+        state.context = digest(state.context, output)
+
+
+def run_incremental(plan, execute_parameter: dict) -> Any:
+    """运行Plan的扁平指令流 复用输入指纹未变化的action的结果"""
+    frame = new_frame(plan, plan.compile(), execute_parameter)
+    return execute_instructions(plan.instructions(), frame, Tracker(plan.incremental_store, frame))
+
+
+async def arun_incremental(plan, execute_parameter: dict, executor=None) -> Any:
+    """异步运行Plan的扁平指令流 复用输入指纹未变化的action的结果"""
+    frame = new_frame(plan, plan.compile(), execute_parameter)
+    return await aexecute_instructions(plan.instructions(), frame, executor, Tracker(plan.incremental_store, frame))
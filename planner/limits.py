@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""limits - action的并发与速率限制
+
+注册时给定concurrency/rate选项的action 在编译时包装为受限的调用目标:
+
+    >>> Plan.register(query, concurrency=4)                 # 同时最多4个调用
+    >>> Plan.register(fetch, rate=(10, 1.0))                # 每秒最多10个调用
+    >>> Plan.register(load_user, limit='db', concurrency=8)  # 共用名为db的限制
+    >>> Plan.register(load_order, limit='db')
+
+#. 限制属于action本身(或者limit给定的名称): 所有线程、所有Plan以及嵌套Plan中的调用共用
+#. concurrency: 超过时按到达顺序排队; 同一上下文中重入的调用不再占用名额(避免死锁)
+#. rate: (次数, 秒数) 或者每秒次数 允许次数以内的突发; 先获得并发名额 再等待速率
+#. 等待时间与运行时间分别统计(stats()); 有订阅者时等待过的调用发送action_wait事件
+#. 与timeout同时使用时 超时包括排队的时间
+
+同一个action或者名称只能有一种限制 在不同的Plan中注册不同的限制时抛出ValueError。
+
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from time import monotonic, perf_counter_ns, sleep
+from typing import Callable, Dict, Optional, Tuple, Union
+from weakref import WeakKeyDictionary
+
+from planner.hooks import ACTION_WAIT, LatencyHistogram, current_path, emit, subscribers
+
+LIMIT_OPTIONS = ('concurrency', 'rate', 'limit')
+"""限制相关的action选项"""
+
+PERCENTILES = (50, 95, 99)
+
+_limiters: WeakKeyDictionary = WeakKeyDictionary()
+"""{action: Limiter} 重新编译后仍然保留"""
+_groups: Dict[str, Limiter] = {}
+"""{名称: Limiter} 以limit选项共用的限制"""
+_lock = threading.Lock()
+
+_holding: ContextVar[frozenset] = ContextVar('planner_limits_holding', default=frozenset())
+"""当前上下文已占用并发名额的Limiter"""
+
+
+class Waiter(object):
+    """排队中的调用: 名额由释放者直接转交"""
+
+    __slots__ = ('wake', 'handed')
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.handed = False
+
+
+class Limiter(object):
+    """并发与速率限制
+
+    Args:
+        name: 名称(action名称或者limit选项)
+        concurrency: 同时运行的最大数量 None时不限制
+        rate: 每秒次数 或者(次数, 秒数) None时不限制
+    """
+
+    def __init__(self, name: str, concurrency: Optional[int] = None,
+                 rate: Union[float, Tuple[float, float], None] = None):
+        if concurrency is not None and concurrency < 1:
+            raise ValueError(f'concurrency must be at least 1, got {concurrency}.')
+
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.interval = None
+        """速率限制下两次调用之间的平均间隔(秒)"""
+        self.burst = 1
+
+        if rate is not None:
+            calls, per = rate if isinstance(rate, tuple) else (rate, 1.0)
+            if calls <= 0 or per <= 0:
+                raise ValueError(f'rate must be positive, got {rate!r}.')
+            self.interval = per / calls
+            self.burst = max(int(calls), 1)
+
+        self.active = 0
+        """正在运行的调用数量"""
+        self.max_queued = 0
+        """同时排队的最大数量"""
+        self.calls = 0
+        self.waited = 0
+        """等待过的调用次数"""
+        self.wait = LatencyHistogram()
+        """等待时间(纳秒)"""
+        self.run = LatencyHistogram()
+        """运行时间(纳秒) 不包括等待"""
+
+        self._waiters = deque()
+        self._next = 0.0
+        """速率限制: 下一个名额的理论时间"""
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<Limiter {self.name} concurrency={self.concurrency} rate={self.rate!r}>'
+
+    @property
+    def queued(self) -> int:
+        """正在排队的调用数量"""
+        return len(self._waiters)
+
+    def config(self) -> tuple:
+        return self.concurrency, self.rate
+
+    def _try_acquire(self, wake: Callable[[], None]) -> Optional[Waiter]:
+        """有空闲名额时占用并返回None 否则排队"""
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self.active += 1
+                return None
+
+            waiter = Waiter(wake)
+            self._waiters.append(waiter)
+            self.max_queued = max(self.max_queued, len(self._waiters))
+            return waiter
+
+    def _cancel(self, waiter: Waiter) -> None:
+        """放弃排队: 已经转交的名额归还"""
+        with self._lock:
+            if not waiter.handed:
+                self._waiters.remove(waiter)
+                return
+        self.release()
+
+    def release(self) -> None:
+        """归还名额: 有排队时直接转交给最早的调用"""
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.handed = True
+        waiter.wake()
+
+    def _reserve(self) -> float:
+        """速率限制: 预定一个名额 返回需要等待的秒数"""
+        with self._lock:
+            now = monotonic()
+            self._next = max(self._next, now) + self.interval
+            return max(self._next - self.burst * self.interval - now, 0.0)
+
+    def acquire(self) -> Tuple[bool, bool]:
+        """等待名额
+
+        Returns:
+            (是否占用了并发名额(重入时不占用), 是否等待过)
+        """
+        acquired = waited = False
+
+        if self.concurrency is not None and self not in _holding.get():
+            lock = threading.Lock()
+            lock.acquire()
+            if self._try_acquire(lock.release) is not None:
+                lock.acquire()
+                waited = True
+            acquired = True
+
+        if self.interval is not None:
+            try:
+                delay = self._reserve()
+                if delay:
+                    sleep(delay)
+                    waited = True
+            except BaseException:
+                if acquired:
+                    self.release()
+                raise
+
+        return acquired, waited
+
+    async def acquire_async(self) -> Tuple[bool, bool]:
+        """acquire()的协程版本: 排队时不阻塞事件循环"""
+        acquired = waited = False
+
+        if self.concurrency is not None and self not in _holding.get():
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            waiter = self._try_acquire(wake)
+            if waiter is not None:
+                try:
+                    await future
+                except BaseException:
+                    self._cancel(waiter)
+                    raise
+                waited = True
+            acquired = True
+
+        if self.interval is not None:
+            try:
+                delay = self._reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                    waited = True
+            except BaseException:
+                if acquired:
+                    self.release()
+                raise
+
+        return acquired, waited
+
+    def record(self, wait_ns: int, run_ns: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.waited += wait_ns > 0
+            self.wait.record(wait_ns)
+            self.run.record(run_ns)
+
+    def waited_for(self, start: int, waited: bool) -> int:
+        """获得名额: 等待过且有订阅者时发送action_wait事件 返回等待时间"""
+        if not waited:
+            return 0
+
+        end = perf_counter_ns()
+        wait_ns = end - start
+
+        if subscribers:
+            path = current_path.get()
+            emit(ACTION_WAIT, None, self.name, path or self.name, end, wait_ns, action=self)
+
+        return wait_ns
+
+    def wrap(self, target: Callable) -> Callable:
+        """包装同步的调用目标"""
+
+        @wraps(target)
+        def limited(*args, **kwargs):
+            start = perf_counter_ns()
+            acquired, waited = self.acquire()
+            token = _holding.set(_holding.get() | {self}) if acquired else None
+            try:
+                wait_ns = self.waited_for(start, waited)
+                started = perf_counter_ns()
+                try:
+                    return target(*args, **kwargs)
+                finally:
+                    self.record(wait_ns, perf_counter_ns() - started)
+            finally:
+                if acquired:
+                    _holding.reset(token)
+                    self.release()
+
+        return limited
+
+    def wrap_async(self, target: Callable) -> Callable:
+        """包装需要await的调用目标"""
+
+        @wraps(target)
+        async def limited(*args, **kwargs):
+            start = perf_counter_ns()
+            acquired, waited = await self.acquire_async()
+            token = _holding.set(_holding.get() | {self}) if acquired else None
+            try:
+                wait_ns = self.waited_for(start, waited)
+                started = perf_counter_ns()
+                try:
+                    return await target(*args, **kwargs)
+                finally:
+                    self.record(wait_ns, perf_counter_ns() - started)
+            finally:
+                if acquired:
+                    _holding.reset(token)
+                    self.release()
+
+        return limited
+
+    def snapshot(self) -> Dict[str, float]:
+        """{concurrency, rate, active, queued, max_queued, calls, waited,
+        wait_mean_ms, wait_max_ms, wait_p50_ms..., run_mean_ms, run_p50_ms...}"""
+        with self._lock:
+            metrics = {
+                'concurrency': self.concurrency,
+                'rate': self.rate,
+                'active': self.active,
+                'queued': len(self._waiters),
+                'max_queued': self.max_queued,
+                'calls': self.calls,
+                'waited': self.waited,
+            }
+            for prefix, histogram in (('wait', self.wait), ('run', self.run)):
+                metrics[f'{prefix}_mean_ms'] = histogram.mean / 1e6
+                metrics[f'{prefix}_max_ms'] = histogram.max / 1e6
+                for q in PERCENTILES:
+                    metrics[f'{prefix}_p{q}_ms'] = histogram.percentile(q) / 1e6
+            return metrics
+
+    def reset(self) -> None:
+        with self._lock:
+            self.max_queued = len(self._waiters)
+            self.calls = 0
+            self.waited = 0
+            self.wait = LatencyHistogram()
+            self.run = LatencyHistogram()
+
+    @classmethod
+    def from_options(cls, action, name: str, options: dict) -> Optional[Limiter]:
+        """由action选项获取共用的Limiter 没有限制时返回None"""
+        concurrency, rate, group = options.get('concurrency'), options.get('rate'), options.get('limit')
+        if concurrency is None and rate is None and group is None:
+            return None
+
+        with _lock:
+            if group is not None:
+                limiter = _groups.get(group)
+                if limiter is None:
+                    if concurrency is None and rate is None:
+                        raise ValueError(f'limit {group!r} is not defined: give concurrency or rate.')
+                    limiter = _groups[group] = cls(group, concurrency, rate)
+            else:
+                try:
+                    limiter = _limiters.get(action)
+                except TypeError:
+                    # 不能弱引用的action: 每次编译使用新的限制
+                    return cls(name, concurrency, rate)
+                if limiter is None:
+                    limiter = _limiters[action] = cls(name, concurrency, rate)
+                    return limiter
+
+        if (concurrency is not None or rate is not None) and limiter.config() != (concurrency, rate):
+            raise ValueError(f'{limiter.name} is already limited with concurrency={limiter.concurrency}, '
+                             f'rate={limiter.rate!r}, got concurrency={concurrency}, rate={rate!r}.')
+
+        return limiter
+
+
+def get_limiter(action_or_name) -> Optional[Limiter]:
+    """action或者limit名称对应的Limiter"""
+    if isinstance(action_or_name, str):
+        return _groups.get(action_or_name)
+
+    try:
+        return _limiters.get(action_or_name)
+    except TypeError:
+        return None
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """全部限制的统计: {名称: Limiter.snapshot()} 名称相同时以#2、#3区分"""
+    with _lock:
+        limiters = list(_groups.values()) + list(_limiters.values())
+
+    result = {}
+    for limiter in limiters:
+        key, n = limiter.name, 1
+        while key in result:
+            n += 1
+            key = f'{limiter.name}#{n}'
+        result[key] = limiter.snapshot()
+
+    return result
+
+
+def summary() -> str:
+    """按等待时间从大到小排列的统计表"""
+    rows = sorted(stats().items(), key=lambda _: _[1]['wait_mean_ms'] * _[1]['calls'], reverse=True)
+
+    lines = [f'{"calls":>8}{"waited":>8}{"queued":>8}{"max q":>7}{"wait p50":>10}{"wait p99":>10}'
+             f'{"run p50":>10}{"run p99":>10}  limit']
+    for name, m in rows:
+        lines.append(f'{m["calls"]:>8}{m["waited"]:>8}{m["queued"]:>8}{m["max_queued"]:>7}'
+                     f'{m["wait_p50_ms"]:>10.3f}{m["wait_p99_ms"]:>10.3f}{m["run_p50_ms"]:>10.3f}'
+                     f'{m["run_p99_ms"]:>10.3f}  {name}')
+
+    return '\n'.join(lines)
@@ -1,4 +1,230 @@
 # -*- coding: utf-8 -*-
-"""log
+"""log - is_output的输出
+
+is_output为True的Plan 每个action开始/结束时构造一条OutputRecord 放入有界队列后立即返回;
+后台线程依次以Plan.output(record)写出(与logging的QueueHandler/QueueListener相同):
+
+#. OutputRecord带有Plan、action路径、耗时与结果 str()时才格式化为原来的文本
+#. 结果以reprlib截断 最长MAX_RESULT_LENGTH个字符 在后台线程中格式化
+#. 队列满时丢弃新的记录 不阻塞执行; 丢弃的数量在队列清空或者flush()时写出一条警告 队列一直满时每DROP_REPORT_INTERVAL秒一条
+#. flush()等待已放入的记录写出 进程退出时自动调用
+#. fork的子进程(例如Plan.map的工作进程)中重新创建队列与后台线程
+
+重写Plan.output时注意: 参数是OutputRecord而不是str 需要原来的文本时使用str(record)。
+
+结果在写出之前被引用: 之后被修改的可变结果 输出的是修改后的内容。
 
 """
+from __future__ import annotations
+
+import atexit
+import os
+import reprlib
+import threading
+from logging import getLogger
+from queue import Queue, Full
+from time import monotonic, time
+from typing import Any, List, Optional
+
+START = 'start'
+"""记录: action开始"""
+DONE = 'done'
+"""记录: action结束"""
+
+MAX_QUEUE_SIZE = 10000
+"""最多等待写出的记录数量"""
+MAX_RESULT_LENGTH = 200
+"""输出的结果最长的字符数"""
+FLUSH_TIMEOUT = 5.0
+"""进程退出时最长等待写出的时间(秒)"""
+DROP_REPORT_INTERVAL = 10.0
+"""队列一直满时 丢弃记录的警告的最小间隔(秒)"""
+
+logger = getLogger(__name__)
+
+_repr = reprlib.Repr()
+_repr.maxstring = _repr.maxother = MAX_RESULT_LENGTH
+_repr.maxlevel = 3
+
+_writer: Optional[OutputWriter] = None
+_lock = threading.Lock()
+
+
+def summarize(value: Any, limit: int = MAX_RESULT_LENGTH) -> str:
+    """截断的repr: 容器只展开前几项"""
+    try:
+        text = value if isinstance(value, str) else _repr.repr(value)
+    except Exception as e:
+        text = f'<{type(value).__name__} repr failed: {e!r}>'
+
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+class OutputRecord(object):
+    """一条输出: 写出时才格式化"""
+
+    __slots__ = ('kind', 'plan', 'name', 'path', 'action', 'created', 'duration_ns', 'result')
+
+    def __init__(self, kind: str, plan, spec, path: Optional[str], duration_ns: Optional[int] = None,
+                 result: Any = None):
+        self.kind = kind
+        self.plan = plan
+        self.name = spec.name
+        self.path = path
+        """action的嵌套路径"""
+        self.action = spec.action
+        self.created = time()
+        self.duration_ns = duration_ns
+        self.result = result
+
+    def __repr__(self):
+        return f'<OutputRecord {self.kind} {self.path}>'
+
+    @property
+    def result_summary(self) -> Optional[str]:
+        return summarize(self.result) if self.kind == DONE else None
+
+    def lines(self) -> List[str]:
+        if self.kind == START:
+            lines = [f'- Start action: {self.name} --> {self.action}']
+            if doc := getattr(self.action, '__doc__', None):
+                lines.append(f'- Doc: {doc}')
+            return lines
+
+        return [
+            '- Done.',
+            f'- Time cost: {round(self.duration_ns / 1e9, 3)} second.',
+            f'- action result:{self.result_summary}',
+            '-' * 80,
+        ]
+
+    def __str__(self):
+        return '\n'.join(self.lines())
+
+    def extra(self) -> dict:
+        """logging的extra: 结构化的字段"""
+        return {
+            'event': self.kind,
+            'plan': self.plan.__name__,
+            'action': self.name,
+            'action_path': self.path,
+            'duration_ns': self.duration_ns,
+            'result_summary': self.result_summary,
+        }
+
+
+class OutputWriter(object):
+    """在后台线程中写出记录
+
+    Args:
+        maxsize: 队列的容量 满时丢弃新的记录
+    """
+
+    def __init__(self, maxsize: int = MAX_QUEUE_SIZE):
+        self.queue = Queue(maxsize)
+        self.dropped = 0
+        """因队列满而丢弃的记录数量"""
+        self._reported = 0
+        self._reported_at = monotonic()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='planner-output', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: OutputRecord) -> bool:
+        """放入队列 队列满时丢弃并返回False"""
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except Full:
+            # 多个线程同时丢弃
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _run(self) -> None:
+        queue = self.queue
+
+        while True:
+            record = queue.get()
+
+            if record is None:
+                self._report()
+                break
+            elif isinstance(record, threading.Event):
+                # flush()返回前写出丢弃的数量
+                self._report()
+                record.set()
+                continue
+
+            try:
+                record.plan.output(record)
+            except Exception:
+                logger.exception(f'output of {record!r} failed.')
+
+            # 队列一直满时不逐条警告: 队列清空时 或者每DROP_REPORT_INTERVAL秒一次
+            if self.dropped != self._reported and (
+                    queue.empty() or monotonic() - self._reported_at >= DROP_REPORT_INTERVAL):
+                self._report()
+
+    def _report(self) -> None:
+        """警告上次之后丢弃的记录数量"""
+        dropped = self.dropped
+        if dropped != self._reported:
+            logger.warning(f'{dropped - self._reported} output records dropped: queue is full.')
+            self._reported, self._reported_at = dropped, monotonic()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已放入的记录写出 返回是否全部写出"""
+        if not self._thread.is_alive():
+            return False
+
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """写出剩余的记录后结束后台线程"""
+        if self._thread.is_alive():
+            self.flush(timeout)
+            try:
+                self.queue.put(None, timeout=timeout)
+            except Full:
+                return
+            self._thread.join(timeout)
+
+
+def get_writer() -> OutputWriter:
+    global _writer
+
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = OutputWriter()
+                atexit.register(_writer.close, FLUSH_TIMEOUT)
+
+    return _writer
+
+
+def _reset() -> None:
+    """fork的子进程中没有父进程的后台线程: 之后的输出使用新的队列"""
+    global _writer, _lock
+
+    _writer = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def submit(record: OutputRecord) -> bool:
+    """放入全局的输出队列"""
+    return (_writer or get_writer()).submit(record)
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """等待全局输出队列中的记录写出"""
+    return _writer is None or _writer.flush(timeout)
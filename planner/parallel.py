@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""parallel - 在进程池中批量运行Plan
+
+#. Plan在每个工作进程中只反序列化一次
+#. 输入按chunksize分块提交 同时运行的块数有上限 不会一次性读取全部输入
+#. 工作进程中的PlanException以格式化后的异常信息传回
+#. 给定transport时 执行参数与结果中大的缓冲区对象经共享内存传递(参见planner.transport)
+
+"""
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Iterable, Iterator, Any, Optional
+
+from planner.serialize import dumps, loads
+
+_worker_plan = None
+"""工作进程中的Plan"""
+_worker_transport = None
+"""工作进程中传递结果的Transport"""
+
+
+def _initialize(data: bytes, transport=None) -> None:
+    global _worker_plan, _worker_transport
+    _worker_plan = loads(data)
+    _worker_transport = transport
+
+
+def _execute_chunk(data: bytes) -> Any:
+    results = [_worker_plan.execute(**execute_parameter) for execute_parameter in loads(data)]
+
+    if _worker_transport is not None:
+        return _worker_transport.dumps(results)
+    return results
+
+
+def _chunks(iterable: Iterable[dict], chunksize: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunksize)):
+        yield chunk
+
+
+def map_plan(plan, iterable: Iterable[dict], workers: Optional[int] = None, chunksize: int = 1,
+             ordered: bool = True, transport=None) -> Iterator[Any]:
+    """在进程池中以每个执行参数运行Plan
+
+    Args:
+        plan: 需要运行的Plan
+        iterable: 执行参数(dict)的迭代器
+        workers: 进程数 默认为CPU数量
+        chunksize: 每次提交到工作进程的输入数量
+        ordered: True时按输入顺序返回结果; False时按完成顺序返回(输入序号, 结果)
+        transport: 经共享内存传递大的执行参数与结果(planner.transport.SharedMemoryTransport)
+
+    Raises:
+        PlanException: 任意输入运行失败
+    """
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(chunksize, 1)
+    chunks = enumerate(_chunks(iterable, chunksize))
+    running = deque()
+
+    executor = ProcessPoolExecutor(workers, initializer=_initialize, initargs=(dumps(plan), transport))
+    serialize = transport.dumps if transport is not None else dumps
+
+    def submit() -> bool:
+        for index, chunk in chunks:
+            data = serialize(chunk)
+            future = executor.submit(_execute_chunk, data)
+            future.offset = index * chunksize
+            future.data = data
+            running.append(future)
+            return True
+        return False
+
+    def results(future) -> list:
+        return loads(future.result()) if transport is not None else future.result()
+
+    try:
+        # 同时运行的块数有上限
+        for _ in range(workers * 2):
+            if not submit():
+                break
+
+        while running:
+            if ordered:
+                yield from results(running.popleft())
+                submit()
+            else:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.remove(future)
+                    yield from enumerate(results(future), future.offset)
+                    submit()
+
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+        # 提前结束时 释放未运行的输入与未读取的结果中的共享内存
+        if transport is not None:
+            from planner.transport import discard
+
+            for future in running:
+                if future.cancelled():
+                    discard(future.data)
+                elif future.exception() is None:
+                    discard(future.result())
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""profiling - 按action统计CPU时间与内存分配
+
+Plan.profiler不为None时 抽样的执行中每个action按嵌套路径(例如 Outer/[2] Inner/[1] parse)记录:
+
+#. CPU时间: 运行action的线程的CPU时间(thread_time) 嵌套Plan的自身时间不包括内层action
+#. 耗时: 墙上时间
+#. 内存: memory=True时以tracemalloc统计action运行前后已分配内存的变化(进程级 并发执行时互相影响)
+
+    >>> Plan.profiler = Profiler(sample=100)    # 每100次执行抽样1次
+    >>> ...
+    >>> print(Plan.profiler.summary())
+    >>> Plan.profiler.write('plan.folded')      # flamegraph.pl plan.folded > plan.svg
+
+也可以直接使用 with profiler.capture(): ... 统计其中的全部执行。
+基于运行事件(planner.hooks) 没有执行被抽样时不产生开销; 协程中的action交错运行 其CPU时间不准确。
+
+"""
+from __future__ import annotations
+
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from time import thread_time_ns
+from typing import Dict, List, Optional
+
+from planner.hooks import ACTION_START, ACTION_END, ACTION_ERROR, Event, subscribe, unsubscribe
+
+METRICS = ('cpu', 'wall', 'memory')
+"""可以输出的指标"""
+
+_capture: ContextVar[Optional[Capture]] = ContextVar('planner_profile_capture', default=None)
+"""当前执行所属的统计"""
+
+
+class ActionProfile(object):
+    """一个路径的统计 时间单位为纳秒 内存单位为字节"""
+
+    __slots__ = ('calls', 'errors', 'cpu', 'self_cpu', 'wall', 'self_wall', 'memory', 'self_memory')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cpu = 0
+        self.self_cpu = 0
+        self.wall = 0
+        self.self_wall = 0
+        self.memory = 0
+        self.self_memory = 0
+
+    def to_dict(self) -> dict:
+        return {_: getattr(self, _) for _ in self.__slots__}
+
+
+class Capture(object):
+    """一次统计中每个线程正在运行的action: [路径, CPU开始, 内存开始, 内层CPU, 内层耗时, 内层内存]"""
+
+    __slots__ = ('profiler', 'stacks')
+
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+        self.stacks: Dict[int, List[list]] = {}
+
+
+class Profiler(object):
+    """按action统计CPU时间、耗时与内存分配
+
+    Args:
+        sample: 每sample次执行抽样统计1次
+        memory: 使用tracemalloc统计内存分配(开销较大)
+    """
+
+    def __init__(self, sample: int = 1, memory: bool = False):
+        if sample < 1:
+            raise ValueError(f'sample must be at least 1, got {sample}.')
+
+        self.sample = sample
+        self.memory = memory
+        self.profiles: Dict[str, ActionProfile] = {}
+        """{路径: 统计}"""
+        self.executions = 0
+        """已统计的执行次数"""
+
+        self._counter = count()
+        self._active = 0
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    def sampled(self) -> bool:
+        """此次执行是否需要统计: 已经在统计中时返回False"""
+        return _capture.get() is None and next(self._counter) % self.sample == 0
+
+    @contextmanager
+    def capture(self):
+        """统计其中运行的全部action(包括其他线程中属于此上下文的action)"""
+        with self._lock:
+            if self._active == 0:
+                if self.memory and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracing = True
+                subscribe(self._on_event, (ACTION_START, ACTION_END, ACTION_ERROR))
+            self._active += 1
+            self.executions += 1
+
+        token = _capture.set(Capture(self))
+        try:
+            yield self
+        finally:
+            _capture.reset(token)
+
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    unsubscribe(self._on_event)
+                    if self._started_tracing:
+                        tracemalloc.stop()
+                        self._started_tracing = False
+
+    def _on_event(self, event: Event) -> None:
+        capture = _capture.get()
+        if capture is None or capture.profiler is not self:
+            return
+
+        cpu = thread_time_ns()
+        memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        stack = capture.stacks.setdefault(threading.get_ident(), [])
+
+        if event.kind == ACTION_START:
+            stack.append([event.path, cpu, memory, 0, 0, 0])
+            return
+
+        # 协程中的action可能交错结束: 按路径查找
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == event.path:
+                path, cpu_start, memory_start, child_cpu, child_wall, child_memory = stack.pop(i)
+                break
+        else:
+            return
+
+        cpu -= cpu_start
+        wall = event.duration_ns
+        memory -= memory_start
+
+        prefix = path + '/'
+        for entry in reversed(stack):
+            if prefix.startswith(entry[0] + '/'):
+                entry[3] += cpu
+                entry[4] += wall
+                entry[5] += memory
+                break
+
+        with self._lock:
+            profile = self.profiles.get(path)
+            if profile is None:
+                profile = self.profiles[path] = ActionProfile()
+
+            profile.calls += 1
+            profile.errors += event.kind == ACTION_ERROR
+            profile.cpu += cpu
+            profile.self_cpu += cpu - child_cpu
+            profile.wall += wall
+            profile.self_wall += wall - child_wall
+            profile.memory += memory
+            profile.self_memory += memory - child_memory
+
+    def reset(self) -> None:
+        with self._lock:
+            self.profiles.clear()
+            self.executions = 0
+
+    def snapshot(self) -> Dict[str, dict]:
+        """{路径: 统计}"""
+        with self._lock:
+            return {path: profile.to_dict() for path, profile in self.profiles.items()}
+
+    def collapsed(self, metric: str = 'cpu') -> str:
+        """flamegraph的折叠栈格式: 每行为 Outer;[2] Inner;[1] parse <自身的值>
+
+        时间的单位为微秒 内存为字节(只输出增加的部分)
+        """
+        if metric not in METRICS:
+            raise ValueError(f'metric must be one of {METRICS}, got {metric!r}.')
+
+        lines = []
+        for path, profile in sorted(self.snapshot().items()):
+            value = profile[f'self_{metric}']
+            if metric != 'memory':
+                value //= 1000
+            if value > 0:
+                lines.append(f'{path.replace(";", ":").replace("/", ";")} {value}')
+
+        return '\n'.join(lines)
+
+    def summary(self, sort: str = 'cpu', limit: Optional[int] = None) -> str:
+        """按自身的值(默认为CPU时间)从大到小排列的统计表"""
+        if sort not in METRICS:
+            raise ValueError(f'sort must be one of {METRICS}, got {sort!r}.')
+
+        rows = sorted(self.snapshot().items(), key=lambda _: _[1][f'self_{sort}'], reverse=True)[:limit]
+
+        lines = [f'{"calls":>8}{"self cpu ms":>14}{"cpu ms":>12}{"self wall ms":>14}{"wall ms":>12}'
+                 f'{"self KiB":>12}  action']
+        for path, p in rows:
+            lines.append(f'{p["calls"]:>8}{p["self_cpu"] / 1e6:>14.3f}{p["cpu"] / 1e6:>12.3f}'
+                         f'{p["self_wall"] / 1e6:>14.3f}{p["wall"] / 1e6:>12.3f}{p["self_memory"] / 1024:>12.1f}'
+                         f'  {path}')
+
+        return '\n'.join(lines)
+
+    def write(self, collapsed_path: Optional[str] = None, summary_path: Optional[str] = None,
+              metric: str = 'cpu') -> None:
+        """写入折叠栈文件与统计表"""
+        if collapsed_path is not None:
+            with open(collapsed_path, 'w') as f:
+                f.write(self.collapsed(metric) + '\n')
+
+        if summary_path is not None:
+            with open(summary_path, 'w') as f:
+                f.write(self.summary(metric) + '\n')
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""registry - 按名称查找Plan
+
+#. 名称可以对应导入路径('package.module:PlanName') 首次查找时才导入模块
+#. 安装包可以通过入口点组planner.plans声明Plan 同样在首次查找时才导入
+#. 已定义的Plan(包括create_plan创建的)可以按名称查找 不会因此被保留
+#. warm_up: 预先导入指定的(或者全部已知的)Plan 例如在工作进程fork之前
+
+    >>> register_plan('report', 'reports.daily:DailyReport')
+    >>> get_plan('report').execute(day='2022-12-01')
+
+"""
+from __future__ import annotations
+
+import importlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Union
+from weakref import WeakValueDictionary
+
+from planner.engine import LINEAR
+
+ENTRY_POINT_GROUP = 'planner.plans'
+"""声明Plan的入口点组"""
+
+
+def import_target(path: str) -> Any:
+    """按'package.module:Name'(或'package.module.Name')导入对象"""
+    if ':' in path:
+        module_name, _, qualname = path.partition(':')
+    else:
+        module_name, _, qualname = path.rpartition('.')
+
+    target = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        target = getattr(target, name)
+
+    return target
+
+
+def iter_entry_points(group: str) -> Iterable[Any]:
+    """入口点组中的全部入口点"""
+    # 按需导入: importlib.metadata会扫描已安装的包
+    from importlib import metadata
+
+    entry_points = metadata.entry_points()
+
+    # Python 3.10之前返回{组: [入口点]}
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=group)
+    return entry_points.get(group, ())
+
+
+class PlanRegistry(object):
+    """Plan名称与Plan(或者其导入路径)的映射
+
+    查找顺序: 已注册/已导入的Plan 注册的导入路径 入口点 已定义的Plan
+    """
+
+    def __init__(self, group: Optional[str] = ENTRY_POINT_GROUP):
+        self.group = group
+        self._plans: Dict[str, Any] = {}
+        self._paths: Dict[str, str] = {}
+        self._defined: WeakValueDictionary = WeakValueDictionary()
+        self._entry_points: Optional[Dict[str, Any]] = None
+        # 导入模块时会定义新的Plan 需要可重入
+        self._lock = threading.RLock()
+
+    def register(self, name: str, target: Union[str, Any]) -> None:
+        """注册一个Plan 或者其导入路径(首次查找时导入)"""
+        with self._lock:
+            if isinstance(target, str):
+                self._paths[name] = target
+                self._plans.pop(name, None)
+            else:
+                self._plans[name] = target
+
+    def define(self, plan) -> None:
+        """记录已定义的Plan(由PlanMeta调用) 同名时以最后定义的为准"""
+        with self._lock:
+            self._defined[plan.__name__] = plan
+
+    def entry_points(self) -> Dict[str, Any]:
+        """入口点组中声明的Plan: {名称: 入口点} 首次使用时读取"""
+        if self._entry_points is None:
+            with self._lock:
+                if self._entry_points is None:
+                    self._entry_points = {_.name: _ for _ in iter_entry_points(self.group)} if self.group else {}
+
+        return self._entry_points
+
+    def get(self, name: str):
+        """按名称查找Plan 必要时导入其模块
+
+        Raises:
+            LookupError: 名称不存在
+        """
+        plan = self._plans.get(name)
+        if plan is not None:
+            return plan
+
+        with self._lock:
+            if (plan := self._plans.get(name)) is not None:
+                return plan
+
+            if name in self._paths:
+                plan = import_target(self._paths[name])
+            elif name in self.entry_points():
+                plan = self._entry_points[name].load()
+            elif (plan := self._defined.get(name)) is not None:
+                return plan
+            else:
+                raise LookupError(f'Plan {name} is not registered.')
+
+            self._check(name, plan)
+            self._plans[name] = plan
+
+        return plan
+
+    @staticmethod
+    def _check(name: str, plan) -> None:
+        from planner.core import PlanMeta
+
+        if not isinstance(plan, PlanMeta):
+            raise TypeError(f'{name} does not refer to a Plan: {plan!r}.')
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names()
+
+    def names(self) -> List[str]:
+        """全部已知的Plan名称(不导入)"""
+        with self._lock:
+            return sorted({*self._plans, *self._paths, *self.entry_points(), *self._defined.keys()})
+
+    def loaded(self, name: str) -> bool:
+        """Plan是否已导入"""
+        return name in self._plans or (name not in self._paths and name in self._defined)
+
+    def warm_up(self, names: Iterable[str] = None) -> List[Any]:
+        """预先导入Plan 并编译其指令流
+
+        Args:
+            names: 需要导入的Plan名称 默认为全部注册的导入路径与入口点
+        """
+        if names is None:
+            with self._lock:
+                names = sorted({*self._paths, *self.entry_points()})
+
+        plans = [self.get(name) for name in names]
+
+        for plan in plans:
+            plan.compile()
+            if plan.mode == LINEAR:
+                plan.instructions()
+
+        return plans
+
+    def clear(self) -> None:
+        """清除注册的Plan与导入路径"""
+        with self._lock:
+            self._plans.clear()
+            self._paths.clear()
+            self._entry_points = None
+
+
+registry = PlanRegistry()
+"""全局的Plan注册表"""
+
+
+def register_plan(name: str, target: Union[str, Any]) -> None:
+    """注册一个Plan 或者其导入路径('package.module:PlanName')"""
+    registry.register(name, target)
+
+
+def get_plan(name: str):
+    """按名称查找Plan 首次查找时导入其模块"""
+    return registry.get(name)
+
+
+def warm_up(names: Iterable[str] = None) -> List[Any]:
+    """预先导入Plan"""
+    return registry.warm_up(names)
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""remote - 在其他进程/机器上运行Plan
+
+工作进程通过TCP或Unix套接字提供一组Plan:
+
+    PLANNER_AUTHKEY=... python -m planner.remote --listen 0.0.0.0:9000 report=reports.daily:DailyReport
+
+客户端的RemotePlan可以直接运行 也可以像其他action一样注册到本地的Plan中:
+
+    >>> report = RemotePlan('report', workers=['10.0.0.1:9000', '10.0.0.2:9000'])
+    >>> Plan.register(report)
+
+#. 执行参数与结果以planner.serialize序列化(lambda、create_plan创建的Plan按值传递)
+#. 作为action时 传递result与执行参数; result_mapper只在send_results=True时传递
+#. 每个工作进程的连接被复用 选择(本地未完成的请求数 + 工作进程报告的运行数)最小的工作进程
+#. 无法连接的工作进程暂时跳过 请求改由其他工作进程处理; 已发送的请求不会重试
+#. 已失效的空闲连接(例如工作进程重启后)被丢弃 未发送的请求以新的连接重试一次
+#. 工作进程中的PlanException带着路径传回 作为action时外层的路径继续添加在前面
+#. 工作进程在同一台机器上时 可以给定transport 经共享内存传递大的执行参数与结果(参见planner.transport)
+
+序列化基于pickle: 只应在可信的网络中使用 并且设置authkey(连接时以HMAC验证)。
+命令行的工作进程没有authkey时只能监听本机的地址。
+
+"""
+from __future__ import annotations
+
+import argparse
+import ipaddress
+import os
+import socket
+import threading
+import time
+from itertools import count
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from planner.error import portable_exception
+from planner.registry import PlanRegistry, get_plan, register_plan
+from planner.serialize import dumps, loads
+
+Address = Union[str, Tuple[str, int]]
+"""'host:port'、(host, port) 或者Unix套接字路径"""
+
+EXECUTE = 'execute'
+"""请求: 运行Plan"""
+STATUS = 'status'
+"""请求: 工作进程提供的Plan与当前的运行数"""
+
+OK = 'ok'
+ERROR = 'error'
+
+RETRY_AFTER = 5.0
+"""无法连接的工作进程在此时间(秒)内被跳过"""
+
+DROPPED_PARAMETERS = ('result_mapper', 'action_mapper')
+"""作为action时不传递的参数"""
+
+
+def parse_address(address: Address) -> Address:
+    """'host:port'转换为(host, port) 'unix:/path'或者路径为Unix套接字"""
+    if isinstance(address, tuple):
+        return address
+
+    if address.startswith('unix:'):
+        return address[len('unix:'):]
+
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return host.strip('[]') or '127.0.0.1', int(port)
+
+    return address
+
+
+def is_local(address: Address) -> bool:
+    """是否只能从本机连接: 回环地址或者Unix套接字"""
+    if not isinstance(address, tuple):
+        return True
+
+    host = address[0]
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WorkerServer(object):
+    """在套接字上提供一组Plan的工作进程
+
+    每个连接在独立的线程中按顺序处理请求 多个连接的请求并发运行。
+
+    Args:
+        plans: {名称: Plan或者导入路径} 或者名称的列表(在全局注册表中查找 参见planner.registry)
+        address: 监听的地址 端口为0时自动分配
+        authkey: 连接时验证的密钥
+        warm_up: 启动前导入全部Plan
+        transport: 经共享内存返回大的结果
+    """
+
+    def __init__(self, plans: Union[Mapping[str, Any], Iterable[str]], address: Address = ('127.0.0.1', 0),
+                 authkey: Optional[bytes] = None, warm_up: bool = True, transport=None):
+        from multiprocessing.connection import Listener
+
+        # 给定的Plan与导入路径只在此工作进程中注册 名称在全局注册表中查找
+        self._registry = PlanRegistry(group=None)
+        self._local = frozenset(plans) if isinstance(plans, Mapping) else frozenset()
+        for name in self._local:
+            self._registry.register(name, plans[name])
+        self.names = frozenset(plans)
+
+        if warm_up:
+            for name in self.names:
+                self.get_plan(name)
+
+        self.authkey = authkey
+        self.transport = transport
+        self.active = 0
+        """正在运行的请求数"""
+        self.requests = 0
+        """已处理的请求数"""
+
+        self._listener = Listener(parse_address(address), backlog=64, authkey=authkey)
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Address:
+        """实际监听的地址"""
+        return self._listener.address
+
+    def get_plan(self, name: str):
+        if name not in self.names:
+            raise LookupError(f'Plan {name} is not served by this worker.')
+
+        if name in self._local:
+            return self._registry.get(name)
+        return get_plan(name)
+
+    def serve_forever(self) -> None:
+        """接受连接 直至close()"""
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            except Exception:
+                # 验证失败 或者close()唤醒时的连接
+                continue
+
+            if self._closed:
+                connection.close()
+                return
+
+            with self._lock:
+                self._connections.add(connection)
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def start(self) -> WorkerServer:
+        """在后台线程中接受连接"""
+        self._thread = threading.Thread(target=self.serve_forever, name='planner-worker', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+
+        # 关闭监听的套接字不能中断阻塞的accept: 以一个空连接唤醒
+        if self._thread is not None:
+            self._wake_up()
+            self._thread.join()
+        self._listener.close()
+
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            connection.close()
+
+    def _wake_up(self) -> None:
+        address = self.address
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+        try:
+            with socket.socket(family) as sock:
+                sock.connect(address)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def handle(self, connection) -> None:
+        """按顺序处理一个连接的请求"""
+        try:
+            while True:
+                try:
+                    request = connection.recv_bytes()
+                except (EOFError, OSError):
+                    return
+
+                connection.send_bytes(self.respond(request))
+        except OSError:
+            return
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def respond(self, request: bytes) -> bytes:
+        """处理一个请求: 返回(状态, 结果或者异常, 当前的运行数)"""
+        with self._lock:
+            self.active += 1
+            self.requests += 1
+
+        try:
+            op, arguments = loads(request)
+
+            if op == EXECUTE:
+                name, execute_parameter = arguments
+                status, value = OK, self.get_plan(name).execute(**execute_parameter)
+            elif op == STATUS:
+                status, value = OK, sorted(self.names)
+            else:
+                raise ValueError(f'unknown request: {op!r}.')
+
+        except Exception as e:
+            status, value = ERROR, e
+
+        with self._lock:
+            self.active -= 1
+            load = self.active
+
+        try:
+            if self.transport is not None:
+                return self.transport.dumps((status, value, load))
+            return dumps((status, value, load))
+        except Exception as e:
+            # 结果不能序列化
+            error = value if status == ERROR else e
+            return dumps((ERROR, portable_exception(error), load))
+
+
+class Worker(object):
+    """客户端所见的一个工作进程"""
+
+    def __init__(self, address: Address):
+        self.address = parse_address(address)
+        self.in_flight = 0
+        """此客户端未完成的请求数"""
+        self.load = 0
+        """工作进程最近报告的运行数(包括其他客户端的请求)"""
+        self.calls = 0
+        self.failures = 0
+        """连接失败的次数"""
+        self.down_until = 0.0
+        self.idle: List[Any] = []
+        """空闲的连接"""
+
+    def __repr__(self):
+        return f'<Worker {self.address} in_flight={self.in_flight} load={self.load}>'
+
+
+class RemotePlan(object):
+    """在工作进程中运行的Plan
+
+    Args:
+        name: 工作进程中的Plan名称
+        workers: 工作进程的地址
+        authkey: 连接时验证的密钥
+        max_idle: 每个工作进程保留的空闲连接数
+        send_results: 作为action时是否传递result_mapper(之前全部action的结果)
+        transport: 经共享内存发送大的执行参数
+    """
+
+    def __init__(self, name: str, workers: Iterable[Address], authkey: Optional[bytes] = None,
+                 max_idle: int = 8, send_results: bool = False, transport=None):
+        self.name = name
+        self.workers = [Worker(_) for _ in workers]
+        if not self.workers:
+            raise ValueError('at least one worker address is required.')
+
+        self.authkey = authkey
+        self.max_idle = max_idle
+        self.send_results = send_results
+        self.transport = transport
+        self._counter = count()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 传递到其他进程时只保留配置
+        return {'name': self.name, 'workers': [_.address for _ in self.workers], 'authkey': self.authkey,
+                'max_idle': self.max_idle, 'send_results': self.send_results, 'transport': self.transport}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<RemotePlan {self.name}>'
+
+    def __call__(self, **kwargs):
+        """作为action运行"""
+        execute_parameter = {k: v for k, v in kwargs.items() if k not in DROPPED_PARAMETERS}
+        if self.send_results and kwargs.get('result_mapper') is not None:
+            execute_parameter['result_mapper'] = dict(kwargs['result_mapper'])
+
+        return self.execute(**execute_parameter)
+
+    def execute(self, **execute_parameter):
+        """在工作进程中运行此Plan"""
+        return self.request(EXECUTE, (self.name, execute_parameter))
+
+    def status(self) -> Dict[Address, Any]:
+        """每个工作进程提供的Plan名称 无法连接时为异常"""
+        statuses = {}
+        for worker in self.workers:
+            try:
+                statuses[worker.address] = self._send(worker, self._connect(worker), STATUS, None)
+            except Exception as e:
+                statuses[worker.address] = e
+        return statuses
+
+    def select(self) -> List[Worker]:
+        """按负载排列的可用工作进程 负载相同时轮流选择"""
+        now = time.monotonic()
+        offset = next(self._counter)
+        size = len(self.workers)
+
+        with self._lock:
+            candidates = [self.workers[(offset + i) % size] for i in range(size)]
+            available = [_ for _ in candidates if _.down_until <= now] or candidates
+            return sorted(available, key=lambda _: _.in_flight + _.load)
+
+    def _connect(self, worker: Worker):
+        while True:
+            with self._lock:
+                if not worker.idle:
+                    break
+                connection = worker.idle.pop()
+
+            # 空闲的连接不应有数据可读: 可读时对方已关闭(例如工作进程重启)
+            try:
+                stale = connection.poll()
+            except (EOFError, OSError):
+                stale = True
+
+            if not stale:
+                return connection
+            connection.close()
+
+        return self._open(worker)
+
+    def _open(self, worker: Worker):
+        from multiprocessing.connection import Client
+
+        return Client(worker.address, authkey=self.authkey)
+
+    def request(self, op: str, arguments: Any) -> Any:
+        """发送请求到负载最小的工作进程 无法连接时尝试下一个"""
+        error = None
+
+        for worker in self.select():
+            try:
+                connection = self._connect(worker)
+            except OSError as e:
+                with self._lock:
+                    worker.failures += 1
+                    worker.down_until = time.monotonic() + RETRY_AFTER
+                error = e
+                continue
+
+            return self._send(worker, connection, op, arguments)
+
+        raise ConnectionError(f'no worker is available for plan {self.name}: {error}')
+
+    def _send(self, worker: Worker, connection, op: str, arguments: Any) -> Any:
+        request = self.transport.dumps((op, arguments)) if self.transport is not None else dumps((op, arguments))
+
+        with self._lock:
+            worker.in_flight += 1
+            worker.calls += 1
+
+        try:
+            try:
+                connection.send_bytes(request)
+            except OSError:
+                # 请求没有发送: 以新的连接重试一次
+                connection.close()
+                connection = self._open(worker)
+                connection.send_bytes(request)
+
+            status, value, load = loads(connection.recv_bytes())
+        except (EOFError, OSError) as e:
+            connection.close()
+            raise ConnectionError(f'worker {worker.address} failed while running plan {self.name}: {e!r}') from e
+        except BaseException:
+            # 连接状态未知 不再复用
+            connection.close()
+            raise
+        finally:
+            with self._lock:
+                worker.in_flight -= 1
+
+        with self._lock:
+            worker.load = load
+            worker.down_until = 0.0
+            if len(worker.idle) < self.max_idle:
+                worker.idle.append(connection)
+                connection = None
+
+        if connection is not None:
+            connection.close()
+
+        if status == ERROR:
+            raise value
+        return value
+
+    def close(self) -> None:
+        """关闭空闲的连接"""
+        with self._lock:
+            for worker in self.workers:
+                for connection in worker.idle:
+                    connection.close()
+                worker.idle.clear()
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m planner.remote', description='planner worker server')
+    parser.add_argument('plans', nargs='+', help='plan names, or name=module:Plan')
+    parser.add_argument('--listen', default='127.0.0.1:9000', help='host:port or unix:/path')
+    parser.add_argument('--authkey-env', default='PLANNER_AUTHKEY',
+                        help='environment variable holding the authentication key')
+    args = parser.parse_args(argv)
+
+    names = []
+    for plan in args.plans:
+        name, sep, path = plan.partition('=')
+        if sep:
+            register_plan(name, path)
+        names.append(name)
+
+    authkey = os.environ.get(args.authkey_env)
+    if not authkey and not is_local(parse_address(args.listen)):
+        # 没有验证时 任何能连接的人都可以发送pickle(即执行任意代码)
+        parser.error(f'listening on {args.listen} requires an authentication key in ${args.authkey_env}.')
+
+    server = WorkerServer(names, args.listen, authkey.encode() if authkey else None)
+    print(f'serving {", ".join(sorted(names))} on {server.address}', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
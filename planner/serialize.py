@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""serialize - Plan的序列化
+
+#. 可以按引用导入的函数/Plan 按引用序列化(与pickle相同)
+#. lambda、局部函数 按值序列化: 字节码、所属模块、闭包、默认参数
+#. create_plan创建的Plan 按值序列化: 名称、基类、属性、actions、action选项
+
+用于将Plan传递到其他进程。字节码只能在相同版本的Python之间传递
+
+"""
+from __future__ import annotations
+
+import builtins
+import importlib
+import io
+import marshal
+import pickle
+import sys
+from types import FunctionType, CellType, ModuleType
+from typing import Any
+
+from planner.core import PlanMeta
+
+_PLAN_EXCLUDED_ATTRS = {
+    '__dict__', '__weakref__',
+    'actions', 'action_options', 'executor', 'result_store', 'checkpoint_store', 'incremental_store', 'profiler',
+    'recorder',
+    '_action_result_var', '_compiled', '_instructions', '_graph', '_dag_executor',
+}
+"""按值序列化Plan时忽略的属性: 由PlanMeta重新生成 或者不能跨进程"""
+
+SHARED_MAGIC = b'PLANNER-SHM1'
+"""使用共享内存的序列化结果的前缀: 与planner.transport.MAGIC相同"""
+
+
+class _Empty(object):
+    """空的闭包变量"""
+
+
+def _lookup(obj) -> Any:
+    """按模块与限定名称查找对象"""
+    target = sys.modules[obj.__module__]
+    for name in obj.__qualname__.split('.'):
+        target = getattr(target, name)
+    return target
+
+
+def is_importable(obj) -> bool:
+    """是否可以按引用序列化"""
+    try:
+        return '<' not in obj.__qualname__ and _lookup(obj) is obj
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+def _global_names(code) -> set:
+    """字节码(包括嵌套的函数)中引用的全局变量名称"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= _global_names(const)
+    return names
+
+
+def _module_globals(module_name: str, captured: dict) -> dict:
+    """函数所属模块的全局变量
+
+    __main__中的函数在其他进程中无法导入其模块 使用序列化时捕获的全局变量
+    """
+    if captured is None:
+        try:
+            return vars(sys.modules.get(module_name) or importlib.import_module(module_name))
+        except (ImportError, TypeError):
+            captured = {}
+
+    return {'__builtins__': builtins, '__name__': module_name, **captured}
+
+
+def _make_function(code: bytes, module_name: str, name: str, cells: int, captured: dict = None) -> FunctionType:
+    return FunctionType(marshal.loads(code), _module_globals(module_name, captured), name, None,
+                        tuple(CellType() for _ in range(cells)) or None)
+
+
+def _set_function_state(function: FunctionType, state: tuple) -> None:
+    defaults, kwdefaults, closure, attrs, qualname = state
+
+    function.__defaults__ = defaults
+    function.__kwdefaults__ = kwdefaults
+    function.__dict__.update(attrs)
+    function.__qualname__ = qualname
+
+    for cell, value in zip(function.__closure__ or (), closure):
+        if value is not _Empty:
+            cell.cell_contents = value
+
+
+def _reduce_function(function: FunctionType):
+    """按值序列化函数: 闭包在函数创建后设置 以支持递归引用"""
+    closure = []
+    for cell in function.__closure__ or ():
+        try:
+            closure.append(cell.cell_contents)
+        except ValueError:
+            closure.append(_Empty)
+
+    state = (function.__defaults__, function.__kwdefaults__, tuple(closure), function.__dict__,
+             function.__qualname__)
+    captured = None
+    if function.__module__ in ('__main__', '__mp_main__', None):
+        function_globals = function.__globals__
+        captured = {_: function_globals[_] for _ in _global_names(function.__code__) if _ in function_globals}
+
+    arguments = (marshal.dumps(function.__code__), function.__module__, function.__name__, len(closure), captured)
+
+    return _make_function, arguments, state, None, None, _set_function_state
+
+
+def _make_plan(metaclass, name: str, bases: tuple, attrs: dict, actions: list, action_options: dict):
+    plan = metaclass(name, bases, attrs, actions)
+    plan.action_options.update(action_options)
+    return plan
+
+
+def _reduce_plan(plan):
+    """按值序列化Plan"""
+    attrs = {k: v for k, v in vars(plan).items() if k not in _PLAN_EXCLUDED_ATTRS}
+
+    return _make_plan, (type(plan), plan.__name__, plan.__bases__, attrs, list(plan.actions),
+                        dict(plan.action_options))
+
+
+class PlanPickler(pickle.Pickler):
+    """不能按引用序列化的函数与Plan 按值序列化"""
+
+    def reducer_override(self, obj):
+        if isinstance(obj, PlanMeta):
+            return NotImplemented if is_importable(obj) else _reduce_plan(obj)
+
+        elif isinstance(obj, FunctionType):
+            return NotImplemented if is_importable(obj) else _reduce_function(obj)
+
+        elif isinstance(obj, (classmethod, staticmethod)):
+            return type(obj), (obj.__func__,)
+
+        # 按值序列化的函数所捕获的模块
+        elif isinstance(obj, ModuleType):
+            return importlib.import_module, (obj.__name__,)
+
+        return NotImplemented
+
+
+def dumps(obj, protocol: int = pickle.HIGHEST_PROTOCOL) -> bytes:
+    """序列化Plan(或者包含Plan、函数的任意对象)"""
+    buffer = io.BytesIO()
+    PlanPickler(buffer, protocol).dump(obj)
+    return buffer.getvalue()
+
+
+def loads(data: bytes) -> Any:
+    """反序列化 包括使用共享内存的序列化结果(planner.transport)"""
+    if data[:len(SHARED_MAGIC)] == SHARED_MAGIC:
+        from planner.transport import loads as shared_loads
+        return shared_loads(data)
+
+    return pickle.loads(data)
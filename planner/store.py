@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""store - action结果的存储
+
+每一层Plan的执行开始时由begin创建结果字典 结束(包括失败)时调用end。
+通过Plan.result_store指定 子类可以单独指定。
+
+#. ContextResultStore: 保留当前上下文(线程/协程任务)中最近一次执行的结果 (默认)
+#. ScopedResultStore: 结果仅在执行期间存在 执行结束后释放
+#. RetainedResultStore: 执行结束后释放 但按策略保留最近的若干次执行(次数/字节数)
+#. NullResultStore: 不记录结果 get_results()与result_mapper中不包含任何结果
+
+"""
+from __future__ import annotations
+
+import sys
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ResultStore(object):
+    """结果存储的基类"""
+
+    def begin(self, plan) -> Dict[str, Any]:
+        """一层Plan的执行开始: 返回用于记录结果的字典"""
+        results = {}
+        plan._action_result_var.set(results)
+        return results
+
+    def end(self, plan, results: Dict[str, Any]) -> None:
+        """一层Plan的执行结束(包括失败)"""
+
+    def get(self, plan) -> Dict[str, Any]:
+        """当前上下文中可见的结果 即Plan.get_results()"""
+        results = plan._action_result_var.get(None)
+        return results if results is not None else {}
+
+
+class ContextResultStore(ResultStore):
+    """保留当前上下文中最近一次执行的结果
+
+    每个线程/协程任务拥有独立的上下文 线程结束后其结果随上下文释放
+    """
+
+    def get(self, plan) -> Dict[str, Any]:
+        results = plan._action_result_var.get(None)
+        if results is None:
+            results = {}
+            plan._action_result_var.set(results)
+        return results
+
+
+class ScopedResultStore(ResultStore):
+    """结果仅在执行期间存在 执行结束后释放"""
+
+    def end(self, plan, results: Dict[str, Any]) -> None:
+        plan._action_result_var.set(None)
+
+
+class RetainedResultStore(ScopedResultStore):
+    """执行结束后释放 但保留最近的若干次执行
+
+    Args:
+        max_executions: 最多保留的执行次数
+        max_bytes: 最多保留的字节数(按sys.getsizeof浅层估计)
+    """
+
+    def __init__(self, max_executions: int = 16, max_bytes: Optional[int] = None):
+        self.max_executions = max_executions
+        self.max_bytes = max_bytes
+        self.size = 0
+        """当前保留的字节数"""
+        self._retained: deque = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(results: Dict[str, Any]) -> int:
+        """结果字典的大小(浅层估计)"""
+        return sys.getsizeof(results) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in results.items())
+
+    def end(self, plan, results: Dict[str, Any]) -> None:
+        super().end(plan, results)
+
+        size = self.sizeof(results)
+
+        with self._lock:
+            self._retained.append((plan.__name__, results, size))
+            self.size += size
+
+            while self._retained and (len(self._retained) > self.max_executions or (
+                    self.max_bytes is not None and self.size > self.max_bytes)):
+                self.size -= self._retained.popleft()[2]
+
+    def history(self, plan=None) -> List[Tuple[str, Dict[str, Any]]]:
+        """保留的执行结果(由旧到新): [(Plan名称, 结果字典)]"""
+        name = getattr(plan, '__name__', plan)
+
+        with self._lock:
+            return [(_[0], _[1]) for _ in self._retained if name is None or _[0] == name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._retained.clear()
+            self.size = 0
+
+
+class _DiscardDict(dict):
+    """丢弃所有写入的字典"""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class NullResultStore(ResultStore):
+    """不记录结果: 适用于从不读取get_results()与result_mapper的Plan"""
+
+    _discard = _DiscardDict()
+
+    def begin(self, plan) -> Dict[str, Any]:
+        return self._discard
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""stream - 流式执行
+
+第一个action(数据源)只运行一次 其结果被逐项迭代; 之后的action逐项运行:
+
+#. 一个参数的action得到当前项 不定参数的action以result得到当前项
+#. 返回生成器的action: 生成的每一项分别传给下游(可以用于展开或者过滤)
+#. 其他action: 返回值作为一项传给下游
+#. Plan.buffer_size > 0时 每个阶段在独立的线程中运行 阶段之间以有界队列连接
+#. 内存占用取决于队列大小 与数据量无关
+#. 出错时PlanException.item记录出错的项: (数据源中的序号, 项)
+
+action结果只记录每个阶段最近一项的结果。特殊返回值(pass)在流模式中不生效;
+控制执行流程的返回值(Stop/Skip/Branch)抛出ValueError。
+
+"""
+from __future__ import annotations
+
+import threading
+from contextvars import copy_context
+from queue import Queue, Full, Empty
+from types import GeneratorType
+from typing import Any, Iterator, Iterable, Tuple
+
+from planner.control import CONTROLS, unsupported
+from planner.engine import NO_ARGUMENT, POSITIONAL, STREAM, Frame, new_frame, close_frames, frame_path, observed_call, \
+    plan_start, plan_end
+from planner.error import PlanException, SpecActions
+from planner.hooks import subscribers
+
+_DONE = object()
+"""队列中的结束标记"""
+
+
+def call_stage(frame: Frame, spec, item) -> Any:
+    """以当前项调用一个阶段的action
+
+    各阶段可能在不同的线程中运行 不读写frame.last_result
+    """
+    kind = spec.kind
+    target = spec.target
+
+    if kind is NO_ARGUMENT:
+        return target()
+    elif kind is POSITIONAL:
+        return target(item)
+
+    return target(**frame.parameter, result=item, result_mapper=frame.result_mapper, action_mapper=frame.action_mapper)
+
+
+def check_control(value):
+    """流模式不支持控制执行流程的返回值"""
+    if type(value) in CONTROLS:
+        raise unsupported(value, STREAM)
+    return value
+
+
+def stream_exception(e: Exception, frame: Frame, index: int, item: Tuple[int, Any] = None) -> PlanException:
+    """包装异常: 记录出错的阶段与项"""
+    if isinstance(e, PlanException):
+        return e
+
+    # 各阶段可能同时出错 不修改frame.index
+    exception = PlanException(e, frame.plan, origin_action=frame.specs[index].action)
+    exception.add_action_trace(frame.plan, index, SpecActions(frame.specs))
+    exception.item = item
+
+    return exception
+
+
+def source(frame: Frame) -> Iterator[Tuple[int, Any]]:
+    """数据源: 运行第一个action 逐项返回(序号, 项)"""
+    spec = frame.specs[0]
+    position = -1
+
+    try:
+        for position, item in enumerate(check_control(run_stage(frame, 0, spec, frame.result))):
+            frame.results[spec.name] = check_control(item)
+            yield position, item
+    except Exception as e:
+        raise stream_exception(e, frame, 0, (position + 1, None)) from None
+
+
+def run_stage(frame: Frame, index: int, spec, item) -> Any:
+    """调用一个阶段 存在订阅者时发送事件"""
+    plan = frame.plan
+
+    if subscribers or plan.is_output:
+        path = f'{frame_path(frame)}/[{index + 1}] {spec.name}'
+        return observed_call(plan, spec, path, call_stage, frame, spec, item)
+
+    return call_stage(frame, spec, item)
+
+
+def stage(frame: Frame, index: int, items: Iterable[Tuple[int, Any]]) -> Iterator[Tuple[int, Any]]:
+    """一个阶段: 对上游的每一项运行action"""
+    spec = frame.specs[index]
+    results = frame.results
+    name = spec.name
+
+    for position, item in items:
+        try:
+            value = run_stage(frame, index, spec, item)
+
+            if type(value) is GeneratorType:
+                for value in value:
+                    results[name] = check_control(value)
+                    yield position, value
+            else:
+                results[name] = check_control(value)
+                yield position, value
+
+        except Exception as e:
+            raise stream_exception(e, frame, index, (position, item)) from None
+
+
+class Buffer(object):
+    """在独立的线程中迭代上游 以有界队列传给下游"""
+
+    def __init__(self, items: Iterable, size: int):
+        self.queue = Queue(size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=copy_context().run, args=(self.produce, items), daemon=True)
+        self.thread.start()
+
+    def put(self, value) -> bool:
+        # 下游停止后不再阻塞
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(value, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce(self, items: Iterable) -> None:
+        try:
+            for value in items:
+                if not self.put(value):
+                    break
+        except BaseException as e:
+            self.put((_DONE, e))
+        else:
+            self.put((_DONE, None))
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    def __iter__(self):
+        try:
+            while True:
+                value = self.queue.get()
+
+                if value[0] is _DONE:
+                    if value[1] is not None:
+                        raise value[1]
+                    return
+
+                yield value
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # 取出一项 使阻塞中的上游可以退出
+        try:
+            self.queue.get_nowait()
+        except Empty:
+            pass
+        self.thread.join()
+
+
+def pipeline(frame: Frame) -> Iterator[Tuple[int, Any]]:
+    """连接所有阶段"""
+    buffer_size = frame.plan.buffer_size
+    items = source(frame)
+
+    for index in range(1, len(frame.specs)):
+        if buffer_size > 0:
+            items = Buffer(items, buffer_size)
+        items = stage(frame, index, items)
+
+    return items
+
+
+def iterate_stream(plan, execute_parameter: dict) -> Iterator[Any]:
+    """流式运行Plan 逐项返回最后一个阶段的结果"""
+    frame = new_frame(plan, plan.compile(), execute_parameter)
+
+    if not frame.specs:
+        close_frames([frame])
+        return
+
+    plan_start(frame)
+    items = pipeline(frame)
+    error = None
+
+    try:
+        for _, frame.last_result in items:
+            yield frame.last_result
+
+    except PlanException as e:
+        error = e.origin_exception
+        raise
+
+    finally:
+        # 提前停止时同样关闭所有阶段
+        items.close()
+        close_frames([frame])
+        plan_end(frame, error)
+
+
+def run_stream(plan, execute_parameter: dict) -> Any:
+    """流式运行Plan 返回最后一项的结果"""
+    result = None
+    for result in iterate_stream(plan, execute_parameter):
+        pass
+    return result
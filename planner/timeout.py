@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""timeout - action的超时与对冲执行
+
+注册时给定timeout/hedge选项的action 在编译时包装为带超时的调用目标:
+
+    >>> Plan.register(fetch, timeout=2.0, hedge='p95')
+
+#. timeout: 超过时间后抛出ActionTimeout(由执行引擎包装为PlanException 指向此action)
+#. hedge: 超过给定时间仍未完成时 再发起一次相同的调用 取先完成的结果
+#. hedge为'p95'形式时 以此action已观测到的耗时分位数作为等待时间(样本不足时不对冲)
+
+同步的action在独立的线程池中运行: Python不能中止线程 超时或者落后的调用会在后台继续运行直至结束。
+适用于I/O密集、可以重复调用(幂等)的action。
+
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextvars import copy_context
+from functools import wraps
+from time import perf_counter_ns, monotonic
+from typing import Callable, Optional, Union
+from weakref import WeakKeyDictionary
+
+from planner.error import ActionTimeout
+from planner.hooks import LatencyHistogram
+
+MAX_WORKERS = 32
+"""运行带超时action的线程池大小"""
+
+MIN_SAMPLES = 20
+"""按分位数对冲时 至少需要的样本数量"""
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+_latencies: WeakKeyDictionary = WeakKeyDictionary()
+"""每个action已观测的耗时: 重新编译后仍然保留"""
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix='planner-timeout')
+
+    return _executor
+
+
+class Guard(object):
+    """超时与对冲的设置
+
+    Args:
+        name: action名称
+        timeout: 超时时间(秒) None时不限制
+        hedge: 对冲前等待的时间(秒) 或者'p95'形式的已观测耗时分位数 None时不对冲
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = None, hedge: Union[float, str, None] = None,
+                 latency: LatencyHistogram = None):
+        self.name = name
+        self.timeout = timeout
+        self.percentile = None
+        self.hedge = None
+
+        if isinstance(hedge, str):
+            if not hedge.startswith('p'):
+                raise ValueError(f'hedge must be seconds or a percentile like "p95", got {hedge!r}.')
+            self.percentile = float(hedge[1:])
+        else:
+            self.hedge = hedge
+
+        self.hedged = 0
+        """发起对冲调用的次数"""
+        self.timeouts = 0
+        """超时的次数"""
+        self._latency = latency if latency is not None else LatencyHistogram()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_options(cls, action, name: str, options: dict) -> Optional[Guard]:
+        """由action选项创建 没有timeout/hedge时返回None"""
+        timeout, hedge = options.get('timeout'), options.get('hedge')
+        if timeout is None and hedge is None:
+            return None
+
+        try:
+            latency = _latencies.setdefault(action, LatencyHistogram())
+        except TypeError:
+            latency = None
+
+        return cls(name, timeout, hedge, latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """对冲前等待的时间(秒)"""
+        if self.percentile is None:
+            return self.hedge
+
+        with self._lock:
+            if self._latency.count < MIN_SAMPLES:
+                return None
+            return self._latency.percentile(self.percentile) / 1e9
+
+    def observe(self, duration_ns: int) -> None:
+        if self.percentile is not None:
+            with self._lock:
+                self._latency.record(duration_ns)
+
+    def timed_out(self) -> ActionTimeout:
+        with self._lock:
+            self.timeouts += 1
+        return ActionTimeout(f'action {self.name} timed out after {self.timeout} second.')
+
+    def _timed(self, target: Callable, args: tuple, kwargs: dict):
+        start = perf_counter_ns()
+        result = target(*args, **kwargs)
+        self.observe(perf_counter_ns() - start)
+        return result
+
+    def wrap(self, target: Callable) -> Callable:
+        """包装同步的调用目标: 在线程池中运行 等待结果"""
+
+        @wraps(target)
+        def guarded(*args, **kwargs):
+            executor = get_executor()
+            deadline = monotonic() + self.timeout if self.timeout is not None else None
+
+            def submit():
+                return executor.submit(copy_context().run, self._timed, target, args, kwargs)
+
+            futures = {submit()}
+            delay = self.hedge_delay()
+
+            if delay is not None:
+                done, _ = wait(futures, delay if deadline is None else min(delay, deadline - monotonic()))
+                if not done and (deadline is None or monotonic() < deadline):
+                    with self._lock:
+                        self.hedged += 1
+                    futures.add(submit())
+
+            # 取先成功的结果 全部失败时抛出先完成的异常
+            error = None
+            while futures:
+                done, futures = wait(futures, None if deadline is None else max(deadline - monotonic(), 0),
+                                     return_when=FIRST_COMPLETED)
+                if not done:
+                    raise self.timed_out()
+
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = error or future.exception()
+
+            raise error
+
+        return guarded
+
+    def wrap_async(self, target: Callable) -> Callable:
+        """包装需要await的调用目标"""
+
+        @wraps(target)
+        async def guarded(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout if self.timeout is not None else None
+
+            async def timed():
+                start = perf_counter_ns()
+                result = await target(*args, **kwargs)
+                self.observe(perf_counter_ns() - start)
+                return result
+
+            tasks = {asyncio.ensure_future(timed())}
+
+            try:
+                delay = self.hedge_delay()
+
+                if delay is not None:
+                    done, _ = await asyncio.wait(tasks, timeout=delay if deadline is None else min(
+                        delay, deadline - loop.time()))
+                    if not done and (deadline is None or loop.time() < deadline):
+                        with self._lock:
+                            self.hedged += 1
+                        tasks.add(asyncio.ensure_future(timed()))
+
+                error = None
+                while tasks:
+                    done, tasks = await asyncio.wait(
+                        tasks, timeout=None if deadline is None else max(deadline - loop.time(), 0),
+                        return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        raise self.timed_out()
+
+                    for task in done:
+                        if task.exception() is None:
+                            return task.result()
+                        error = error or task.exception()
+
+                raise error
+
+            finally:
+                # 协程可以取消
+                for task in tasks:
+                    task.cancel()
+
+        return guarded
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""transport - 以共享内存在进程之间传递大的结果
+
+序列化时 大于阈值的缓冲区对象(bytes、bytearray、memoryview、array、支持pickle协议5的NumPy数组等)
+写入共享内存段或者内存映射文件 序列化结果中只保留其句柄:
+
+    >>> transport = SharedMemoryTransport(threshold=1 << 16)
+    >>> Plan.map(inputs, transport=transport)
+
+#. shm: multiprocessing.shared_memory 读取时复制一次后立即释放共享内存段
+#. mmap: 临时目录中的文件 读取时映射并删除文件; 映射在最后一个引用(例如NumPy数组)释放后解除 不复制
+#. 每个句柄只能被读取一次: 读取者负责释放
+#. 未被读取的段在close()(或者Transport被回收、进程退出)时释放; mmap模式同时删除临时目录
+#. planner.serialize.loads可以直接读取 接收方不需要Transport
+
+句柄只在同一台机器上有效。
+
+"""
+from __future__ import annotations
+
+import io
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from array import array
+from typing import Any, List, Optional, Set, Tuple
+
+from planner.serialize import PlanPickler, SHARED_MAGIC
+
+MAGIC = SHARED_MAGIC
+"""使用共享内存的序列化结果的前缀"""
+
+SHM = 'shm'
+"""共享内存段"""
+MMAP = 'mmap'
+"""内存映射文件"""
+
+SHM_DIRECTORY = '/dev/shm'
+"""Linux上共享内存段所在的目录: 用于检查段是否已被释放"""
+
+MAX_PENDING = 1024
+"""记录的未释放段超过此数量时 清除已被读取的段"""
+
+Handle = Tuple[str, str, int]
+"""(方式, 共享内存段名称或者文件路径, 字节数)"""
+
+
+def _make_memoryview(buffer, format: str, shape: tuple) -> memoryview:
+    view = memoryview(buffer).cast('B')
+    return view.cast(format, shape) if shape else view.cast(format)
+
+
+def _make_array(typecode: str, buffer) -> array:
+    result = array(typecode)
+    result.frombytes(buffer)
+    return result
+
+
+def _unlink_shm(name: str) -> None:
+    from multiprocessing.shared_memory import SharedMemory
+
+    try:
+        shm = SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _release(backend: str, pending: Set[str], directory: Optional[str], owns_directory: bool) -> None:
+    """释放未被读取的段"""
+    for target in list(pending):
+        release((backend, target, 0))
+    pending.clear()
+
+    if owns_directory and directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TransportPickler(PlanPickler):
+    """大于阈值的缓冲区写入共享内存
+
+    bytes、bytearray、memoryview、array以persistent_id替换为句柄的序号(pickle不对bytes调用reducer_override);
+    其余对象(NumPy数组等)以协议5的带外缓冲区传递
+    """
+
+    def __init__(self, file, transport: SharedMemoryTransport):
+        super().__init__(file, 5, buffer_callback=self.store)
+        self.transport = transport
+        self.handles: List[Handle] = []
+        self.out_of_band: List[int] = []
+        """带外缓冲区的句柄序号"""
+
+    def persistent_id(self, obj):
+        kind = type(obj)
+
+        if kind is bytes or kind is bytearray:
+            size, meta = len(obj), None
+        elif kind is array:
+            size, meta = len(obj) * obj.itemsize, obj.typecode
+        elif kind is memoryview and obj.contiguous:
+            size, meta = obj.nbytes, (obj.format, obj.shape)
+        else:
+            return None
+
+        if size < self.transport.threshold:
+            return None
+
+        self.handles.append(self.transport.put(memoryview(obj).cast('B')))
+        return kind.__name__, len(self.handles) - 1, meta
+
+    def store(self, buffer: pickle.PickleBuffer) -> bool:
+        """返回True时在序列化结果中保存 否则写入共享内存"""
+        view = buffer.raw()
+        if view.nbytes < self.transport.threshold:
+            return True
+
+        self.handles.append(self.transport.put(view))
+        self.out_of_band.append(len(self.handles) - 1)
+        return False
+
+
+class TransportUnpickler(pickle.Unpickler):
+    """由共享内存中的缓冲区重建对象"""
+
+    def __init__(self, file, buffers: list, out_of_band: List[int]):
+        super().__init__(file, buffers=[buffers[_] for _ in out_of_band])
+        self.shared = buffers
+
+    def persistent_load(self, pid):
+        kind, index, meta = pid
+        buffer = self.shared[index]
+
+        if kind == 'bytes':
+            return bytes(buffer)
+        elif kind == 'bytearray':
+            # shm模式下读取时已经复制
+            return buffer if type(buffer) is bytearray else bytearray(buffer)
+        elif kind == 'array':
+            return _make_array(meta, buffer)
+        elif kind == 'memoryview':
+            return _make_memoryview(buffer, *meta)
+
+        raise pickle.UnpicklingError(f'unknown shared buffer: {pid!r}.')
+
+
+class SharedMemoryTransport(object):
+    """以共享内存传递大的缓冲区对象
+
+    Args:
+        threshold: 不小于此字节数的缓冲区写入共享内存
+        backend: shm(共享内存段) 或者 mmap(内存映射文件)
+        directory: mmap模式下保存文件的目录 默认为新的临时目录(close()时删除)
+    """
+
+    def __init__(self, threshold: int = 1 << 16, backend: str = SHM, directory: Optional[str] = None):
+        if backend not in (SHM, MMAP):
+            raise ValueError(f'backend must be {SHM} or {MMAP}, got {backend!r}.')
+
+        self.threshold = threshold
+        self.backend = backend
+        self.directory = directory
+        self._owns_directory = False
+
+        if backend == MMAP and directory is None:
+            self.directory = tempfile.mkdtemp(prefix='planner-transport-')
+            self._owns_directory = True
+
+        self.pending: Set[str] = set()
+        """此进程写入、可能尚未被读取的段"""
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _release, backend, self.pending, self.directory,
+                                           self._owns_directory)
+
+    def __getstate__(self):
+        # 传递到其他进程时只保留配置: 目录仍然由创建它的Transport删除
+        return {'threshold': self.threshold, 'backend': self.backend, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """释放未被读取的段"""
+        self._finalizer()
+
+    def put(self, view: memoryview) -> Handle:
+        """写入一个缓冲区 返回其句柄"""
+        size = view.nbytes
+
+        if self.backend == SHM:
+            from multiprocessing import resource_tracker
+            from multiprocessing.shared_memory import SharedMemory
+
+            # 由读取者释放: 不由此进程的resource_tracker在退出时释放
+            if sys.version_info >= (3, 13):
+                shm = SharedMemory(create=True, size=max(size, 1), track=False)
+            else:
+                shm = SharedMemory(create=True, size=max(size, 1))
+                if os.name == 'posix':
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+
+            shm.buf[:size] = view
+            target = shm.name
+            shm.close()
+        else:
+            fd, target = tempfile.mkstemp(dir=self.directory, suffix='.buffer')
+            with open(fd, 'wb') as f:
+                f.write(view)
+
+        with self._lock:
+            self.pending.add(target)
+            if len(self.pending) > MAX_PENDING:
+                self._prune()
+
+        return self.backend, target, size
+
+    def _prune(self) -> None:
+        """清除已被读取的段的记录"""
+        if self.backend == SHM:
+            # 打开共享内存段会将其登记到resource_tracker: 只在可以直接检查时清除
+            if os.path.isdir(SHM_DIRECTORY):
+                self.pending.difference_update(
+                    [_ for _ in self.pending if not os.path.exists(os.path.join(SHM_DIRECTORY, _))])
+        else:
+            self.pending.difference_update([_ for _ in self.pending if not os.path.exists(_)])
+
+    def dumps(self, obj: Any) -> bytes:
+        """序列化 大的缓冲区写入共享内存"""
+        buffer = io.BytesIO()
+        pickler = TransportPickler(buffer, self)
+        pickler.dump(obj)
+
+        if not pickler.handles:
+            return buffer.getvalue()
+
+        return MAGIC + pickle.dumps((buffer.getvalue(), pickler.handles, pickler.out_of_band),
+                                    pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        """反序列化 读取并释放其中的共享内存段"""
+        return loads(data)
+
+
+def release(handle: Handle) -> None:
+    """不读取 直接释放一个段"""
+    backend, target, _ = handle
+
+    if backend == SHM:
+        _unlink_shm(target)
+    else:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+
+
+def attach(handle: Handle):
+    """读取并释放一个段"""
+    backend, target, size = handle
+
+    if backend == SHM:
+        from multiprocessing.shared_memory import SharedMemory
+
+        shm = SharedMemory(target)
+        try:
+            return bytearray(shm.buf[:size])
+        finally:
+            shm.close()
+            shm.unlink()
+
+    try:
+        if not size:
+            return b''
+        with open(target, 'rb') as f:
+            return memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY))
+    finally:
+        os.unlink(target)
+
+
+def is_shared(data: bytes) -> bool:
+    """是否为使用共享内存的序列化结果"""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def discard(data: bytes) -> None:
+    """不反序列化 直接释放其中的共享内存段"""
+    if is_shared(data):
+        for handle in pickle.loads(memoryview(data)[len(MAGIC):])[1]:
+            release(handle)
+
+
+def loads(data: bytes) -> Any:
+    """反序列化 读取并释放其中的共享内存段"""
+    if not is_shared(data):
+        return pickle.loads(data)
+
+    payload, handles, out_of_band = pickle.loads(memoryview(data)[len(MAGIC):])
+    buffers = []
+
+    try:
+        for handle in handles:
+            buffers.append(attach(handle))
+    except Exception:
+        # 其余的段同样释放
+        for handle in handles[len(buffers) + 1:]:
+            release(handle)
+        raise
+
+    return TransportUnpickler(io.BytesIO(payload), buffers, out_of_band).load()
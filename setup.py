@@ -17,6 +17,7 @@ setup(
     ],
     entry_points='''
         [console_scripts]
+        planner-history=planner.history:main
     ''',
     license='Apache License 2.0'
 )
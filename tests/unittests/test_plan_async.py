@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+
+
+async def async_action(**kwargs):
+    await asyncio.sleep(0.01)
+    return kwargs['ident']
+
+
+async def async_error(x):
+    await asyncio.sleep(0)
+    raise ValueError(x)
+
+
+def blocking_action():
+    return threading.get_ident()
+
+
+class test_plan_asyncTestCase(unittest.TestCase):
+
+    def test_aexecute(self):
+        """await协程action 普通action直接运行"""
+        plan = create_plan(actions=[async_action, lambda x: x * 2])
+
+        assert asyncio.run(plan.aexecute(ident=2)) == 4
+
+    def test_nested_plan(self):
+        """嵌套的异步Plan"""
+        inner_plan = create_plan('inner_plan', actions=[async_action])
+        plan = create_plan(actions=[lambda: None, inner_plan, lambda x: x + 1])
+
+        assert asyncio.run(plan.aexecute(ident=1)) == 2
+
+    def test_blocking(self):
+        """blocking的action放入线程池运行"""
+        plan = create_plan()
+        plan.register(blocking_action, blocking=True)
+
+        assert asyncio.run(plan.aexecute()) != threading.get_ident()
+
+    def test_concurrent_results(self):
+        """同一事件循环中并发的执行拥有独立的结果字典"""
+        plan = create_plan()
+
+        plan.register(async_action)
+
+        @plan.register
+        async def check_results(**kwargs):
+            await asyncio.sleep(0.01)
+            return plan.get_results()['async_action'], kwargs['result_mapper']['async_action']
+
+        async def main():
+            return await asyncio.gather(*[plan.aexecute(ident=_) for _ in range(10)])
+
+        assert asyncio.run(main()) == [(_, _) for _ in range(10)]
+
+    def test_error(self):
+        """协程action的异常"""
+        plan = create_plan(actions=[lambda: 1, async_error])
+
+        with self.assertRaises(PlanException) as e:
+            asyncio.run(plan.aexecute())
+
+        assert isinstance(e.exception.origin_exception, ValueError)
+        assert [flag for flag, _ in e.exception.trace[0]] == [False, True]
+        assert 'raise ValueError' in str(e.exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
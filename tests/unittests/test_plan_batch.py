@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from planner import create_plan
+from planner.batch import get_batcher, make_item
+from planner.error import PlanException
+
+
+class Backend(object):
+    """记录每次batch调用的item"""
+
+    def __init__(self, sleep=0.01):
+        self.sleep = sleep
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        time.sleep(self.sleep)
+        return [KeyError(item) if item == 'missing' else f'user-{item}' for item in items]
+
+    async def run(self, items):
+        self.batches.append(list(items))
+        await asyncio.sleep(self.sleep)
+        return [f'user-{item}' for item in items]
+
+
+def start(**kwargs):
+    return kwargs.get('value')
+
+
+def get_user(user_id):
+    raise AssertionError('batched action is not called')
+
+
+async def aget_user(user_id):
+    raise AssertionError('batched action is not called')
+
+
+def run_concurrently(plan, values, workers=None):
+    barrier = threading.Barrier(len(values))
+
+    def run(value):
+        barrier.wait()
+        return plan.execute(value=value)
+
+    with ThreadPoolExecutor(workers or len(values)) as executor:
+        return list(executor.map(run, values))
+
+
+class test_plan_batchTestCase(unittest.TestCase):
+
+    def test_threads(self):
+        """并发线程的调用合并为一次batch 每个调用得到自己的结果"""
+        backend = Backend()
+        plan = create_plan(actions=[start])
+        plan.register(get_user, batch=backend, batch_wait=0.05)
+
+        assert run_concurrently(plan, list(range(16))) == [f'user-{i}' for i in range(16)]
+        assert len(backend.batches) < 4
+        assert sorted(sum(backend.batches, [])) == list(range(16))
+
+        metrics = get_batcher(get_user).snapshot()
+        assert metrics['calls'] == 16 and metrics['batches'] == len(backend.batches)
+
+        # 单独的调用等待batch_wait后单独运行
+        assert plan.execute(value=1) == 'user-1'
+        assert backend.batches[-1] == [1]
+
+    def test_size(self):
+        """凑满batch_size时立即运行"""
+        backend = Backend()
+        plan = create_plan(actions=[start])
+        plan.register(lambda user_id: None, batch=backend, batch_size=4, batch_wait=10)
+
+        begin = time.perf_counter()
+        assert run_concurrently(plan, list(range(16))) == [f'user-{i}' for i in range(16)]
+        assert time.perf_counter() - begin < 5
+        assert [len(_) for _ in backend.batches] == [4] * 4
+
+    def test_errors(self):
+        """结果中的异常只由对应的调用抛出 batch的异常由全部调用抛出"""
+        plan = create_plan(actions=[start])
+        plan.register(lambda user_id: None, batch=Backend(), batch_wait=0.05)
+
+        with ThreadPoolExecutor(2) as executor:
+            found = executor.submit(plan.execute, value=1)
+            with self.assertRaises(PlanException) as e:
+                executor.submit(plan.execute, value='missing').result()
+            assert isinstance(e.exception.origin_exception, KeyError)
+            assert found.result() == 'user-1'
+
+        plan = create_plan(actions=[start])
+        plan.register(lambda user_id: None, batch=lambda items: items[1:], batch_wait=0)
+        with self.assertRaises(PlanException) as e:
+            plan.execute(value=1)
+        assert isinstance(e.exception.origin_exception, ValueError)
+
+    def test_item(self):
+        """item为唯一的参数 或者关键字参数字典"""
+        assert make_item((1,), {}) == 1
+        assert make_item((), {'a': 1, 'result_mapper': None}) == {'a': 1}
+        assert make_item((1,), {'a': 1}) == ((1,), {'a': 1})
+
+        plan = create_plan(actions=[start])
+        plan.register(lambda **kwargs: None, batch=lambda items: [_['value'] * 2 for _ in items])
+        assert plan.execute(value=2) == 4
+
+    def test_limit(self):
+        """同时给定concurrency时 限制batch调用而不是合并前的调用"""
+        backend = Backend(0.05)
+        plan = create_plan(actions=[start])
+        plan.register(lambda user_id: None, batch=backend, batch_size=4, batch_wait=0.05, concurrency=1)
+
+        assert run_concurrently(plan, list(range(8))) == [f'user-{i}' for i in range(8)]
+        assert sum(len(_) for _ in backend.batches) == 8
+        assert max(len(_) for _ in backend.batches) == 4
+
+    def test_async(self):
+        """同一事件循环中的协程调用合并 取消的调用不影响其他调用"""
+        backend = Backend()
+        plan = create_plan(actions=[start])
+        plan.register(aget_user, batch=backend.run, batch_wait=0.02)
+
+        async def main():
+            results = await asyncio.gather(*[plan.aexecute(value=i) for i in range(20)])
+
+            tasks = [asyncio.ensure_future(plan.aexecute(value=i)) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks[0].cancel()
+            return results, await asyncio.gather(*tasks, return_exceptions=True)
+
+        results, rest = asyncio.run(main())
+        assert results == [f'user-{i}' for i in range(20)]
+        assert backend.batches[0] == list(range(20))
+        assert isinstance(rest[0], asyncio.CancelledError)
+        assert rest[1:] == ['user-1', 'user-2']
+
+        # 同步的batch函数在线程池中运行
+        async def aget(user_id):
+            pass
+
+        sync_backend = Backend()
+        plan = create_plan(actions=[start])
+        plan.register(aget, batch=sync_backend, batch_wait=0.02)
+
+        async def run_sync_batch():
+            return await asyncio.gather(*[plan.aexecute(value=i) for i in range(5)])
+
+        assert asyncio.run(run_sync_batch()) == [f'user-{i}' for i in range(5)]
+        assert len(sync_backend.batches) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
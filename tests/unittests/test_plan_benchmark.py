@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+import unittest
+
+from planner.benchmark import run_benchmarks, compare, main
+
+
+class test_plan_benchmarkTestCase(unittest.TestCase):
+
+    def test_run(self):
+        """结果可以序列化为JSON"""
+        results = run_benchmarks('dispatch', quick=True, repeat=1, min_time=0.001)
+
+        assert {'dispatch.raw_call', 'dispatch.execute.var_keyword', 'dispatch.single.nested_plan'} <= set(
+            results['results'])
+        assert all(_['ns'] > 0 for _ in results['results'].values())
+        assert json.loads(json.dumps(results)) == results
+
+    def test_compare(self):
+        """超过阈值的变慢视为回归"""
+        base = {'results': {'a': {'ns': 100.0}, 'b': {'ns': 100.0}, 'c': {'ns': 100.0}}}
+        new = {'results': {'a': {'ns': 105.0}, 'b': {'ns': 130.0}, 'd': {'ns': 1.0}}}
+
+        rows = compare(base, new, threshold=0.1)
+
+        assert [(_['name'], _['regression']) for _ in rows] == [('a', False), ('b', True)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, content in (('base', base), ('new', new)):
+                paths.append(os.path.join(directory, f'{name}.json'))
+                with open(paths[-1], 'w') as f:
+                    json.dump(content, f)
+
+            assert main(['compare', *paths]) == 1
+            assert main(['compare', *paths, '--threshold', '0.5']) == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
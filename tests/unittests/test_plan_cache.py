@@ -0,0 +1,132 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from planner import create_plan
+from planner.cache import LRU
+from planner.serialize import dumps, loads
+
+
+def start(**kwargs):
+    return kwargs['result']
+
+
+class test_plan_cacheTestCase(unittest.TestCase):
+
+    def test_positional(self):
+        """以上一个结果为键 命中时仍然记录结果"""
+        calls = []
+        cache = LRU(maxsize=2)
+
+        def score(x):
+            calls.append(x)
+            return x * 2
+
+        plan = create_plan(actions=[start])
+        plan.register(score, cache=cache)
+        plan.register(lambda **kwargs: kwargs['result_mapper']['score'])
+
+        assert [plan.execute(result=_) for _ in (1, 1, 2, 3, 1)] == [2, 2, 4, 6, 2]
+        assert calls == [1, 2, 3, 1]
+        assert plan.get_results()['score'] == 2
+        assert cache.stats() == {'hits': 1, 'misses': 4, 'evictions': 2, 'uncacheable': 0, 'size': 2}
+
+    def test_keyword(self):
+        """不定参数action以执行参数与result为键"""
+        calls = []
+
+        def lookup(**kwargs):
+            calls.append(kwargs['name'])
+            return kwargs['name'].upper()
+
+        plan = create_plan()
+        plan.register(lookup, cache=LRU())
+
+        assert [plan.execute(name=_) for _ in 'aab'] == ['A', 'A', 'B']
+        assert calls == ['a', 'b']
+
+    def test_ttl(self):
+        """过期的结果被移除"""
+        cache = LRU(ttl=0.05)
+        plan = create_plan()
+        plan.register(lambda: time.perf_counter(), cache=cache)
+
+        first = plan.execute()
+        assert plan.execute() == first
+        time.sleep(0.1)
+        assert plan.execute() != first
+        assert cache.evictions == 1
+
+    def test_unhashable(self):
+        """参数不可哈希时直接调用 可以给定key函数"""
+        plan = create_plan(actions=[start])
+        plan.register(lambda x: sum(x), cache=LRU())
+        plan.execute(result=[1, 2])
+
+        cache = plan.get_options(plan.actions[1])['cache']
+        assert cache.uncacheable == 1 and not len(cache)
+
+        keyed = LRU(key=lambda x: tuple(x))
+        plan = create_plan(actions=[start])
+        plan.register(lambda x: sum(x), cache=keyed)
+
+        assert plan.execute(result=[1, 2]) == plan.execute(result=[1, 2]) == 3
+        assert keyed.hits == 1
+
+    def test_plan_and_async(self):
+        """嵌套的Plan与协程函数"""
+        calls = []
+        inner = create_plan('Inner')
+        inner.register(lambda **kwargs: calls.append(1) or kwargs['n'])
+
+        outer = create_plan()
+        outer.register(inner, cache=LRU())
+        assert outer.execute(n=1) == outer.execute(n=1) == 1
+        assert calls == [1]
+
+        async def fetch(x):
+            calls.append(x)
+            return x
+
+        plan = create_plan(actions=[start])
+        plan.register(fetch, cache=LRU())
+        assert asyncio.run(plan.aexecute(result=2)) == asyncio.run(plan.aexecute(result=2)) == 2
+        assert calls == [1, 2]
+
+    def test_recompile(self):
+        """重新编译(包装的调用目标变化)后仍然命中"""
+        calls = []
+        cache = LRU()
+        plan = create_plan(actions=[start])
+        plan.register(lambda x: calls.append(x) or x, cache=cache, timeout=5)
+
+        assert plan.execute(result=1) == 1
+        plan.actions = list(plan.actions)
+        assert plan.execute(result=1) == 1
+
+        assert calls == [1] and cache.misses == 1 and len(cache) == 1
+
+    def test_threads(self):
+        """多线程同时使用"""
+        cache = LRU(maxsize=8)
+        plan = create_plan(actions=[start])
+        plan.register(lambda x: x % 10, cache=cache)
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: plan.execute(result=_), range(1000)))
+
+        assert results == [_ % 10 for _ in range(1000)]
+        assert cache.hits + cache.misses == 1000 and len(cache) == 8
+
+    def test_serialize(self):
+        """序列化时只保留配置"""
+        cache = LRU(maxsize=4, ttl=1)
+        cache.set('key', 1)
+
+        copied = loads(dumps(cache))
+        assert (copied.maxsize, copied.ttl, len(copied)) == (4, 1, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
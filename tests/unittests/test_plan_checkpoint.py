@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from planner import create_plan
+from planner.control import branch
+from planner.checkpoint import DirectoryCheckpointStore, SQLiteCheckpointStore
+from planner.engine import DAG
+from planner.error import PlanException
+
+
+class JsonSerializer(object):
+
+    def dumps(self, value):
+        return json.dumps(value).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class test_plan_checkpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_plan(self, store, calls, fail):
+        def first(**kwargs):
+            calls.append('first')
+            return {'pass': True, 'result': kwargs['start'] + 1, 'offset': 10}
+
+        def second(**kwargs):
+            calls.append('second')
+            return kwargs['result'] * 2
+
+        def third(**kwargs):
+            calls.append('third')
+            if fail:
+                raise ValueError('third')
+            return kwargs['result_mapper']['second'] + kwargs['offset']
+
+        inner = create_plan('Inner', actions=[second, third])
+        return create_plan('Nightly', actions=[first, inner], checkpoint_store=store)
+
+    def check_resume(self, store):
+        calls = []
+        plan = self.make_plan(store, calls, True)
+
+        with self.assertRaises(PlanException) as e:
+            plan.execute(start=1)
+
+        assert calls == ['first', 'second', 'third']
+        execution_id = e.exception.execution_id
+        assert execution_id
+
+        # 恢复执行: 已完成的action不再运行 结果与特殊返回值被恢复
+        calls.clear()
+        plan = self.make_plan(store, calls, False)
+
+        assert plan.execute(resume=execution_id) == 14
+        assert calls == ['third']
+
+        # 成功后删除检查点
+        assert store.load('Nightly', execution_id) == {}
+
+    def test_directory(self):
+        self.check_resume(DirectoryCheckpointStore(self.directory.name))
+
+    def test_sqlite(self):
+        store = SQLiteCheckpointStore(os.path.join(self.directory.name, 'checkpoints.db'))
+        try:
+            self.check_resume(store)
+        finally:
+            store.close()
+
+    def test_branch(self):
+        """Branch的结果(包含create_plan创建的Plan)被保存 恢复时不再选择分支"""
+        store = DirectoryCheckpointStore(self.directory.name)
+        calls = []
+
+        def make_plan(fail):
+            def choose(result):
+                calls.append('choose')
+                return result > 0
+
+            def last(result):
+                if fail:
+                    raise ValueError('last')
+                return result * 10
+
+            positive = create_plan('Pos', actions=[lambda **kwargs: kwargs['result'] + 1])
+            negative = create_plan('Neg', actions=[lambda **kwargs: kwargs['result'] - 1])
+            return create_plan('Branching', actions=[lambda **kwargs: kwargs['start'],
+                                                     branch((choose, positive), default=negative), last],
+                               checkpoint_store=store)
+
+        with self.assertRaises(PlanException) as e:
+            make_plan(True).execute(start=1)
+
+        assert make_plan(False).execute(resume=e.exception.execution_id) == 20
+        assert calls == ['choose']
+
+    def test_many_and_async(self):
+        """execute_many与aexecute同样保存检查点"""
+        store = DirectoryCheckpointStore(self.directory.name)
+        calls = []
+
+        error, = self.make_plan(store, calls, True).execute_many([{'start': 1}], errors='yield')
+        assert error.execution_id and calls == ['first', 'second', 'third']
+
+        calls.clear()
+        plan = self.make_plan(store, calls, False)
+        assert asyncio.run(plan.aexecute(resume=error.execution_id)) == 14
+        assert calls == ['third']
+
+        with self.assertRaises(PlanException) as e:
+            asyncio.run(self.make_plan(store, calls, True).aexecute(start=1))
+        assert store.load('Nightly', e.exception.execution_id)
+
+    def test_serializer(self):
+        """序列化方式可以替换"""
+        store = DirectoryCheckpointStore(self.directory.name, JsonSerializer())
+        store.save('Plan', 'id', '0/1', {'a': [1, 2]})
+
+        assert store.load('Plan', 'id') == {'0/1': {'a': [1, 2]}}
+        with open(os.path.join(self.directory.name, 'Plan', 'id', '0-1'), 'rb') as f:
+            assert json.loads(f.read()) == {'a': [1, 2]}
+
+    def test_no_store(self):
+        with self.assertRaises(ValueError):
+            create_plan(actions=[lambda: 1]).execute(resume='id')
+
+        # 只支持linear模式
+        store = DirectoryCheckpointStore(self.directory.name)
+        plan = create_plan(actions=[lambda: 1], mode=DAG, checkpoint_store=store)
+        with self.assertRaises(ValueError):
+            plan.execute()
+        with self.assertRaises(ValueError):
+            asyncio.run(plan.aexecute())
+        with self.assertRaises(ValueError):
+            plan.execute_many([{}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+
+from planner import Plan, create_plan
+from planner.checkpoint import DirectoryCheckpointStore
+from planner.error import PlanException
+from planner.history import HistoryRecorder
+from planner.incremental import IncrementalStore
+from planner.profiling import Profiler
+from planner.core import NO_ARGUMENT, POSITIONAL, VAR_KEYWORD, PLAN
+
+
+def invalid_action(a, b):
+    pass
+
+
+class test_plan_compileTestCase(unittest.TestCase):
+
+    def test_dispatch_kind(self):
+        """每个action的调用方式在编译时确定"""
+        inner_plan = create_plan('inner_plan')
+
+        plan = create_plan(actions=[
+            lambda: 1,
+            lambda x: x,
+            lambda **kwargs: kwargs['result'],
+            inner_plan,
+        ])
+
+        assert [spec.kind for spec in plan.compile()] == [NO_ARGUMENT, POSITIONAL, VAR_KEYWORD, PLAN]
+
+    def test_compile_cached(self):
+        """编译结果会被缓存"""
+        plan = create_plan(actions=[lambda: 1])
+
+        assert plan.compile() is plan.compile()
+
+    def test_invalidate(self):
+        """actions变化后重新编译"""
+        plan = create_plan(actions=[lambda: 1])
+
+        with self.subTest('register'):
+            specs = plan.compile()
+            plan.register(lambda: 2)
+
+            assert plan.compile() is not specs
+            assert len(plan.compile()) == 2
+            assert plan.execute() == 2
+
+        with self.subTest('modify actions'):
+            plan.actions.append(lambda: 3)
+
+            assert plan.execute() == 3
+
+        with self.subTest('replace actions'):
+            plan.actions = [lambda: 4]
+
+            assert len(plan.compile()) == 1
+            assert plan.execute() == 4
+
+    def test_invalidate_per_plan(self):
+        """只有actions变化的Plan(以及展开了它的Plan)重新编译"""
+        inner = create_plan('inner', actions=[lambda: 1])
+        plan = create_plan(actions=[inner])
+        specs, instructions = plan.compile(), plan.instructions()
+
+        create_plan(actions=[lambda: 2]).actions.append(lambda: 3)
+        assert plan.compile() is specs and plan.instructions() is instructions
+
+        inner.actions.append(lambda: 4)
+        assert plan.compile() is specs and plan.instructions() is not instructions
+        assert plan.execute() == 4
+
+    def test_standalone_options(self):
+        """带检查点/增量执行/统计/记录的Plan嵌套时不展开 这些功能仍然生效"""
+        calls = []
+
+        def action(**kwargs):
+            calls.append(kwargs['value'])
+            if kwargs['value'] < 0:
+                raise ValueError(kwargs['value'])
+            return kwargs['value']
+
+        def nest(**options):
+            calls.clear()
+            outer = create_plan('Outer', actions=[create_plan('Inner', actions=[action], **options)])
+
+            assert outer.compile()[0].kind == VAR_KEYWORD
+            assert outer.execute(value=1) == outer.execute(value=1) == 1
+            return outer
+
+        assert create_plan(actions=[create_plan('Inner')]).compile()[0].kind == PLAN
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.subTest('checkpoint_store'):
+                outer = nest(checkpoint_store=DirectoryCheckpointStore(directory))
+                with self.assertRaises(PlanException) as context:
+                    outer.execute(value=-1)
+                assert context.exception.execution_id
+
+            with self.subTest('incremental_store'):
+                store = IncrementalStore()
+                nest(incremental_store=store)
+                assert calls == [1] and store.hits == 1
+
+            with self.subTest('profiler'):
+                profiler = Profiler()
+                nest(profiler=profiler)
+                assert profiler.executions == 2
+
+            with self.subTest('recorder'):
+                recorder = HistoryRecorder(os.path.join(directory, 'history.sqlite3'))
+                nest(recorder=recorder)
+                recorder.close()
+                assert recorder.written == 2
+
+    def test_reject_invalid_signature(self):
+        """不支持的参数形式在注册时即被拒绝"""
+        plan = create_plan()
+
+        with self.subTest('register'):
+            with self.assertRaises(TypeError):
+                plan.register(invalid_action)
+
+            assert not plan.actions
+
+        with self.subTest('create_plan'):
+            with self.assertRaises(TypeError):
+                create_plan(actions=[invalid_action])
+
+        with self.subTest('class definition'):
+            with self.assertRaises(TypeError):
+                class InvalidPlan(Plan):
+                    actions = [lambda *args: None]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import asyncio
+import unittest
+
+from planner import create_plan, Stop, Skip, Branch, branch
+from planner.store import NullResultStore
+from planner.error import PlanException
+from planner.incremental import IncrementalStore
+
+
+class test_plan_controlTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def action(self, name, value=None):
+        """记录调用 返回value(为None时返回result)"""
+        def action(**kwargs):
+            self.calls.append(name)
+            result = value(kwargs['result']) if callable(value) else value
+            return kwargs['result'] if result is None else result
+
+        action.__name__ = name
+        return action
+
+    def test_stop(self):
+        """结束当前的Plan 之后的action不运行"""
+        plan = create_plan(actions=[
+            self.action('a'),
+            self.action('guard', lambda result: Stop(-1) if result < 0 else None),
+            self.action('b', lambda result: result * 10),
+        ])
+
+        assert plan.execute(result=2) == 20
+        assert self.calls == ['a', 'guard', 'b']
+
+        self.calls.clear()
+        assert plan.execute(result=-2) == -1
+        assert self.calls == ['a', 'guard']
+
+    def test_stop_nested(self):
+        """内层Plan结束时外层继续运行 levels控制结束的层数"""
+        def make(levels):
+            inner = create_plan('Inner', actions=[
+                self.action('guard', lambda result: Stop('stopped', levels)), self.action('inner')])
+            middle = create_plan('Middle', actions=[self.action('start'), inner, self.action('middle')])
+            return create_plan('Outer', actions=[self.action('start'), middle, self.action('outer', lambda r: r + '!')])
+
+        assert make(1).execute(result='x') == 'stopped!'
+        assert self.calls == ['start', 'start', 'guard', 'middle', 'outer']
+
+        self.calls.clear()
+        assert make(2).execute(result='x') == 'stopped!'
+        assert self.calls == ['start', 'start', 'guard', 'outer']
+
+        self.calls.clear()
+        assert make(None).execute(result='x') == 'stopped'
+        assert self.calls == ['start', 'start', 'guard']
+
+        # 超过嵌套的层数
+        self.calls.clear()
+        assert make(10).execute(result='x') == 'stopped'
+
+        with self.assertRaises(ValueError):
+            Stop(levels=0)
+
+    def test_skip(self):
+        """跳过之后的action 嵌套的Plan算作一个"""
+        inner = create_plan('Inner', actions=[self.action('inner1'), self.action('inner2')])
+        plan = create_plan(actions=[
+            self.action('start'),
+            self.action('skip', lambda result: Skip(2, result + 1)),
+            inner,
+            self.action('b'),
+            self.action('c', lambda result: result * 10),
+        ])
+
+        assert plan.execute(result=1) == 20
+        assert self.calls == ['start', 'skip', 'c']
+
+        # 超过剩余的数量: 只结束当前的Plan
+        self.calls.clear()
+        inner = create_plan('Inner', actions=[self.action('skip', lambda result: Skip(5, 'v')), self.action('x')])
+        plan = create_plan(actions=[self.action('start'), inner, self.action('after')])
+        assert plan.execute(result=1) == 'v'
+        assert self.calls == ['start', 'skip', 'after']
+
+        # 不跳过
+        self.calls.clear()
+        plan = create_plan(actions=[self.action('skip', lambda result: Skip(0, 3)), self.action('after')])
+        assert plan.execute() == 3
+        assert self.calls == ['skip', 'after']
+
+    def test_branch(self):
+        """按result选择分支 分支的结果作为此action的结果"""
+        positive = create_plan('Positive', actions=[self.action('positive', lambda result: 'positive')])
+        negative = create_plan('Negative', actions=[self.action('negative', lambda result: 'negative')])
+        zero = create_plan('Zero', actions=[self.action('zero', lambda result: 'zero')])
+
+        def report(**kwargs):
+            return kwargs['result'], sorted(kwargs['result_mapper'])
+
+        plan = create_plan(actions=[
+            self.action('start'),
+            branch((lambda result: result > 0, positive), (lambda result: result < 0, negative), default=zero),
+            report,
+        ])
+
+        assert plan.execute(result=1) == ('positive', ['Positive', 'start'])
+        assert plan.execute(result=-1)[0] == 'negative'
+        assert plan.execute(result=0)[0] == 'zero'
+        assert self.calls == ['start', 'positive', 'start', 'negative', 'start', 'zero']
+
+        # 没有默认的分支: result不变
+        plan = create_plan(actions=[self.action('start'), branch((lambda result: False, positive))])
+        assert plan.execute(result=5) == 5
+
+        # DAG模式的Plan作为一个action运行
+        dag = create_plan('Dag', actions=[self.action('dag', lambda result: 'dag')], mode='dag')
+        plan = create_plan(actions=[self.action('start'), lambda: Branch(dag)])
+        assert plan.execute(result=1) == 'dag'
+
+    def test_branch_error(self):
+        """分支中的异常包含分支的路径"""
+        def fail(**kwargs):
+            raise ValueError(kwargs['result'])
+
+        failing = create_plan('Failing', actions=[fail])
+        plan = create_plan('Outer', actions=[self.action('start'), branch((lambda result: True, failing))])
+
+        with self.assertRaises(PlanException) as context:
+            plan.execute(result=1)
+
+        message = str(context.exception)
+        assert '-->  [2] (Function) branch' in message
+        assert '-->  [1] (Function) fail' in message
+
+    def test_async(self):
+        """异步运行"""
+        async def guard(**kwargs):
+            return Stop(kwargs['result'] * 2)
+
+        plan = create_plan(actions=[self.action('start'), guard, self.action('after')])
+        assert asyncio.run(plan.aexecute(result=2)) == 4
+        assert self.calls == ['start']
+
+    def test_dag(self):
+        """DAG模式不支持"""
+        plan = create_plan(actions=[lambda: Stop(1)], mode='dag')
+
+        with self.assertRaises(PlanException) as context:
+            plan.execute()
+        assert isinstance(context.exception.origin_exception, ValueError)
+        assert 'only supported in linear mode' in str(context.exception.origin_exception)
+
+    def test_stream(self):
+        """流模式不支持: 数据源与之后的阶段"""
+        def inc(x):
+            return x + 1
+
+        for actions in ([lambda: [1, 2], lambda x: Stop(x), inc], [lambda: Skip(1), inc],
+                        [lambda: iter([1, Branch(create_plan())]), inc]):
+            plan = create_plan(actions=actions, mode='stream')
+
+            with self.assertRaises(PlanException) as context:
+                plan.execute()
+            assert isinstance(context.exception.origin_exception, ValueError)
+            assert 'only supported in linear mode' in str(context.exception.origin_exception)
+
+    def test_null_store(self):
+        """不记录结果时同样可以使用Branch"""
+        inner = create_plan('Inner', actions=[self.action('inner', lambda result: result * 2)])
+        plan = create_plan(actions=[branch((lambda result: True, inner))], result_store=NullResultStore())
+
+        assert plan.execute(result=2) == 4
+
+    def test_incremental(self):
+        """增量执行时复用的控制结果同样生效"""
+        plan = create_plan(actions=[
+            self.action('start'),
+            self.action('guard', lambda result: Skip(1, result)),
+            self.action('skipped'),
+            self.action('after', lambda result: result + 1),
+        ], incremental_store=IncrementalStore())
+
+        assert plan.execute(result=1) == 2
+        assert plan.execute(result=1) == 2
+        assert self.calls == ['start', 'guard', 'after']
+
+    def test_single(self):
+        """单个action"""
+        plan = create_plan(actions=[])
+        assert plan.execute_single_actions(lambda: Stop(3), None, {}) == 3
+        assert plan.execute_single_actions(lambda x: Skip(1, x), 4, {}) == 4
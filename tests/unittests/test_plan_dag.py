@@ -0,0 +1,133 @@
+import gc
+import time
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+
+
+def load_a():
+    time.sleep(0.2)
+    return 1
+
+
+def load_b():
+    time.sleep(0.2)
+    return 2
+
+
+def total(load_a, load_b):
+    return load_a + load_b
+
+
+def error_action():
+    raise ValueError('error')
+
+
+class test_plan_dagTestCase(unittest.TestCase):
+
+    def test_concurrent(self):
+        """没有依赖关系的action并发执行"""
+        plan = create_plan(mode='dag', actions=[load_a, load_b, total])
+
+        s = time.perf_counter()
+        assert plan.execute() == 3
+        assert time.perf_counter() - s < 0.35
+
+        assert plan.get_results() == {'load_a': 1, 'load_b': 2, 'total': 3}
+
+    def test_infer_depends(self):
+        """根据参数推断依赖"""
+        plan = create_plan(mode='dag', actions=[load_a, load_b, total, lambda x: x * 2, lambda **kwargs: kwargs])
+
+        nodes = plan.graph()
+
+        assert [node.depends for node in nodes] == [(), (), (0, 1), (2,), (0, 1, 2, 3)]
+
+        result = plan.execute(ident=1)
+
+        assert result['result'] == 6
+        assert result['ident'] == 1
+        assert result['result_mapper']['total'] == 3
+
+    def test_explicit_depends(self):
+        """注册时给定依赖"""
+        plan = create_plan(mode='dag')
+
+        plan.register(load_a)
+        plan.register(load_b)
+        plan.register(lambda **kwargs: kwargs['result_mapper']['load_a'], depends=['load_a'])
+
+        assert plan.graph()[-1].depends == (0,)
+        assert plan.execute() == 1
+
+        with self.subTest('unknown depends'):
+            with self.assertRaises(TypeError):
+                plan.register(lambda: None, depends=['unknown'])
+
+    def test_named_parameters_only_in_dag(self):
+        """多个位置参数仅在DAG模式下可用"""
+        with self.assertRaises(TypeError):
+            create_plan(actions=[load_a, load_b, total])
+
+    def test_nested(self):
+        """DAG模式的Plan嵌套在线性Plan中"""
+        inner_plan = create_plan('inner_plan', mode='dag', actions=[load_a, load_b, total])
+        plan = create_plan(actions=[inner_plan, lambda x: x + 1])
+
+        assert plan.execute() == 4
+
+    def test_error(self):
+        """失败时取消尚未开始的action 异常指向失败的action"""
+        called = []
+
+        def after_b(load_b):
+            called.append(load_b)
+
+        plan = create_plan('dag_plan', mode='dag', actions=[load_b, error_action, after_b])
+
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+
+        assert [flag for flag, _ in e.exception.trace[0]] == [False, True, False]
+        assert 'raise ValueError' in str(e.exception)
+
+        time.sleep(0.3)
+        assert not called
+
+    def test_error_waits_running(self):
+        """失败时已开始的action结束后才抛出异常"""
+        finished = []
+
+        def slow():
+            time.sleep(0.1)
+            finished.append(True)
+
+        def fail():
+            time.sleep(0.01)
+            raise ValueError('error')
+
+        plan = create_plan(mode='dag', actions=[slow, fail])
+
+        with self.assertRaises(PlanException):
+            plan.execute()
+        assert finished == [True]
+
+    def test_executor_shutdown(self):
+        """Plan被回收时关闭其线程池"""
+        plan = create_plan(mode='dag', actions=[load_a])
+        plan.max_workers = 1
+        plan.execute()
+
+        executor = plan._dag_executor
+        threads = list(executor._threads)
+        del plan
+        gc.collect()
+
+        for thread in threads:
+            thread.join(1)
+        assert executor._shutdown and not any(_.is_alive() for _ in threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
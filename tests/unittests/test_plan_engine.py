@@ -0,0 +1,74 @@
+import sys
+import unittest
+
+from planner import Plan, create_plan
+from planner.engine import CALL, ENTER, EXIT
+from planner.error import PlanException
+
+
+def error_action():
+    raise ValueError('error')
+
+
+class OverriddenPlan(Plan):
+    actions = [lambda **kwargs: kwargs['result'] + 1]
+
+    @classmethod
+    def execute(cls, **execute_parameter):
+        return super().execute(**execute_parameter) * 10
+
+
+class test_plan_engineTestCase(unittest.TestCase):
+
+    def test_flatten(self):
+        """嵌套的Plan被展开为扁平的指令流"""
+        inner_plan = create_plan('inner_plan', actions=[lambda: 1])
+        plan = create_plan(actions=[lambda: 0, inner_plan, lambda x: x])
+
+        assert [_[0] for _ in plan.instructions()] == [CALL, ENTER, CALL, EXIT, CALL]
+        assert plan.execute() == 1
+
+        with self.subTest('invalidate'):
+            inner_plan.register(lambda: 2)
+
+            assert [_[0] for _ in plan.instructions()] == [CALL, ENTER, CALL, CALL, EXIT, CALL]
+            assert plan.execute() == 2
+
+    def test_deep_nesting(self):
+        """嵌套深度不受递归深度限制"""
+        plan = create_plan(actions=[lambda **kwargs: kwargs['result'] + 1])
+
+        for _ in range(sys.getrecursionlimit() + 100):
+            plan = create_plan(actions=[plan])
+
+        assert plan.execute(result=1) == 2
+
+    def test_contains_itself(self):
+        """Plan包含自身"""
+        plan = create_plan()
+        plan.register(create_plan(actions=[plan]))
+
+        with self.assertRaises(RecursionError):
+            plan.execute()
+
+    def test_overridden_execute(self):
+        """重写了execute的Plan不会被展开"""
+        plan = create_plan(actions=[lambda: 1, OverriddenPlan])
+
+        assert plan.execute() == 20
+
+    def test_trace_with_same_bytecode(self):
+        """异常路径按序号定位 不受相同字节码影响"""
+        inner_plan = create_plan('inner_plan', actions=[error_action])
+        plan = create_plan(actions=[lambda: None, lambda: None, inner_plan])
+
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+
+        assert [[flag for flag, _ in level] for level in e.exception.trace] == [[False, False, True], [True]]
+        assert e.exception.origin_plan is inner_plan
+        assert 'raise ValueError' in str(e.exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
+from unittest import mock
 
 from planner import create_plan
+from planner.error import PlanException
 
 
 def empty():
@@ -67,6 +69,56 @@ class TestPlanErrorTestCase(unittest.TestCase):
 
         print(e.exception)
 
+    def test_lazy_format(self):
+        """捕获异常时不格式化 只记录每一层出错action的序号"""
+        inner_plan = create_plan('inner_plan', actions=[empty, normal_error])
+        plan = create_plan('plan', actions=[empty, inner_plan])
+
+        with mock.patch('planner.error.get_action_name') as get_action_name, \
+                mock.patch('planner.error.linecache') as linecache:
+            with self.assertRaises(PlanException) as e:
+                plan.execute()
+
+            assert not get_action_name.called and not linecache.getlines.called
+
+        # 路径在首次访问时生成
+        assert e.exception._levels is None
+        assert e.exception.action_path == (('plan', 1), ('inner_plan', 1))
+        assert 'normal_error' in str(e.exception)
+
+    def test_identical_code(self):
+        """字节码相同的action 指向实际出错的action"""
+        plan = create_plan()
+
+        def divide(value):
+            return lambda: 1 / value
+
+        for value in (1, 0, 2):
+            plan.register(divide(value))
+
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+
+        assert e.exception.action_path[-1][1] == 1
+        assert [_[0] for _ in e.exception.trace[0]] == [False, True, False]
+
+    def test_deprecated_trace(self):
+        """已废弃的add_origin_exception/add_plan_exception仍然可用"""
+        inner_plan = create_plan('inner_plan', actions=[empty, normal_error])
+        plan = create_plan('plan', actions=[inner_plan])
+
+        try:
+            normal_error()
+        except KeyError as e:
+            exception = PlanException(e, inner_plan, origin_action=normal_error)
+
+        with self.assertWarns(DeprecationWarning):
+            exception.add_origin_exception(inner_plan, exception.origin_exception)
+        with self.assertWarns(DeprecationWarning):
+            exception.add_plan_exception(plan, exception)
+
+        assert exception.action_path == (('plan', 0), ('inner_plan', 1))
+
 
 if __name__ == '__main__':
     unittest.main()
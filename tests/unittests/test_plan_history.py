@@ -0,0 +1,162 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from planner import create_plan
+from planner.engine import DAG
+from planner.error import PlanException
+from planner.history import HistoryRecorder, History, ACTION, PLAN, main, parse_time
+
+
+def start(**kwargs):
+    return kwargs.get('value', [1, 2, 3])
+
+
+def slow(result):
+    time.sleep(0.005)
+    return result
+
+
+def fail(**kwargs):
+    if kwargs.get('fail'):
+        raise KeyError('fail')
+    return 'ok'
+
+
+class test_plan_historyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record(self):
+        """每次执行与其中每个action(包括嵌套Plan)的耗时与结果长度"""
+        inner = create_plan('Inner', actions=[start, slow])
+        plan = create_plan('Outer', actions=[start, inner, lambda x: x])
+        plan.recorder = HistoryRecorder(self.path)
+
+        for _ in range(5):
+            assert plan.execute() == [1, 2, 3]
+        plan.recorder.close()
+        assert plan.recorder.written == 5
+
+        history = History(self.path)
+        rows = {_['path']: _ for _ in history.percentiles()}
+        assert sorted(rows) == ['Outer', 'Outer/[1] start', 'Outer/[2] Inner', 'Outer/[2] Inner/[1] start',
+                                'Outer/[2] Inner/[2] slow', 'Outer/[3] <lambda>']
+        assert rows['Outer']['kind'] == PLAN and rows['Outer/[2] Inner']['kind'] == ACTION
+        assert all(_['count'] == 5 and _['mean_result_size'] == 3 for _ in rows.values())
+        assert rows['Outer/[2] Inner/[2] slow']['p50_ms'] >= 4
+        assert history.plans() == ['Outer']
+
+        assert history.slowest(1)[0]['path'] in ('Outer/[2] Inner', 'Outer/[2] Inner/[2] slow')
+        assert [_['path'] for _ in history.critical_path('Outer')] == [
+            'Outer', 'Outer/[2] Inner', 'Outer/[2] Inner/[2] slow']
+        assert [_['depth'] for _ in history.breakdown('Outer')] == [0, 1, 1, 2, 2, 1]
+
+        # 时间范围
+        assert history.percentiles(since='1h') and not history.percentiles(until=time.time() - 3600)
+        with self.assertRaises(ValueError):
+            history.slowest(by='p42_ms')
+
+    def test_failures(self):
+        """失败的执行记录异常类型 按时间窗口统计失败率"""
+        plan = create_plan('Failing', actions=[start, fail])
+        plan.recorder = HistoryRecorder(self.path, flush_interval=0.01)
+
+        for i in range(4):
+            try:
+                plan.execute(fail=i % 2)
+            except PlanException:
+                pass
+        plan.recorder.close()
+
+        history = History(self.path)
+        rows = history.failures(window=86400)
+        assert len(rows) == 1 and rows[0]['count'] == 4 and rows[0]['failure_rate'] == 0.5
+
+        actions = {_['path']: _ for _ in history.failures(window=86400, kind=ACTION)}
+        assert actions['Failing/[2] fail']['errors'] == 2 and actions['Failing/[1] start']['errors'] == 0
+
+        errors = [_[5] for _ in history.records(kind=PLAN)]
+        assert errors == [None, 'PlanException', None, 'PlanException']
+
+    def test_sample(self):
+        """抽样 以及DAG模式与嵌套在action中的执行"""
+        plan = create_plan('Sampled', actions=[start, slow], mode=DAG)
+        plan.recorder = HistoryRecorder(self.path, sample=2)
+
+        outer = create_plan('Runner', actions=[lambda: plan.execute()])
+        for _ in range(4):
+            outer.execute()
+        plan.recorder.close()
+
+        rows = {_['path']: _['count'] for _ in History(self.path).percentiles()}
+        assert rows == {'Sampled': 2, 'Sampled/[1] start': 2, 'Sampled/[2] slow': 2}
+
+    def test_many_and_async(self):
+        """execute_many与aexecute的每次执行同样被记录"""
+        plan = create_plan('Many', actions=[start, slow])
+        plan.recorder = HistoryRecorder(self.path)
+
+        assert list(plan.execute_many([{}, {'value': [1]}])) == [[1, 2, 3], [1]]
+        assert asyncio.run(plan.aexecute()) == [1, 2, 3]
+        plan.recorder.close()
+
+        rows = {_['path']: _ for _ in History(self.path).percentiles()}
+        assert rows['Many']['count'] == 3 and rows['Many/[2] slow']['count'] == 3
+
+    def test_readonly(self):
+        """查询不创建数据库文件"""
+        history = History(self.path)
+        with self.assertRaises(FileNotFoundError):
+            history.plans()
+        assert not os.path.exists(self.path)
+
+        plan = create_plan('Readonly', actions=[start])
+        plan.recorder = HistoryRecorder(self.path)
+        plan.execute()
+        plan.recorder.close()
+
+        os.chmod(self.path, 0o444)
+        assert history.plans() == ['Readonly']
+
+    def test_parse_time(self):
+        now = 1_000_000.0
+        assert parse_time('30m', now) == now - 1800
+        assert parse_time('1.5h', now) == now - 5400
+        assert parse_time(now) == now
+        assert parse_time(datetime.fromtimestamp(now)) == now
+        assert parse_time(datetime.fromtimestamp(now).isoformat()) == now
+
+    def test_cli(self):
+        """命令行输出表格或者JSON"""
+        plan = create_plan('Cli', actions=[start, slow])
+        plan.recorder = HistoryRecorder(self.path)
+        plan.execute()
+        plan.recorder.close()
+
+        for command in (['percentiles'], ['slowest', '--limit', '1'], ['failures', '--window', '1d'],
+                        ['critical-path', '--plan', 'Cli']):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                main(['--db', self.path] + command)
+            assert 'Cli' in output.getvalue() or '[2] slow' in output.getvalue()
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(['--db', self.path, '--json', 'percentiles', '--kind', 'plan'])
+        assert [_['path'] for _ in json.loads(output.getvalue())] == ['Cli']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import asyncio
+import time
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+from planner.hooks import subscribe, unsubscribe, subscribers, LatencyAggregator, LatencyHistogram, PLAN_START, \
+    PLAN_END, ACTION_START, ACTION_END, ACTION_ERROR
+
+
+def parse(x):
+    return x
+
+
+def error_action():
+    raise ValueError('error')
+
+
+class test_plan_hooksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        subscribe(self.events.append)
+
+    def tearDown(self):
+        unsubscribe(self.events.append)
+        assert not subscribers
+
+    def kinds(self):
+        return [(_.kind, _.path) for _ in self.events]
+
+    def test_events(self):
+        """Plan与action的开始/结束事件 带有嵌套路径"""
+        inner = create_plan('Inner', actions=[parse])
+        outer = create_plan('Outer', actions=[lambda: 1, inner])
+
+        outer.execute()
+        assert self.kinds() == [
+            (PLAN_START, 'Outer'),
+            (ACTION_START, 'Outer/[1] <lambda>'),
+            (ACTION_END, 'Outer/[1] <lambda>'),
+            (ACTION_START, 'Outer/[2] Inner'),
+            (PLAN_START, 'Outer/[2] Inner'),
+            (ACTION_START, 'Outer/[2] Inner/[1] parse'),
+            (ACTION_END, 'Outer/[2] Inner/[1] parse'),
+            (PLAN_END, 'Outer/[2] Inner'),
+            (ACTION_END, 'Outer/[2] Inner'),
+            (PLAN_END, 'Outer'),
+        ]
+
+        start, end = self.events[1], self.events[2]
+        assert end.time_ns - start.time_ns == end.duration_ns >= 0
+        assert end.result == 1
+
+    def test_error_events(self):
+        """出错时由内向外结束每一层"""
+        inner = create_plan('Inner', actions=[error_action])
+        outer = create_plan('Outer', actions=[inner])
+
+        with self.assertRaises(PlanException):
+            outer.execute()
+
+        assert self.kinds()[-4:] == [
+            (ACTION_ERROR, 'Outer/[1] Inner/[1] error_action'),
+            (PLAN_END, 'Outer/[1] Inner'),
+            (ACTION_ERROR, 'Outer/[1] Inner'),
+            (PLAN_END, 'Outer'),
+        ]
+        assert all(isinstance(_.error, ValueError) for _ in self.events[-4:])
+
+    def test_plan_in_action(self):
+        """action中运行的Plan 以action的路径作为前缀"""
+        inner = create_plan('Inner', actions=[parse])
+        outer = create_plan('Outer', actions=[lambda: inner.execute()])
+
+        outer.execute()
+
+        assert (PLAN_START, 'Outer/[1] <lambda>') in self.kinds()
+        assert (ACTION_END, 'Outer/[1] <lambda>/[1] parse') in self.kinds()
+
+    def test_async_and_dag(self):
+        """异步执行与DAG模式同样发送事件"""
+
+        async def fetch():
+            return 1
+
+        plan = create_plan('Async', actions=[fetch])
+        asyncio.run(plan.aexecute())
+
+        dag = create_plan('Dag', mode='dag', actions=[lambda: 1, lambda: 2])
+        dag.execute()
+
+        paths = [_[1] for _ in self.kinds() if _[0] == ACTION_END]
+        assert paths[0] == 'Async/[1] fetch'
+        assert sorted(paths[1:]) == ['Dag/[1] <lambda>', 'Dag/[2] <lambda>']
+
+    def test_failing_hook(self):
+        """订阅者抛出的异常不影响执行"""
+
+        def hook(event):
+            raise RuntimeError('hook')
+
+        subscribe(hook)
+        try:
+            with self.assertLogs('planner.hooks'):
+                assert create_plan(actions=[lambda: 1]).execute() == 1
+        finally:
+            unsubscribe(hook)
+
+    def test_no_sleep(self):
+        """打印信息时不再等待"""
+        plan = create_plan(actions=[lambda: 1] * 5, is_output=True, delay=1)
+        plan.output = classmethod(lambda cls, content: None)
+
+        start = time.perf_counter()
+        plan.execute()
+        assert time.perf_counter() - start < 0.5
+
+
+class test_plan_latencyTestCase(unittest.TestCase):
+
+    def test_histogram(self):
+        """分位数的相对误差在桶宽度之内"""
+        histogram = LatencyHistogram()
+        for value in range(1, 10001):
+            histogram.record(value * 1000)
+
+        assert histogram.count == 10000
+        for q in (50, 95, 99):
+            assert abs(histogram.percentile(q) / (q * 100000) - 1) < 0.05
+
+    def test_aggregator(self):
+        """按action统计调用次数与出错次数"""
+        plan = create_plan('Metrics', actions=[parse])
+        failed = create_plan('Failed', actions=[error_action])
+
+        aggregator = LatencyAggregator().attach()
+        try:
+            for _ in range(3):
+                plan.execute()
+            with self.assertRaises(PlanException):
+                failed.execute()
+        finally:
+            aggregator.detach()
+
+        snapshot = aggregator.snapshot()
+        assert snapshot['Metrics/[1] parse']['count'] == 3
+        assert snapshot['Failed/[1] error_action']['errors'] == 1
+        assert {'p50_ms', 'p95_ms', 'p99_ms'} <= set(snapshot['Metrics/[1] parse'])
+
+        assert 'planner_action_seconds_count{action="Metrics/[1] parse"} 3' in aggregator.render()
+
+        by_name = LatencyAggregator(by='name').attach()
+        try:
+            plan.execute()
+        finally:
+            by_name.detach()
+
+        assert list(by_name.snapshot()) == ['Metrics.parse']
+
+
+if __name__ == '__main__':
+    unittest.main()
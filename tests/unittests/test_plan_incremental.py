@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import unittest
+
+from planner import create_plan
+from planner.engine import DAG
+from planner.incremental import IncrementalStore
+
+calls = []
+"""运行过的action"""
+
+
+def make(n):
+    def multiply(**kwargs):
+        calls.append(n)
+        return kwargs['value'] * n
+
+    return multiply
+
+
+class test_plan_incrementalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def make_plan(self, store, **options):
+        def load(**kwargs):
+            calls.append('load')
+            return kwargs['path'].upper()
+
+        def parse(text):
+            calls.append('parse')
+            return text.split('/')
+
+        def report(**kwargs):
+            calls.append('report')
+            return len(kwargs['result_mapper']['parse']) + kwargs['extra']
+
+        plan = create_plan(incremental_store=store)
+        plan.register(load, reads=['path'])
+        plan.register(parse, **options)
+        plan.register(report)
+
+        return plan
+
+    def test_incremental(self):
+        """只运行输入变化的action"""
+        store = IncrementalStore()
+        plan = self.make_plan(store)
+
+        assert plan.execute(path='a/b', extra=0) == 2
+        assert calls == ['load', 'parse', 'report']
+
+        # 输入不变: 全部复用 结果仍然被记录
+        calls.clear()
+        assert plan.execute(path='a/b', extra=0) == 2
+        assert calls == []
+        assert plan.get_results()['parse'] == ['A', 'B']
+
+        # load未读取extra: 只有report重新运行
+        calls.clear()
+        assert plan.execute(path='a/b', extra=1) == 3
+        assert calls == ['report']
+
+        # path变化: 全部重新运行
+        calls.clear()
+        assert plan.execute(path='a/b/c', extra=1) == 4
+        assert calls == ['load', 'parse', 'report']
+
+    def test_impure(self):
+        """impure的action总是运行 结果相同时下游仍然复用"""
+        plan = self.make_plan(IncrementalStore(), impure=True)
+
+        plan.execute(path='a/b', extra=0)
+        calls.clear()
+
+        plan.execute(path='a/b', extra=0)
+        assert calls == ['parse']
+
+    def test_nested(self):
+        """嵌套的Plan"""
+        inner = create_plan('Inner', actions=[lambda **kwargs: calls.append(kwargs['result']) or kwargs['result']])
+        plan = create_plan(incremental_store=IncrementalStore(), actions=[lambda **kwargs: kwargs['n'], inner])
+
+        assert plan.execute(n=1) == plan.execute(n=1) == 1
+        assert plan.execute(n=2) == 2
+        assert calls == [1, 2]
+
+    def test_closure(self):
+        """替换为字节码相同的action时不复用 同一个action的可变状态不参与指纹"""
+        plan = create_plan(incremental_store=IncrementalStore(), actions=[make(1)])
+        assert plan.execute(value=2) == 2
+
+        plan.actions[0] = make(2)
+        assert plan.execute(value=2) == plan.execute(value=2) == 4
+        assert calls == [1, 2]
+
+        # 闭包中的计数与不能序列化的对象
+        counter, lock = [], threading.Lock()
+
+        def count(**kwargs):
+            with lock:
+                counter.append(kwargs['value'])
+            return len(counter)
+
+        plan.actions[0] = count
+        assert plan.execute(value=2) == plan.execute(value=2) == 1
+
+        # 依赖可变状态的action注册为impure
+        plan = create_plan(incremental_store=IncrementalStore())
+        plan.register(count, impure=True)
+        assert plan.execute(value=2) == 2 and plan.execute(value=2) == 3
+
+    def test_bound_method(self):
+        """绑定的对象不序列化"""
+        class Table(object):
+            def __init__(self):
+                self.rows = list(range(200000))
+
+            def lookup(self, **kwargs):
+                calls.append('lookup')
+                return self.rows[kwargs['value']]
+
+        plan = create_plan(incremental_store=IncrementalStore(), actions=[Table().lookup])
+        assert plan.execute(value=3) == plan.execute(value=3) == 3
+        assert calls == ['lookup']
+
+    def test_many_and_async(self):
+        """execute_many与aexecute同样复用结果"""
+        store = IncrementalStore()
+        plan = self.make_plan(store)
+
+        assert list(plan.execute_many([{'path': 'a/b', 'extra': 0}] * 3)) == [2, 2, 2]
+        assert calls == ['load', 'parse', 'report']
+
+        async def aload(**kwargs):
+            calls.append('aload')
+            return kwargs['path']
+
+        plan = create_plan(incremental_store=store, actions=[aload, lambda x: x.upper()])
+        calls.clear()
+        assert asyncio.run(plan.aexecute(path='a')) == asyncio.run(plan.aexecute(path='a')) == 'A'
+        assert calls == ['aload']
+
+    def test_linear_only(self):
+        """只支持linear模式"""
+        plan = create_plan(incremental_store=IncrementalStore(), actions=[lambda: 1], mode=DAG)
+
+        with self.assertRaises(ValueError):
+            plan.execute()
+        with self.assertRaises(ValueError):
+            asyncio.run(plan.aexecute())
+        with self.assertRaises(ValueError):
+            plan.execute_many([{}])
+
+    def test_eviction(self):
+        """存储有上限"""
+        store = IncrementalStore(maxsize=2)
+        plan = create_plan(incremental_store=store, actions=[lambda **kwargs: kwargs['n']])
+
+        for n in range(5):
+            plan.execute(n=n)
+
+        assert len(store) == 2 and store.evictions == 3
+        assert plan.execute(n=4) == 4 and store.hits == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from planner import create_plan
+from planner.hooks import ACTION_WAIT, subscribe, unsubscribe
+from planner.limits import get_limiter, stats, summary
+
+
+class Counter(object):
+    """记录同时运行的最大数量"""
+
+    def __init__(self, sleep=0.02):
+        self.sleep = sleep
+        self.running = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            self.running += 1
+            self.max = max(self.max, self.running)
+
+    def exit(self):
+        with self.lock:
+            self.running -= 1
+
+    def __call__(self, **kwargs):
+        self.enter()
+        time.sleep(self.sleep)
+        self.exit()
+        return kwargs.get('result')
+
+    async def run(self, **kwargs):
+        self.enter()
+        await asyncio.sleep(self.sleep)
+        self.exit()
+        return kwargs.get('result')
+
+
+def start(**kwargs):
+    return kwargs.get('value')
+
+
+class test_plan_limitsTestCase(unittest.TestCase):
+
+    def test_concurrency(self):
+        """所有线程共用并发限制 等待时间与运行时间分别统计"""
+        counter = Counter()
+        plan = create_plan(actions=[start])
+        plan.register(counter, concurrency=2)
+
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(lambda i: plan.execute(value=i), range(32)))
+
+        assert results == list(range(32))
+        assert counter.max == 2
+
+        limiter = get_limiter(counter)
+        metrics = limiter.snapshot()
+        assert metrics['calls'] == 32
+        assert metrics['waited'] > 0 and metrics['max_queued'] > 0
+        assert metrics['active'] == 0 and metrics['queued'] == 0
+        assert metrics['run_p50_ms'] >= 15
+        assert metrics['wait_max_ms'] > metrics['run_max_ms']
+        assert any(_ is metrics or _['calls'] == 32 for _ in stats().values())
+        assert summary().splitlines()[0].endswith('limit')
+
+    def test_shared_between_plans(self):
+        """同一个action在不同Plan与嵌套Plan中共用限制 重入的调用不死锁"""
+        counter = Counter()
+        inner = create_plan('Inner', actions=[start])
+        inner.register(counter, concurrency=1)
+        outer = create_plan('Outer', actions=[start, inner])
+        outer.register(counter, concurrency=1)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda i: (outer if i % 2 else inner).execute(value=i), range(16)))
+
+        assert counter.max == 1
+        assert get_limiter(counter).snapshot()['calls'] == 24
+
+        with self.assertRaises(ValueError):
+            create_plan().register(counter, concurrency=2)
+
+        def reenter(**kwargs):
+            if kwargs['result']:
+                return reentrant.execute(value=kwargs['result'] - 1)
+            return 'done'
+
+        reentrant = create_plan(actions=[start])
+        reentrant.register(reenter, concurrency=1)
+        assert reentrant.execute(value=2) == 'done'
+
+    def test_group(self):
+        """limit给定的名称在多个action之间共用"""
+        counter = Counter()
+        plan = create_plan(actions=[start])
+        plan.register(lambda **kwargs: counter(**kwargs), limit='test_group', concurrency=1)
+        plan.register(lambda **kwargs: counter(**kwargs), limit='test_group')
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda i: plan.execute(value=i), range(8)))
+
+        assert counter.max == 1
+        assert stats()['test_group']['calls'] == 16
+
+        with self.assertRaises(ValueError):
+            create_plan().register(start, limit='test_undefined')
+
+    def test_rate(self):
+        """速率限制: 允许次数以内的突发 之后按间隔运行"""
+        plan = create_plan(actions=[start])
+        plan.register(lambda **kwargs: kwargs['result'], rate=(2, 0.2))
+
+        begin = time.perf_counter()
+        assert [plan.execute(value=i) for i in range(6)] == list(range(6))
+        assert 0.35 < time.perf_counter() - begin < 1
+
+    def test_wait_event(self):
+        """等待过的调用发送action_wait事件 路径为等待的action"""
+        events = []
+        subscribe(events.append, [ACTION_WAIT])
+        try:
+            counter = Counter(0.05)
+            plan = create_plan('Waiting', actions=[start])
+            plan.register(counter, concurrency=1)
+
+            with ThreadPoolExecutor(2) as executor:
+                list(executor.map(lambda i: plan.execute(value=i), range(2)))
+        finally:
+            unsubscribe(events.append)
+
+        assert len(events) == 1
+        assert events[0].path.startswith('Waiting/[2] ')
+        assert events[0].plan is None
+        assert events[0].duration_ns > 30e6
+
+    def test_async(self):
+        """协程action排队时不阻塞事件循环 取消的调用归还名额"""
+        counter = Counter()
+        plan = create_plan(actions=[start])
+        plan.register(counter.run, concurrency=2)
+
+        async def main():
+            results = await asyncio.gather(*[plan.aexecute(value=i) for i in range(8)])
+
+            slow = create_plan(actions=[start])
+            slow.register(Counter(1).run, concurrency=1)
+            tasks = [asyncio.ensure_future(slow.aexecute(value=i)) for i in range(3)]
+            await asyncio.sleep(0.05)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            return results, get_limiter(slow.compile()[1].action).snapshot()
+
+        results, metrics = asyncio.run(main())
+        assert results == list(range(8))
+        assert counter.max == 2
+        assert metrics['active'] == 0 and metrics['queued'] == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
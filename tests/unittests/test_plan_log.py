@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+import unittest
+
+from planner import create_plan, log
+from planner.log import OutputRecord, OutputWriter, MAX_RESULT_LENGTH, START, DONE, flush, summarize
+
+
+def start(**kwargs):
+    """开始"""
+    return kwargs.get('value')
+
+
+class Collect(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class test_plan_logTestCase(unittest.TestCase):
+
+    def test_background(self):
+        """输出在后台线程中写出 文本与原来相同"""
+        outputs = []
+        plan = create_plan('Output', actions=[start, lambda x: x + 1], is_output=True)
+        plan.output = classmethod(lambda cls, content: outputs.append((threading.get_ident(), str(content))))
+
+        assert plan.execute(value=1) == 2
+        assert flush(1)
+
+        assert len(outputs) == 4
+        assert all(ident != threading.get_ident() for ident, _ in outputs)
+        assert outputs[0][1] == f'- Start action: start --> {start}\n- Doc: 开始'
+        lines = outputs[3][1].splitlines()
+        assert lines[0] == '- Done.' and lines[1].startswith('- Time cost: ')
+        assert lines[2:] == ['- action result:2', '-' * 80]
+
+    def test_structured(self):
+        """写入logger时带有结构化的字段 结果被截断"""
+        handler = Collect()
+        logger = logging.getLogger('Structured')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            inner = create_plan('Inner', actions=[start, lambda x: list(range(x))])
+            plan = create_plan('Structured', actions=[start, inner], is_output=True)
+            plan.execute(value=10000)
+            assert flush(1)
+        finally:
+            logger.removeHandler(handler)
+
+        # 只输出is_output的Plan中的action
+        assert [_.event for _ in handler.records] == [START, DONE, START, DONE]
+        assert handler.records[2].action_path == 'Structured/[2] Inner'
+        done = handler.records[3]
+        assert done.plan == 'Structured' and done.action == 'Inner' and done.duration_ns > 0
+        assert len(done.result_summary) <= MAX_RESULT_LENGTH
+        assert done.getMessage().endswith('-' * 80)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork is not available')
+    def test_fork(self):
+        """fork的子进程中重新创建后台线程"""
+        plan = create_plan('Forked', actions=[start], is_output=True)
+        plan.output = classmethod(lambda cls, content: cls.pipe and os.write(cls.pipe, str(content).encode() + b'\n'))
+        plan.pipe = None
+
+        plan.execute(value=1)
+        assert flush(1)
+        parent = log.get_writer()
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                plan.pipe = write
+                plan.execute(value=2)
+                code = 0 if flush(1) and log.get_writer() is not parent else 1
+            finally:
+                os._exit(code)
+
+        os.close(write)
+        _, status = os.waitpid(pid, 0)
+        with os.fdopen(read) as f:
+            output = f.read()
+
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert output.startswith('- Start action: start') and '- action result:2' in output
+
+    def test_summarize(self):
+        """repr截断 失败时不抛出异常"""
+        class Broken(object):
+            def __repr__(self):
+                raise RuntimeError('broken')
+
+        assert summarize('x' * 1000).endswith('...')
+        assert len(summarize(list(range(100000)))) <= MAX_RESULT_LENGTH
+        assert 'Broken' in summarize(Broken())
+
+    def test_full(self):
+        """队列满时丢弃新的记录 不阻塞"""
+        slow = create_plan('Slow', actions=[start])
+        slow.output = classmethod(lambda cls, content: time.sleep(0.05))
+        spec = slow.compile()[0]
+        writer = OutputWriter(maxsize=1)
+
+        try:
+            begin = time.perf_counter()
+            accepted = [writer.submit(OutputRecord(START, slow, spec, 'Slow/[1] start')) for _ in range(10)]
+            assert time.perf_counter() - begin < 0.05
+            assert not all(accepted) and writer.dropped == accepted.count(False)
+
+            # 队列一直满时不逐条警告 flush时警告一次
+            with self.assertLogs('planner.log', 'WARNING') as logs:
+                for _ in range(20):
+                    writer.submit(OutputRecord(START, slow, spec, 'Slow/[1] start'))
+                    time.sleep(0.01)
+                assert writer.flush(2)
+
+            assert len(logs.output) == 1
+            assert logs.output[0].endswith(f':{writer.dropped} output records dropped: queue is full.')
+        finally:
+            writer.close(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
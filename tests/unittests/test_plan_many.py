@@ -0,0 +1,69 @@
+import types
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+
+
+def check_value(**kwargs):
+    if kwargs['value'] < 0:
+        raise ValueError('negative value')
+    return kwargs['value']
+
+
+class test_plan_manyTestCase(unittest.TestCase):
+
+    def test_execute_many(self):
+        """逐个返回结果"""
+        plan = create_plan(actions=[check_value, create_plan(actions=[lambda **kwargs: kwargs['result'] * 2])])
+
+        results = plan.execute_many({'value': _} for _ in range(5))
+
+        assert isinstance(results, types.GeneratorType)
+        assert list(results) == [0, 2, 4, 6, 8]
+
+    def test_lazy(self):
+        """惰性运行: 不会提前读取输入"""
+        consumed = []
+
+        def parameters():
+            for _ in range(3):
+                consumed.append(_)
+                yield {'value': _}
+
+        results = create_plan(actions=[check_value]).execute_many(parameters())
+
+        assert next(results) == 0
+        assert consumed == [0]
+
+    def test_errors(self):
+        """单个输入失败时的处理"""
+        plan = create_plan(actions=[check_value])
+        parameters = [{'value': 1}, {'value': -1}, {'value': 2}]
+
+        with self.subTest('raise'):
+            with self.assertRaises(PlanException):
+                list(plan.execute_many(parameters))
+
+        with self.subTest('skip'):
+            assert list(plan.execute_many(parameters, errors='skip')) == [1, 2]
+
+        with self.subTest('yield'):
+            results = list(plan.execute_many(parameters, errors='yield'))
+
+            assert results[0] == 1 and results[2] == 2
+            assert isinstance(results[1], PlanException)
+
+        with self.subTest('unknown'):
+            with self.assertRaises(ValueError):
+                plan.execute_many(parameters, errors='ignore')
+
+    def test_dag(self):
+        """DAG模式"""
+        plan = create_plan(mode='dag', actions=[check_value, lambda x: x + 1])
+
+        assert list(plan.execute_many({'value': _} for _ in range(3))) == [1, 2, 3]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+from planner.serialize import dumps, loads
+
+
+def square(**kwargs):
+    return kwargs['value'] ** 2
+
+
+def check_value(x):
+    if x == 9:
+        raise ValueError('value error')
+    return x
+
+
+def closure_plan():
+    offset = 1
+    return create_plan('closure_plan', actions=[lambda **kwargs: kwargs['value'] + offset])
+
+
+class test_plan_mapTestCase(unittest.TestCase):
+
+    def test_serialize(self):
+        """lambda与create_plan创建的Plan按值序列化"""
+        plan = create_plan('outer', actions=[closure_plan(), lambda x: x * 2], custom=1)
+
+        loaded = loads(dumps(plan))
+
+        assert loaded is not plan
+        assert loaded.__name__ == 'outer'
+        assert loaded.custom == 1
+        assert loaded.execute(value=1) == plan.execute(value=1) == 4
+
+    def test_map(self):
+        """按输入顺序返回结果"""
+        plan = create_plan(actions=[square, lambda x: x + 1])
+
+        results = list(plan.map([{'value': _} for _ in range(20)], workers=2, chunksize=3))
+
+        assert results == [_ ** 2 + 1 for _ in range(20)]
+
+    def test_map_unordered(self):
+        """按完成顺序返回(输入序号, 结果)"""
+        plan = closure_plan()
+
+        results = sorted(plan.map([{'value': _} for _ in range(10)], workers=2, chunksize=4, ordered=False))
+
+        assert results == [(_, _ + 1) for _ in range(10)]
+
+        # chunksize小于1时按1处理 序号不变
+        results = sorted(plan.map([{'value': _} for _ in range(5)], workers=2, chunksize=0, ordered=False))
+        assert results == [(_, _ + 1) for _ in range(5)]
+
+    def test_map_error(self):
+        """工作进程中的异常与本地运行的异常信息相同"""
+        plan = create_plan('error_plan', actions=[square, check_value])
+
+        with self.assertRaises(PlanException) as local:
+            plan.execute(value=3)
+
+        with self.assertRaises(PlanException) as remote:
+            list(plan.map([{'value': _} for _ in range(5)], workers=2))
+
+        assert str(remote.exception) == str(local.exception)
+        assert isinstance(remote.exception.origin_exception, ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from collections.abc import Mapping
 
 from planner import Plan, create_plan
 
@@ -25,7 +26,7 @@ class test_plan_parameterTestCase(unittest.TestCase):
 
         action_mapper = NormalPlan.execute()
 
-        assert isinstance(action_mapper, dict)
+        assert isinstance(action_mapper, Mapping)
         assert action_mapper.get('Ins')
         assert action_mapper.get('Ins') is ins
 
@@ -33,7 +34,7 @@ class test_plan_parameterTestCase(unittest.TestCase):
 
         action_mapper = normal_plan.execute()
 
-        assert isinstance(action_mapper, dict)
+        assert isinstance(action_mapper, Mapping)
         assert action_mapper.get('Ins')
         assert action_mapper.get('Ins') is ins
 
@@ -50,10 +51,40 @@ class test_plan_parameterTestCase(unittest.TestCase):
         assert level_1.execute()
         action_mapper = level_2.execute()
 
-        assert isinstance(action_mapper, dict)
+        assert isinstance(action_mapper, Mapping)
         assert action_mapper.get('Ins')
         assert action_mapper.get('Ins') is ins
 
+    def test_mapper_views(self):
+        """result_mapper与action_mapper是只读的分层视图"""
+        mappers = []
+
+        def collect(**kwargs):
+            mappers.append((kwargs['result_mapper'], kwargs['action_mapper']))
+            return len(mappers)
+
+        inner_plan = create_plan('inner_plan', actions=[collect, collect])
+        plan = create_plan(actions=[collect, inner_plan])
+
+        plan.execute()
+
+        outer_results, outer_actions = mappers[0]
+        inner_results, inner_actions = mappers[2]
+
+        with self.subTest('no copy'):
+            assert mappers[1][0] is inner_results
+
+        with self.subTest('layered'):
+            assert inner_results['collect'] == 3
+            assert outer_results['collect'] == 1
+            assert outer_results['inner_plan'] == 3
+            assert inner_actions['inner_plan'] is inner_plan
+            assert 'inner_plan' not in outer_actions or outer_actions['inner_plan'] is inner_plan
+
+        with self.subTest('read only'):
+            with self.assertRaises(TypeError):
+                inner_results['collect'] = 0
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from planner import create_plan, hooks
+from planner.profiling import Profiler
+
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+class test_plan_profilingTestCase(unittest.TestCase):
+
+    def make_plan(self, profiler=None):
+        def start(**kwargs):
+            return kwargs['size']
+
+        def parse(size):
+            busy(0.02)
+            return size
+
+        def allocate(**kwargs):
+            return bytearray(kwargs['result'])
+
+        inner = create_plan('Inner', actions=[start, parse, allocate])
+        return create_plan('Outer', actions=[start, inner], profiler=profiler)
+
+    def test_profile(self):
+        """按嵌套路径统计 内层Plan的自身时间不包括内层action"""
+        profiler = Profiler(memory=True)
+        plan = self.make_plan(profiler)
+
+        assert len(plan.execute(size=1 << 20)) == 1 << 20
+        assert not hooks.subscribers
+
+        profiles = profiler.snapshot()
+        assert set(profiles) == {'Outer/[1] start', 'Outer/[2] Inner', 'Outer/[2] Inner/[1] start',
+                                 'Outer/[2] Inner/[2] parse', 'Outer/[2] Inner/[3] allocate'}
+
+        parse = profiles['Outer/[2] Inner/[2] parse']
+        inner = profiles['Outer/[2] Inner']
+        assert parse['calls'] == 1
+        assert parse['self_cpu'] >= 15_000_000
+        assert inner['cpu'] >= parse['cpu']
+        assert inner['self_cpu'] < parse['self_cpu']
+        assert profiles['Outer/[2] Inner/[3] allocate']['self_memory'] >= 1 << 20
+
+        collapsed = profiler.collapsed().splitlines()
+        assert any(line.startswith('Outer;[2] Inner;[2] parse ') for line in collapsed)
+        assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in collapsed)
+
+        summary = profiler.summary().splitlines()
+        assert summary[1].endswith('Outer/[2] Inner/[2] parse')
+        assert summary[1:] == sorted(summary[1:], key=lambda _: -float(_.split()[1]))
+        assert profiler.summary('memory', limit=1).splitlines()[1].endswith('allocate')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plan.folded')
+            profiler.write(path)
+            with open(path) as f:
+                assert f.read().splitlines() == collapsed
+
+    def test_sample(self):
+        """每N次执行抽样统计1次"""
+        profiler = Profiler(sample=3)
+        plan = self.make_plan(profiler)
+
+        for _ in range(7):
+            plan.execute(size=1)
+
+        assert profiler.executions == 3
+        assert profiler.snapshot()['Outer/[2] Inner/[2] parse']['calls'] == 3
+
+    def test_many_and_async(self):
+        """execute_many的每个输入与aexecute同样被抽样统计"""
+        profiler = Profiler(sample=2)
+        plan = self.make_plan(profiler)
+
+        assert len(list(plan.execute_many([{'size': 1}] * 4))) == 4
+        assert profiler.executions == 2
+
+        async def main():
+            return await asyncio.gather(*[plan.aexecute(size=1) for _ in range(4)])
+
+        asyncio.run(main())
+        assert profiler.executions == 4
+        assert profiler.snapshot()['Outer/[2] Inner/[2] parse']['calls'] == 4
+        assert not hooks.subscribers
+
+    def test_capture(self):
+        """capture之外的执行不被统计"""
+        profiler = Profiler()
+        plan = self.make_plan()
+
+        with profiler.capture():
+            plan.execute(size=1)
+        plan.execute(size=1)
+
+        assert profiler.snapshot()['Outer/[1] start']['calls'] == 1
+
+        profiler.reset()
+        assert profiler.snapshot() == {}
+
+        with self.assertRaises(ValueError):
+            Profiler(sample=0)
+        with self.assertRaises(ValueError):
+            profiler.collapsed('time')
+
+    def test_error(self):
+        """出错的action同样被统计"""
+        def fail(**kwargs):
+            raise ValueError(kwargs)
+
+        profiler = Profiler()
+        plan = create_plan('Failing', actions=[fail], profiler=profiler)
+
+        with self.assertRaises(Exception):
+            plan.execute()
+
+        assert profiler.snapshot()['Failing/[1] fail']['errors'] == 1
@@ -0,0 +1,105 @@
+import gc
+import os
+import sys
+import tempfile
+import unittest
+from importlib.metadata import EntryPoint
+from unittest import mock
+
+from planner import create_plan
+from planner.registry import PlanRegistry
+
+MODULE = '''
+from planner import Plan
+
+
+def double(**kwargs):
+    return kwargs['value'] * 2
+
+
+class LazyPlan(Plan):
+    actions = [double]
+'''
+
+
+class test_plan_registryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.module = f'lazy_plans_{os.getpid()}_{id(self)}'
+        with open(os.path.join(self.directory.name, f'{self.module}.py'), 'w') as f:
+            f.write(MODULE)
+        sys.path.insert(0, self.directory.name)
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        sys.modules.pop(self.module, None)
+        self.directory.cleanup()
+
+    def test_import_path(self):
+        """首次查找时才导入模块"""
+        registry = PlanRegistry(group=None)
+        registry.register('lazy', f'{self.module}:LazyPlan')
+
+        assert self.module not in sys.modules
+        assert 'lazy' in registry
+        assert not registry.loaded('lazy')
+
+        plan = registry.get('lazy')
+        assert self.module in sys.modules
+        assert registry.loaded('lazy')
+        assert plan.execute(value=2) == 4
+        assert registry.get('lazy') is plan
+
+        # 点号分隔的路径
+        registry.register('dotted', f'{self.module}.LazyPlan')
+        assert registry.get('dotted') is plan
+
+    def test_entry_points(self):
+        """入口点组中声明的Plan"""
+        entry_point = EntryPoint('lazy', f'{self.module}:LazyPlan', 'planner.plans')
+
+        with mock.patch('planner.registry.iter_entry_points', return_value=[entry_point]) as entry_points:
+            registry = PlanRegistry()
+            assert registry.names() == ['lazy']
+            assert self.module not in sys.modules
+
+            assert registry.get('lazy').execute(value=3) == 6
+            entry_points.assert_called_once_with('planner.plans')
+
+    def test_defined(self):
+        """已定义的Plan可以按名称查找 不会因此被保留"""
+        registry = PlanRegistry(group=None)
+
+        with mock.patch('planner.core.registry', registry):
+            plan = create_plan(actions=[lambda: 1])
+            name = plan.__name__
+
+        assert registry.get(name) is plan
+
+        # 类对象之间存在循环引用
+        del plan
+        gc.collect()
+        with self.assertRaises(LookupError):
+            registry.get(name)
+
+    def test_errors(self):
+        """名称不存在或者不是Plan"""
+        registry = PlanRegistry(group=None)
+
+        with self.assertRaises(LookupError):
+            registry.get('missing')
+
+        registry.register('double', f'{self.module}:double')
+        with self.assertRaises(TypeError):
+            registry.get('double')
+
+    def test_warm_up(self):
+        """预先导入并编译"""
+        registry = PlanRegistry(group=None)
+        registry.register('lazy', f'{self.module}:LazyPlan')
+
+        plan, = registry.warm_up()
+        assert registry.loaded('lazy')
+        assert plan._compiled[0] is not None
+        assert registry.warm_up(['lazy']) == [plan]
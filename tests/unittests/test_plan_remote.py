@@ -0,0 +1,203 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from planner import Plan, create_plan
+from planner.error import PlanException
+from planner.remote import RemotePlan, WorkerServer, is_local, main, parse_address
+
+AUTHKEY = b'planner-test'
+
+
+def start(**kwargs):
+    return kwargs['result']
+
+
+def square(x):
+    if x < 0:
+        raise ValueError(f'negative: {x}')
+    return x * x
+
+
+def worker_id(**kwargs):
+    return os.getpid(), kwargs['result']
+
+
+def sleep(**kwargs):
+    time.sleep(kwargs['seconds'])
+    return os.getpid()
+
+
+class RemoteSquare(Plan):
+    actions = [start, square]
+
+
+class RemoteWorkerId(Plan):
+    actions = [worker_id]
+
+
+class RemoteSleep(Plan):
+    actions = [sleep]
+
+
+PLANS = {
+    'square': f'{__name__}:RemoteSquare',
+    'worker_id': RemoteWorkerId,
+    'sleep': RemoteSleep,
+}
+
+
+def serve(address, ready):
+    server = WorkerServer(PLANS, address, AUTHKEY)
+    ready.put(server.address)
+    server.serve_forever()
+
+
+class test_plan_remoteTestCase(unittest.TestCase):
+
+    def start_workers(self, addresses):
+        ready = multiprocessing.Queue()
+        workers = []
+        self.processes = []
+
+        for address in addresses:
+            process = multiprocessing.Process(target=serve, args=(address, ready), daemon=True)
+            process.start()
+            self.addCleanup(process.join)
+            self.addCleanup(process.terminate)
+            self.processes.append(process)
+            workers.append(ready.get(timeout=10))
+
+        return workers
+
+    def test_execute(self):
+        """在工作进程中运行 异常带着路径传回"""
+        worker, = self.start_workers([('127.0.0.1', 0)])
+        remote = RemotePlan('square', [worker], AUTHKEY)
+        self.addCleanup(remote.close)
+
+        assert remote.execute(result=3) == 9
+        assert remote.execute(result=4) == 16
+        assert len(remote.workers[0].idle) == 1
+
+        with self.assertRaises(PlanException) as context:
+            remote.execute(result=-1)
+
+        message = str(context.exception)
+        assert 'Message:negative: -1' in message
+        assert '-->  [2] (Function) square' in message
+        assert "raise ValueError(f'negative: {x}')" in message
+        assert isinstance(context.exception.origin_exception, ValueError)
+
+        # 名称不存在
+        with self.assertRaises(LookupError):
+            RemotePlan('missing', [worker], AUTHKEY).execute()
+
+        assert remote.status() == {worker: ['sleep', 'square', 'worker_id']}
+
+    def test_nested(self):
+        """作为本地Plan的action 外层的路径添加在前面"""
+        with tempfile.TemporaryDirectory() as directory:
+            worker, = self.start_workers([os.path.join(directory, 'worker.sock')])
+            remote = RemotePlan('square', [f'unix:{worker}'], AUTHKEY)
+            self.addCleanup(remote.close)
+
+            plan = create_plan('Local', actions=[start, remote, lambda x: x + 1])
+            assert plan.execute(result=5) == 26
+
+            with self.assertRaises(PlanException) as context:
+                plan.execute(result=-2)
+
+            message = str(context.exception)
+            assert '-->  [2] (Other) <RemotePlan square>' in message
+            assert '-->  [2] (Function) square' in message
+            assert message.index('<RemotePlan square>') < message.index('(Function) square')
+
+    def test_load_balance(self):
+        """选择负载最小的工作进程 无法连接的工作进程被跳过"""
+        workers = self.start_workers([('127.0.0.1', 0), ('127.0.0.1', 0)])
+        remote = RemotePlan('sleep', workers, AUTHKEY)
+        self.addCleanup(remote.close)
+
+        # 并发的请求分配到不同的工作进程
+        pids = []
+        threads = [threading.Thread(target=lambda: pids.append(remote.execute(seconds=0.3))) for _ in range(2)]
+        for _ in threads:
+            _.start()
+        for _ in threads:
+            _.join()
+
+        assert len(set(pids)) == 2
+        assert [_.calls for _ in remote.workers] == [1, 1]
+
+        down = RemotePlan('sleep', [('127.0.0.1', 1)] + workers, AUTHKEY)
+        self.addCleanup(down.close)
+
+        assert down.execute(seconds=0) in pids
+        assert down.execute(seconds=0) in pids
+        assert down.workers[0].failures == 1
+        assert down.workers[0].calls == 0
+
+    def test_restart(self):
+        """工作进程重启后 失效的空闲连接被丢弃"""
+        worker, = self.start_workers([('127.0.0.1', 0)])
+        remote = RemotePlan('worker_id', [worker], AUTHKEY)
+        self.addCleanup(remote.close)
+
+        pid, _ = remote.execute(result=1)
+        self.processes[0].terminate()
+        self.processes[0].join()
+
+        assert self.start_workers([worker]) == [worker]
+        restarted, result = remote.execute(result=2)
+        assert restarted != pid and result == 2
+        assert remote.workers[0].failures == 0
+
+    def test_serialize(self):
+        """按值传递lambda与执行参数"""
+        worker, = self.start_workers([('127.0.0.1', 0)])
+        remote = RemotePlan('worker_id', [worker], AUTHKEY)
+        self.addCleanup(remote.close)
+
+        pid, result = remote.execute(result={'f': (1, 2)})
+        assert pid != os.getpid() and result == {'f': (1, 2)}
+
+        # 其他进程中的RemotePlan只保留配置
+        import pickle
+        copied = pickle.loads(pickle.dumps(remote))
+        assert copied.execute(result=1)[1] == 1
+        copied.close()
+
+    def test_parse_address(self):
+        assert parse_address('localhost:9000') == ('localhost', 9000)
+        assert parse_address(':9000') == ('127.0.0.1', 9000)
+        assert parse_address('unix:/tmp/a:1') == '/tmp/a:1'
+        assert parse_address('/tmp/worker.sock') == '/tmp/worker.sock'
+
+    def test_listen(self):
+        """命令行的工作进程没有authkey时只能监听本机的地址"""
+        assert is_local(parse_address('127.0.0.1:9000')) and is_local(parse_address('[::1]:9000'))
+        assert is_local(parse_address('localhost:9000')) and is_local(parse_address('unix:/tmp/worker.sock'))
+        assert not is_local(parse_address('0.0.0.0:9000')) and not is_local(parse_address('example.com:9000'))
+
+        environ = os.environ.pop('PLANNER_AUTHKEY', None)
+        self.addCleanup(lambda: environ is None or os.environ.__setitem__('PLANNER_AUTHKEY', environ))
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            main(['--listen', '0.0.0.0:0', 'square'])
+
+    def test_authkey(self):
+        """密钥不一致时不能连接"""
+        with WorkerServer(PLANS, authkey=AUTHKEY).start() as server:
+            remote = RemotePlan('square', [server.address], b'wrong')
+            with self.assertRaises(Exception):
+                remote.execute(result=1)
+
+            remote = RemotePlan('square', [server.address], AUTHKEY)
+            assert remote.execute(result=2) == 4
+            assert server.requests == 1
+            remote.close()
@@ -0,0 +1,86 @@
+import gc
+import unittest
+import weakref
+
+from planner import create_plan
+from planner.store import ScopedResultStore, RetainedResultStore, NullResultStore
+
+
+class Payload(object):
+    pass
+
+
+def payload():
+    return Payload()
+
+
+def error_action():
+    raise ValueError('error')
+
+
+class test_plan_storeTestCase(unittest.TestCase):
+
+    def test_context_store(self):
+        """默认保留当前上下文中最近一次执行的结果"""
+        plan = create_plan(actions=[lambda: 1])
+        plan.execute()
+
+        assert plan.get_results() == {'<lambda>': 1}
+
+    def test_scoped_store(self):
+        """结果在执行结束后释放"""
+        plan = create_plan(result_store=ScopedResultStore())
+
+        plan.register(payload)
+        plan.register(lambda x: dict(plan.get_results()))
+
+        results = plan.execute()
+
+        assert isinstance(results['payload'], Payload)
+        assert plan.get_results() == {}
+
+        reference = weakref.ref(results.pop('payload'))
+        gc.collect()
+
+        assert reference() is None
+
+        with self.subTest('error'):
+            plan.register(error_action)
+
+            with self.assertRaises(Exception):
+                plan.execute()
+
+            assert plan.get_results() == {}
+
+    def test_retained_store(self):
+        """按策略保留最近的若干次执行"""
+        store = RetainedResultStore(max_executions=2)
+        plan = create_plan('retained', actions=[lambda **kwargs: kwargs['value']], result_store=store)
+
+        for _ in range(5):
+            plan.execute(value=_)
+
+        assert plan.get_results() == {}
+        assert store.history(plan) == [('retained', {'<lambda>': 3}), ('retained', {'<lambda>': 4})]
+
+        with self.subTest('max bytes'):
+            store = RetainedResultStore(max_executions=100, max_bytes=RetainedResultStore.sizeof({'<lambda>': 0}) * 3)
+            plan.result_store = store
+
+            for _ in range(10):
+                plan.execute(value=_)
+
+            assert len(store.history()) == 3
+            assert store.size <= store.max_bytes
+
+    def test_null_store(self):
+        """不记录结果"""
+        plan = create_plan(actions=[lambda: 1, lambda **kwargs: kwargs['result_mapper']],
+                           result_store=NullResultStore())
+
+        assert plan.execute() == {}
+        assert plan.get_results() == {}
+
+
+if __name__ == '__main__':
+    unittest.main()
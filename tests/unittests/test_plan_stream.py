@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException
+
+
+def read(**kwargs):
+    for line in range(kwargs['lines']):
+        yield f'{line},{line * 2}'
+
+
+def parse(line):
+    return tuple(map(int, line.split(',')))
+
+
+def keep_even(row):
+    if row[0] % 2 == 0:
+        yield row
+
+
+def total(**kwargs):
+    return sum(kwargs['result']) + kwargs['offset']
+
+
+class test_plan_streamTestCase(unittest.TestCase):
+
+    def test_stream(self):
+        """逐项运行之后的action 生成器可以过滤"""
+        plan = create_plan(mode='stream', actions=[read, parse, keep_even, total])
+
+        assert list(plan.stream(lines=5, offset=1)) == [1, 7, 13]
+        assert plan.execute(lines=5, offset=0) == 12
+        assert plan.get_results() == {'read': '4,8', 'parse': (4, 8), 'keep_even': (4, 8), 'total': 12}
+
+    def test_buffered(self):
+        """阶段在独立的线程中运行 上游最多领先队列大小"""
+        produced = []
+        threads = set()
+
+        def source():
+            for _ in range(1000):
+                produced.append(_)
+                yield _
+
+        def double(x):
+            threads.add(threading.get_ident())
+            return x * 2
+
+        plan = create_plan(mode='stream', buffer_size=4, actions=[source, double, lambda x: x + 1])
+
+        results = plan.stream()
+        assert next(results) == 1
+        assert len(produced) <= 12
+
+        assert sum(results) == sum(_ * 2 + 1 for _ in range(1, 1000))
+        assert threading.get_ident() not in threads
+
+    def test_stop_early(self):
+        """提前停止时上游随之停止"""
+        produced = []
+
+        def source():
+            for _ in range(10 ** 6):
+                produced.append(_)
+                yield _
+
+        for buffer_size in (0, 2):
+            produced.clear()
+            plan = create_plan(mode='stream', buffer_size=buffer_size, actions=[source, lambda x: x])
+
+            results = plan.stream()
+            assert [next(results) for _ in range(3)] == [0, 1, 2]
+            results.close()
+
+            assert len(produced) < 100
+
+    def test_error(self):
+        """异常指向出错的阶段与项"""
+
+        def check(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        for buffer_size in (0, 2):
+            plan = create_plan('StreamPlan', mode='stream', buffer_size=buffer_size,
+                               actions=[lambda: iter(range(10)), lambda x: x, check])
+
+            with self.assertRaises(PlanException) as e:
+                plan.execute()
+
+            assert e.exception.item == (3, 3)
+            assert e.exception.action_path == (('StreamPlan', 2),)
+            assert isinstance(e.exception.origin_exception, ValueError)
+            assert 'Item [3]: 3' in str(e.exception)
+
+    def test_source_error(self):
+        """数据源出错"""
+
+        def source():
+            yield 1
+            raise ValueError('source')
+
+        plan = create_plan(mode='stream', actions=[source, lambda x: x])
+
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+
+        assert e.exception.item == (1, None) and e.exception.action_path[0][1] == 0
+
+    def test_async_and_many(self):
+        """异步执行与批量执行"""
+        plan = create_plan(mode='stream', actions=[read, parse, keep_even, total])
+
+        assert asyncio.run(plan.aexecute(lines=3, offset=0)) == 6
+        assert list(plan.execute_many([{'lines': 1, 'offset': 0}, {'lines': 3, 'offset': 1}])) == [0, 7]
+
+    def test_not_stream(self):
+        with self.assertRaises(ValueError):
+            create_plan(actions=[read]).stream()
+
+
+if __name__ == '__main__':
+    unittest.main()
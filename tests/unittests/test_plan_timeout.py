@@ -0,0 +1,86 @@
+import asyncio
+import time
+import unittest
+
+from planner import create_plan
+from planner.error import PlanException, ActionTimeout
+
+
+def slow(**kwargs):
+    time.sleep(kwargs.get('sleep', 0.5))
+    return 'slow'
+
+
+class test_plan_timeoutTestCase(unittest.TestCase):
+
+    def test_timeout(self):
+        """超时抛出PlanException 指向超时的action"""
+        inner = create_plan('Inner', actions=[lambda: None])
+        inner.register(slow, timeout=0.05)
+        plan = create_plan('Outer', actions=[lambda: None, inner])
+
+        start = time.perf_counter()
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+
+        assert time.perf_counter() - start < 0.4
+        assert isinstance(e.exception.origin_exception, ActionTimeout)
+        assert e.exception.action_path == (('Outer', 1), ('Inner', 1))
+
+    def test_in_time(self):
+        """未超时时正常返回结果与异常"""
+        plan = create_plan()
+        plan.register(slow, timeout=1)
+        assert plan.execute(sleep=0) == 'slow'
+
+        plan = create_plan()
+        plan.register(lambda: {}[1], timeout=1)
+        with self.assertRaises(PlanException) as e:
+            plan.execute()
+        assert isinstance(e.exception.origin_exception, KeyError)
+
+    def test_hedge(self):
+        """对冲: 第一次调用较慢时 取第二次调用的结果"""
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            time.sleep(0.5 if len(calls) == 1 else 0)
+            return len(calls)
+
+        plan = create_plan()
+        plan.register(flaky, hedge=0.02, timeout=2)
+
+        start = time.perf_counter()
+        assert plan.execute() == 2
+        assert time.perf_counter() - start < 0.3
+
+    def test_hedge_percentile(self):
+        """按已观测耗时的分位数对冲 样本不足时不对冲"""
+        plan = create_plan()
+        plan.register(lambda: 1, hedge='p95')
+
+        for _ in range(30):
+            assert plan.execute() == 1
+
+        with self.assertRaises(ValueError):
+            create_plan().register(lambda: 1, hedge='fast')
+
+    def test_async(self):
+        """协程action的超时与对冲"""
+
+        async def sleep(**kwargs):
+            await asyncio.sleep(kwargs['sleep'])
+            return kwargs['sleep']
+
+        plan = create_plan('Async')
+        plan.register(sleep, timeout=0.05)
+
+        assert asyncio.run(plan.aexecute(sleep=0)) == 0
+        with self.assertRaises(PlanException) as e:
+            asyncio.run(plan.aexecute(sleep=1))
+        assert isinstance(e.exception.origin_exception, ActionTimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import unittest
+from array import array
+
+from planner import create_plan
+from planner.remote import RemotePlan, WorkerServer
+from planner.serialize import loads
+from planner.transport import SharedMemoryTransport, MMAP, is_shared, discard
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def length(**kwargs):
+    return kwargs['result']
+
+
+def invert(data):
+    return bytes(255 - _ for _ in data[:16]) + bytes(data[16:])
+
+
+class test_plan_transportTestCase(unittest.TestCase):
+
+    def payloads(self):
+        return {
+            'bytes': os.urandom(1 << 17),
+            'bytearray': bytearray(os.urandom(1 << 17)),
+            'array': array('d', range(1 << 14)),
+            'memoryview': memoryview(array('i', range(1 << 15))),
+            'small': b'small',
+        }
+
+    def check_round_trip(self, transport):
+        payloads = self.payloads()
+
+        data = transport.dumps(payloads)
+        assert is_shared(data)
+        # 只传递句柄
+        assert len(data) < 4096
+        assert len(transport.pending) == 4
+
+        loaded = loads(data)
+        assert loaded['bytes'] == payloads['bytes'] and type(loaded['bytes']) is bytes
+        assert loaded['bytearray'] == payloads['bytearray'] and type(loaded['bytearray']) is bytearray
+        assert loaded['array'] == payloads['array']
+        assert loaded['memoryview'].format == 'i' and loaded['memoryview'].tolist() == payloads['memoryview'].tolist()
+        assert loaded['small'] == b'small'
+
+        # 读取后已释放: 不能再次读取
+        with self.assertRaises(FileNotFoundError):
+            loads(data)
+
+        # 小的对象不使用共享内存
+        assert not is_shared(transport.dumps({'small': b'small'}))
+
+    def test_shm(self):
+        """共享内存段"""
+        with SharedMemoryTransport() as transport:
+            self.check_round_trip(transport)
+
+    def test_mmap(self):
+        """内存映射文件 关闭时删除临时目录"""
+        transport = SharedMemoryTransport(backend=MMAP)
+        self.check_round_trip(transport)
+
+        directory = transport.directory
+        assert os.listdir(directory) == []
+        transport.close()
+        assert not os.path.exists(directory)
+
+    def test_release(self):
+        """未读取的段在close()或discard时释放"""
+        for backend in ('shm', MMAP):
+            transport = SharedMemoryTransport(backend=backend)
+            data = transport.dumps(os.urandom(1 << 17))
+            transport.close()
+            with self.assertRaises(FileNotFoundError):
+                loads(data)
+
+            transport = SharedMemoryTransport(backend=backend)
+            data = transport.dumps(os.urandom(1 << 17))
+            discard(data)
+            with self.assertRaises(FileNotFoundError):
+                loads(data)
+            transport.close()
+
+        with self.assertRaises(ValueError):
+            SharedMemoryTransport(backend='pipe')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy(self):
+        """NumPy数组以pickle协议5的带外缓冲区传递"""
+        with SharedMemoryTransport(backend=MMAP) as transport:
+            value = numpy.arange(1 << 16, dtype='float64').reshape(256, 256)
+            data = transport.dumps(value)
+            assert is_shared(data)
+            assert (loads(data) == value).all()
+
+    def test_map(self):
+        """进程池中的执行参数与结果"""
+        plan = create_plan(actions=[length, invert])
+        inputs = [{'result': os.urandom(1 << 17)} for _ in range(4)]
+
+        with SharedMemoryTransport() as transport:
+            results = list(plan.map(inputs, workers=2, transport=transport))
+
+        for execute_parameter, result in zip(inputs, results):
+            assert result[16:] == execute_parameter['result'][16:]
+            assert result[:16] == bytes(255 - _ for _ in execute_parameter['result'][:16])
+
+    def test_remote(self):
+        """同一台机器上的工作进程"""
+        plan = create_plan(actions=[length, invert])
+        payload = os.urandom(1 << 17)
+
+        with SharedMemoryTransport() as transport, \
+                WorkerServer({'invert': plan}, transport=transport).start() as server:
+            remote = RemotePlan('invert', [server.address], transport=transport)
+            assert remote.execute(result=payload)[16:] == payload[16:]
+            remote.close()